@@ -0,0 +1,610 @@
+#!/usr/bin/env python3
+"""
+Benchmark and load-test harness for proxy-server.py
+
+Starts the proxy as a subprocess together with a local mock of its upstreams
+(OpenAI chat completions with configurable latency and 429 injection, Google
+Books search, and Firebase token signing keys so /api/library can be
+exercised), generates a synthetic HEIC/JPEG corpus, and drives each endpoint
+at one or more concurrency levels. --seed makes the corpus and the mock's
+latencies and 429s repeatable. Reports throughput, p50/p95/p99 latency and peak RSS of
+the proxy (including its worker processes) and writes everything to a JSON
+results file that later runs can be compared against.
+
+Examples:
+    python benchmark.py
+    python benchmark.py --endpoints openai,convert-heic --concurrency 1,8,32 --requests 200
+    python benchmark.py --output new.json --compare baseline.json
+"""
+
+import argparse
+import base64
+import hashlib
+import http.client
+import http.server
+import io
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+import pillow_heif
+
+pillow_heif.register_heif_opener()
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+PROXY_SCRIPT = os.path.join(REPO_DIR, 'proxy-server.py')
+
+ENDPOINTS = ('static', 'openai', 'openai-image', 'scan-shelf', 'convert-heic', 'convert-heic-direct',
+             'heic-preview', 'convert-heic-batch', 'books-lookup', 'library', 'metrics')
+
+FIREBASE_PROJECT = 'benchmark'
+LIBRARY_USERS = 4
+
+MOCK_REPLY = json.dumps([
+    {"title": "The Left Hand of Darkness", "confidence": "high"},
+    {"title": "Middlemarch", "confidence": "medium"},
+    {"title": "Pale Fire", "confidence": "low"}
+])
+
+
+# ---------------------------------------------------------------------------
+# Mock upstream
+# ---------------------------------------------------------------------------
+
+class MockUpstreamHandler(http.server.BaseHTTPRequestHandler):
+    """Stand-in for OpenAI's /v1/chat/completions (with latency and 429s), Google Books and the Firebase keys"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/books/v1/volumes':
+            query = dict(item.split('=', 1) for item in self.path.split('?', 1)[1].split('&') if '=' in item)
+            payload = json.dumps({'items': [
+                {'id': f'mock{i}', 'volumeInfo': {'title': query.get('q', ''), 'authors': ['Mock Author']}}
+                for i in range(3)
+            ]}).encode()
+        elif path == '/jwks':
+            payload = json.dumps({'keys': [self.server.signing_key.jwk()]}).encode()
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Cache-Control', 'public, max-age=3600')
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        config = self.server.config
+        with self.server.lock:
+            self.server.calls += 1
+            self.server.bytes_received += len(body)
+            latency = max(0.0, self.server.rng.gauss(config['latency'], config['latency_jitter']))
+            rate_limited = self.server.rng.random() < config['rate_429']
+            if rate_limited:
+                self.server.rate_limited += 1
+
+        time.sleep(latency)
+
+        if rate_limited:
+            payload = json.dumps({'error': {'message': 'Rate limit reached (mock)', 'type': 'requests'}}).encode()
+            self.send_response(429)
+            self.send_header('Retry-After', '1')
+        else:
+            payload = json.dumps({
+                'id': 'chatcmpl-mock',
+                'object': 'chat.completion',
+                'model': 'mock',
+                'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': MOCK_REPLY},
+                             'finish_reason': 'stop'}],
+                'usage': {'prompt_tokens': 1000, 'completion_tokens': 40, 'total_tokens': 1040}
+            }).encode()
+            self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_mock_upstream(latency, latency_jitter, rate_429, seed):
+    """Start the mock upstream; its latencies and 429s are drawn from a generator seeded with seed"""
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MockUpstreamHandler)
+    server.daemon_threads = True
+    server.config = {'latency': latency, 'latency_jitter': latency_jitter, 'rate_429': rate_429}
+    server.rng = random.Random(seed)
+    server.signing_key = SigningKey(random.Random(seed))
+    server.lock = threading.Lock()
+    server.calls = 0
+    server.rate_limited = 0
+    server.bytes_received = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class SigningKey:
+    """An RSA key that signs Firebase-style ID tokens, so the proxy's token checks run for real"""
+
+    KID = 'benchmark'
+
+    def __init__(self, rng, bits=1024, e=65537):
+        p = self._prime(rng, bits // 2, e)
+        q = self._prime(rng, bits // 2, e)
+        while q == p:
+            q = self._prime(rng, bits // 2, e)
+        self.n = p * q
+        self.e = e
+        self.d = pow(e, -1, (p - 1) * (q - 1))
+
+    @staticmethod
+    def _prime(rng, bits, e):
+        while True:
+            candidate = rng.getrandbits(bits) | (1 << (bits - 1)) | 1
+            if (candidate - 1) % e and all(candidate % p for p in (3, 5, 7, 11, 13, 17, 19, 23)) \
+                    and all(pow(rng.randrange(2, candidate - 1), candidate - 1, candidate) == 1 for _ in range(20)):
+                return candidate
+
+    def jwk(self):
+        return {'kty': 'RSA', 'alg': 'RS256', 'use': 'sig', 'kid': self.KID,
+                'n': b64url(self.n.to_bytes((self.n.bit_length() + 7) // 8, 'big')),
+                'e': b64url(self.e.to_bytes(3, 'big'))}
+
+    def id_token(self, uid, lifetime=3600):
+        now = int(time.time())
+        claims = {'iss': f'https://securetoken.google.com/{FIREBASE_PROJECT}', 'aud': FIREBASE_PROJECT,
+                  'sub': uid, 'iat': now, 'auth_time': now, 'exp': now + lifetime}
+        signing_input = (b64url(json.dumps({'alg': 'RS256', 'kid': self.KID}).encode()) + '.' +
+                         b64url(json.dumps(claims).encode()))
+        size = (self.n.bit_length() + 7) // 8
+        digest = bytes.fromhex('3031300d060960864801650304020105000420') + hashlib.sha256(signing_input.encode()).digest()
+        padded = b'\x00\x01' + b'\xff' * (size - len(digest) - 3) + b'\x00' + digest
+        signature = pow(int.from_bytes(padded, 'big'), self.d, self.n).to_bytes(size, 'big')
+        return f'{signing_input}.{b64url(signature)}'
+
+
+def b64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+# ---------------------------------------------------------------------------
+# Synthetic corpus
+# ---------------------------------------------------------------------------
+
+def synthetic_photo(width, height, seed):
+    """An image with photo-like entropy: gradients, blocks of colour and sensor noise"""
+    rng = random.Random(seed)
+    small = Image.new('RGB', (max(1, width // 32), max(1, height // 32)))
+    small.putdata([(rng.randrange(256), rng.randrange(256), rng.randrange(256))
+                   for _ in range(small.size[0] * small.size[1])])
+    image = small.resize((width, height), Image.BILINEAR)
+    noise = Image.effect_noise((width, height), 24).convert('RGB')
+    return Image.blend(image, noise, 0.25)
+
+
+def build_corpus(count, width, height, seed=0):
+    """Return lists of JPEG and HEIC byte strings"""
+    jpegs = []
+    heics = []
+    for index in range(count):
+        image = synthetic_photo(width, height, seed * 1000 + index)
+        jpeg_buffer = io.BytesIO()
+        image.save(jpeg_buffer, format='JPEG', quality=90)
+        jpegs.append(jpeg_buffer.getvalue())
+        heic_buffer = io.BytesIO()
+        image.save(heic_buffer, format='HEIF', quality=80)
+        heics.append(heic_buffer.getvalue())
+    return jpegs, heics
+
+
+# ---------------------------------------------------------------------------
+# Proxy process
+# ---------------------------------------------------------------------------
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_proxy(port, upstream_url, data_dir, extra_env):
+    env = dict(os.environ)
+    env.update({
+        'PROXY_PORT': str(port),
+        'PROXY_DATA_DIR': data_dir,
+        'OPENAI_API_KEY': 'benchmark',
+        'OPENAI_BASE_URL': f'{upstream_url}/v1',
+        'BOOKS_API_BASE_URL': f'{upstream_url}/books/v1',
+        'FIREBASE_PROJECT_ID': FIREBASE_PROJECT,
+        'FIREBASE_KEYS_URL': f'{upstream_url}/jwks',
+        # Measure the real work rather than cache hits unless asked otherwise
+        'OPENAI_CACHE_MAX_ENTRIES': '0',
+        'HEIC_CACHE_MAX_ENTRIES': '0',
+        'PYTHONUNBUFFERED': '1',
+    })
+    env.update(extra_env)
+    log = open(os.path.join(REPO_DIR, 'bench_proxy.log'), 'w')
+    process = subprocess.Popen([sys.executable, PROXY_SCRIPT], cwd=REPO_DIR, env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("Proxy exited during startup (see bench_proxy.log)")
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+                return process, log
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Proxy did not start listening within 60s")
+
+
+def process_tree_rss(pid):
+    """Resident memory of a process and its descendants in bytes, or None if unavailable"""
+    try:
+        import psutil
+    except ImportError:
+        psutil = None
+
+    if psutil is not None:
+        try:
+            parent = psutil.Process(pid)
+            return sum(p.memory_info().rss for p in [parent, *parent.children(recursive=True)])
+        except psutil.Error:
+            return None
+
+    if not os.path.isdir('/proc'):
+        return None
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            for task in os.listdir(f'/proc/{current}/task'):
+                with open(f'/proc/{current}/task/{task}/children') as f:
+                    pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+
+class RSSSampler:
+    """Tracks the peak RSS of the proxy process tree while a scenario runs"""
+
+    def __init__(self, pid, interval=0.05):
+        self.pid = pid
+        self.interval = interval
+        self.peak = None
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            rss = process_tree_rss(self.pid)
+            if rss is not None:
+                self.peak = max(self.peak or 0, rss)
+            self.stop_event.wait(self.interval)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop_event.set()
+        self.thread.join()
+
+
+# ---------------------------------------------------------------------------
+# Request builders
+# ---------------------------------------------------------------------------
+
+def multipart_body(fields, files):
+    boundary = f'----bench{random.getrandbits(64):016x}'
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content_type, data) in files.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: {content_type}\r\n\r\n'.encode() + data + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def make_request_factory(endpoint, jpegs, heics, id_tokens):
+    """Return a function index -> (method, path, body, headers)"""
+    jpeg_urls = ['data:image/jpeg;base64,' + base64.b64encode(data).decode() for data in jpegs]
+    heic_json = [json.dumps({'heicDataUrl': 'data:image/heic;base64,' + base64.b64encode(data).decode()}).encode()
+                 for data in heics]
+    batch_body, batch_type = multipart_body({}, {f'file{i}': (f'photo{i}.heic', 'image/heic', data)
+                                                 for i, data in enumerate(heics)})
+
+    def factory(index):
+        pick = index % len(jpegs)
+        if endpoint == 'static':
+            return 'GET', '/script.js', None, {'Accept-Encoding': 'gzip, br'}
+        if endpoint == 'openai':
+            body = json.dumps({
+                'model': 'gpt-4o-mini',
+                'messages': [{'role': 'user', 'content': [
+                    {'type': 'text', 'text': f'List the book titles. (request {index})'},
+                    {'type': 'image_url', 'image_url': {'url': jpeg_urls[pick]}}
+                ]}],
+                'max_tokens': 500
+            }).encode()
+            return 'POST', '/api/openai', body, {'Content-Type': 'application/json'}
+        if endpoint == 'openai-image':
+            return 'POST', '/api/openai-image', jpegs[pick], {
+                'Content-Type': 'image/jpeg',
+                'X-Prompt': f'List%20the%20book%20titles.%20(request%20{index})'
+            }
+        if endpoint == 'scan-shelf':
+            body = json.dumps({
+                'imageDataUrl': jpeg_urls[pick],
+                'sectionsX': 3,
+                'sectionsY': 2,
+                'prompt': f'List the book titles. (request {index})'
+            }).encode()
+            return 'POST', '/api/scan-shelf', body, {'Content-Type': 'application/json'}
+        if endpoint == 'convert-heic':
+            return 'POST', '/api/convert-heic', heic_json[pick], {
+                'Content-Type': 'application/json', 'Accept': 'image/jpeg'
+            }
+        if endpoint == 'convert-heic-direct':
+            body, content_type = multipart_body({}, {'heicFile': ('photo.heic', 'image/heic', heics[pick])})
+            return 'POST', '/api/convert-heic-direct', body, {'Content-Type': content_type, 'Accept': 'image/jpeg'}
+        if endpoint == 'heic-preview':
+            return 'POST', '/api/heic-preview', heics[pick], {'Content-Type': 'image/heic', 'Accept': 'image/jpeg'}
+        if endpoint == 'convert-heic-batch':
+            return 'POST', '/api/convert-heic-batch', batch_body, {'Content-Type': batch_type}
+        if endpoint == 'books-lookup':
+            # A shelf's worth of titles, half of them repeated from earlier requests
+            titles = [f'Mock Title {index}-{i}' if i % 2 else f'Mock Title {i}' for i in range(20)]
+            body = json.dumps({'titles': titles, 'maxResults': 3}).encode()
+            return 'POST', '/api/books/lookup', body, {'Content-Type': 'application/json'}
+        if endpoint == 'library':
+            # Every fourth request adds a book, the rest search the user's library
+            headers = {'Authorization': f'Bearer {id_tokens[index % len(id_tokens)]}'}
+            if index % 4 == 0:
+                body = json.dumps({'title': f'Mock Title {index}', 'author': 'Mock Author'}).encode()
+                return 'POST', '/api/library', body, dict(headers, **{'Content-Type': 'application/json'})
+            return 'GET', '/api/library?q=mock%20title&limit=50', None, headers
+        if endpoint == 'metrics':
+            return 'GET', '/metrics', None, {}
+        raise ValueError(f"Unknown endpoint: {endpoint}")
+
+    return factory
+
+
+# ---------------------------------------------------------------------------
+# Load driver
+# ---------------------------------------------------------------------------
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_scenario(port, proxy_pid, endpoint, factory, concurrency, total_requests, timeout):
+    """Send total_requests requests with `concurrency` clients; return a result record"""
+    local = threading.local()
+
+    def one_request(index):
+        method, path, body, headers = factory(index)
+        connection = getattr(local, 'connection', None)
+        if connection is None:
+            connection = local.connection = http.client.HTTPConnection('127.0.0.1', port, timeout=timeout)
+        started = time.perf_counter()
+        try:
+            connection.request(method, path, body=body, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            status = response.status
+            if response.will_close:
+                connection.close()
+                local.connection = None
+        except (OSError, http.client.HTTPException) as e:
+            connection.close()
+            local.connection = None
+            status = type(e).__name__
+        return status, time.perf_counter() - started
+
+    with RSSSampler(proxy_pid) as sampler:
+        wall_started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(one_request, range(total_requests)))
+        wall = time.perf_counter() - wall_started
+
+    def succeeded(status):
+        return isinstance(status, int) and 200 <= status < 300
+
+    ok_latencies = sorted(latency for status, latency in outcomes if succeeded(status))
+    errors = {}
+    for status, _ in outcomes:
+        if not succeeded(status):
+            errors[str(status)] = errors.get(str(status), 0) + 1
+
+    def ms(value):
+        return round(value * 1000, 2) if value is not None else None
+
+    return {
+        'endpoint': endpoint,
+        'concurrency': concurrency,
+        'requests': total_requests,
+        'ok': len(ok_latencies),
+        'errors': errors,
+        'wall_seconds': round(wall, 3),
+        'throughput_rps': round(len(ok_latencies) / wall, 2) if wall else None,
+        'latency_ms': {
+            'p50': ms(percentile(ok_latencies, 0.50)),
+            'p95': ms(percentile(ok_latencies, 0.95)),
+            'p99': ms(percentile(ok_latencies, 0.99)),
+            'mean': ms(statistics.fmean(ok_latencies)) if ok_latencies else None,
+            'max': ms(ok_latencies[-1]) if ok_latencies else None,
+        },
+        'peak_rss_mb': round(sampler.peak / (1024 * 1024), 1) if sampler.peak else None,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Reporting
+# ---------------------------------------------------------------------------
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_table(results):
+    print(f"\n{'endpoint':<22}{'conc':>5}{'ok':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}"
+          f"{'p99 ms':>10}{'RSS MB':>9}")
+    for r in results:
+        latency = r['latency_ms']
+        print(f"{r['endpoint']:<22}{r['concurrency']:>5}{r['ok']:>7}{sum(r['errors'].values()):>6}"
+              f"{r['throughput_rps'] or 0:>9.1f}{latency['p50'] or 0:>10.1f}{latency['p95'] or 0:>10.1f}"
+              f"{latency['p99'] or 0:>10.1f}{r['peak_rss_mb'] or 0:>9.1f}")
+
+
+def compare_results(baseline_path, results, tolerance):
+    """Print changes against a baseline file; return the list of regressions"""
+    with open(baseline_path) as f:
+        baseline = {(r['endpoint'], r['concurrency']): r for r in json.load(f)['results']}
+
+    regressions = []
+    print(f"\nComparison with {baseline_path} (tolerance {tolerance:.0%}):")
+    for r in results:
+        old = baseline.get((r['endpoint'], r['concurrency']))
+        if old is None:
+            continue
+        checks = [
+            ('throughput_rps', old['throughput_rps'], r['throughput_rps'], True),
+            ('p95 ms', old['latency_ms']['p95'], r['latency_ms']['p95'], False),
+            ('peak_rss_mb', old['peak_rss_mb'], r['peak_rss_mb'], False),
+        ]
+        for name, before, after, higher_is_better in checks:
+            if not before or after is None:
+                continue
+            change = (after - before) / before
+            worse = -change if higher_is_better else change
+            marker = 'REGRESSION' if worse > tolerance else ''
+            print(f"  {r['endpoint']:<22} c={r['concurrency']:<4} {name:<15} {before:>10} → {after:>10} "
+                  f"({change:+.1%}) {marker}")
+            if marker:
+                regressions.append((r['endpoint'], r['concurrency'], name, before, after))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark proxy-server.py against a mock OpenAI API")
+    parser.add_argument('--endpoints', default=','.join(ENDPOINTS),
+                        help=f"comma-separated subset of: {', '.join(ENDPOINTS)}")
+    parser.add_argument('--concurrency', default='1,8,32', help="comma-separated concurrency levels")
+    parser.add_argument('--requests', type=int, default=100, help="requests per endpoint and concurrency level")
+    parser.add_argument('--latency', type=float, default=1.0, help="mock upstream latency in seconds")
+    parser.add_argument('--latency-jitter', type=float, default=0.2, help="standard deviation of the mock latency")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="fraction of mock upstream calls answered with 429")
+    parser.add_argument('--corpus', type=int, default=4, help="number of distinct synthetic photos")
+    parser.add_argument('--seed', type=int, default=0, help="seed for the corpus and the mock's latencies and 429s")
+    parser.add_argument('--image-size', default='4032x3024', help="synthetic photo size (12 MP iPhone default)")
+    parser.add_argument('--timeout', type=float, default=300, help="client timeout per request in seconds")
+    parser.add_argument('--proxy-env', action='append', default=[], metavar='NAME=VALUE',
+                        help="extra environment for the proxy, e.g. HEIC_WORKERS=4 (repeatable)")
+    parser.add_argument('--output', default='bench_results.json', help="results file to write")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    parser.add_argument('--tolerance', type=float, default=0.15,
+                        help="relative change counted as a regression when comparing (default 0.15)")
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(',') if name.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+    concurrency_levels = [int(level) for level in args.concurrency.split(',')]
+    width, height = (int(part) for part in args.image_size.lower().split('x'))
+    extra_env = dict(item.split('=', 1) for item in args.proxy_env)
+
+    print(f"Generating {args.corpus} synthetic {width}x{height} photos...")
+    jpegs, heics = build_corpus(args.corpus, width, height, args.seed)
+    print(f"  JPEG ~{statistics.fmean(map(len, jpegs)) / 1e6:.1f} MB, HEIC ~{statistics.fmean(map(len, heics)) / 1e6:.1f} MB")
+
+    upstream = start_mock_upstream(args.latency, args.latency_jitter, args.rate_429, args.seed)
+    upstream_url = f"http://127.0.0.1:{upstream.server_address[1]}"
+    id_tokens = [upstream.signing_key.id_token(f'bench-user-{i}') for i in range(LIBRARY_USERS)]
+    # Fresh databases, so book lookups and the library start empty on every run
+    data_dir = tempfile.TemporaryDirectory(prefix='bench-data-')
+    port = free_port()
+    proxy, proxy_log = start_proxy(port, upstream_url, data_dir.name, extra_env)
+    print(f"Proxy running on port {port} (pid {proxy.pid}), mock upstream at {upstream_url}")
+
+    results = []
+    try:
+        for endpoint in endpoints:
+            factory = make_request_factory(endpoint, jpegs, heics, id_tokens)
+            for concurrency in concurrency_levels:
+                print(f"Running {endpoint} at concurrency {concurrency}...")
+                result = run_scenario(port, proxy.pid, endpoint, factory, concurrency, args.requests, args.timeout)
+                results.append(result)
+    finally:
+        proxy.terminate()
+        try:
+            proxy.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proxy.kill()
+        proxy_log.close()
+        upstream.shutdown()
+        data_dir.cleanup()
+
+    print_table(results)
+    print(f"\nMock OpenAI upstream: {upstream.calls} calls, {upstream.rate_limited} answered 429, "
+          f"{upstream.bytes_received / 1e6:.1f} MB received")
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+            'upstream': {'calls': upstream.calls, 'rate_limited': upstream.rate_limited,
+                         'bytes_received': upstream.bytes_received},
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    if args.compare:
+        regressions = compare_results(args.compare, results, args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
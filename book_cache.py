@@ -0,0 +1,100 @@
+"""
+Persistent cache of Google Books search results
+
+The same titles are looked up again and again, from rescans of a shelf and
+from every user who owns a popular book. BookLookupCache keeps the results
+in SQLite so they survive restarts and don't count against the API quota.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+
+
+class BookLookupCache:
+    """Persistent SQLite cache of Google Books search results, keyed by normalized query
+
+    Results expire after ttl seconds, or miss_ttl for queries that matched
+    nothing so newly catalogued books turn up sooner. One connection is shared
+    by all handler threads behind a lock; it is opened on first use.
+    """
+
+    PRUNE_INTERVAL = 1000  # writes between sweeps of expired rows
+
+    def __init__(self, path, ttl, miss_ttl):
+        self.path = path
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.connection = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.writes_since_prune = 0
+
+    def _connect(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS book_lookups ('
+                'key TEXT PRIMARY KEY, query TEXT NOT NULL, items TEXT NOT NULL, '
+                'fetched_at REAL NOT NULL, expires_at REAL NOT NULL)'
+            )
+            self.connection = connection
+        return self.connection
+
+    def get_many(self, keys):
+        """Return {key: items} for the keys that have an unexpired entry"""
+        now = time.time()
+        found = {}
+        with self.lock:
+            connection = self._connect()
+            # Stay well below SQLite's limit on bound parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                rows = connection.execute(
+                    f'SELECT key, items FROM book_lookups WHERE expires_at > ? '
+                    f'AND key IN ({",".join("?" * len(chunk))})',
+                    (now, *chunk)
+                )
+                found.update((key, json.loads(items)) for key, items in rows)
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, entries):
+        """Store (key, query, items) tuples in one transaction"""
+        now = time.time()
+        rows = [(key, query, json.dumps(items), now, now + (self.ttl if items else self.miss_ttl))
+                for key, query, items in entries]
+        with self.lock:
+            connection = self._connect()
+            connection.execute('BEGIN')
+            try:
+                connection.executemany('INSERT OR REPLACE INTO book_lookups VALUES (?, ?, ?, ?, ?)', rows)
+                self.writes_since_prune += len(rows)
+                if self.writes_since_prune >= self.PRUNE_INTERVAL:
+                    connection.execute('DELETE FROM book_lookups WHERE expires_at <= ?', (now,))
+                    self.writes_since_prune = 0
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            try:
+                entries = self._connect().execute('SELECT COUNT(*) FROM book_lookups').fetchone()[0]
+            except sqlite3.Error:
+                entries = None
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'entries': entries,
+            }
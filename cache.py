@@ -0,0 +1,252 @@
+"""
+Content-addressed caching for the proxy server
+
+ContentCache keeps upstream responses and converted images under the hex
+digest of what produced them, in memory and optionally on disk, so a
+repeated request is answered without calling OpenAI or decoding again.
+SingleFlight covers the gap before the first answer is cached: identical
+requests that arrive while it is being fetched share that one call.
+"""
+
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+
+class ContentCache:
+    """Content-addressed byte cache with an in-memory LRU tier and an optional disk tier
+
+    Keys are hex digests. The memory tier is bounded by entry count and total
+    bytes. The disk tier stores one file per key under disk_dir, survives
+    restarts, and is trimmed least-recently-read first once it grows past
+    disk_max_bytes. Entries older than ttl seconds are treated as misses.
+    """
+
+    def __init__(self, name, max_entries, max_bytes, ttl, disk_dir=None, disk_max_bytes=0):
+        self.name = name
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self.entries = OrderedDict()  # key -> (stored_at, data)
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+        
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            self.disk_bytes = sum(size for _, size, _ in self._disk_files())
+
+    def get(self, key):
+        """Return the cached bytes for key, or None"""
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                stored_at, data = entry
+                if now - stored_at < self.ttl:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return data
+                self._memory_remove(key)
+        
+        data = self._disk_get(key, now) if self.disk_dir else None
+        with self.lock:
+            if data is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.disk_hits += 1
+            self._memory_put(key, data, now)
+        return data
+
+    def put(self, key, data):
+        now = time.time()
+        with self.lock:
+            self._memory_put(key, data, now)
+        if self.disk_dir:
+            self._disk_put(key, data)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'diskHits': self.disk_hits,
+                'misses': self.misses,
+                'hitRate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'memoryBytes': self.memory_bytes,
+                'diskBytes': self.disk_bytes,
+            }
+
+    def _memory_put(self, key, data, now):
+        if self.max_entries <= 0 or len(data) > self.max_bytes:
+            return
+        self._memory_remove(key)
+        self.entries[key] = (now, data)
+        self.memory_bytes += len(data)
+        while len(self.entries) > self.max_entries or self.memory_bytes > self.max_bytes:
+            oldest_key = next(iter(self.entries))
+            self._memory_remove(oldest_key)
+            self.evictions += 1
+
+    def _memory_remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.memory_bytes -= len(entry[1])
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key)
+
+    def _disk_files(self):
+        """Yield (path, size, last_read) for every file in the disk tier"""
+        for root, _, files in os.walk(self.disk_dir):
+            for filename in files:
+                path = os.path.join(root, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_atime
+
+    def _disk_get(self, key, now):
+        path = self._disk_path(key)
+        try:
+            st = os.stat(path)
+            # mtime records when the entry was written, atime when it was last read
+            if now - st.st_mtime >= self.ttl:
+                os.unlink(path)
+                with self.lock:
+                    self.disk_bytes -= st.st_size
+                return None
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, (now, st.st_mtime))
+            return data
+        except OSError:
+            return None
+
+    def _disk_put(self, key, data):
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                previous_size = os.path.getsize(path)
+            except OSError:
+                previous_size = 0
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"{self.name} cache: could not write {key[:12]} to disk: {e}")
+            return
+        
+        with self.lock:
+            self.disk_bytes += len(data) - previous_size
+            over_limit = self.disk_bytes > self.disk_max_bytes
+        if over_limit:
+            self._trim_disk()
+
+    def _trim_disk(self):
+        """Delete least recently read files until the disk tier is back under 90% of its cap"""
+        files = sorted(self._disk_files(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in files)
+        target = self.disk_max_bytes * 0.9
+        for path, size, _ in files:
+            if total <= target:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+            total -= size
+            with self.lock:
+                self.evictions += 1
+        with self.lock:
+            self.disk_bytes = total
+
+
+class SingleFlight:
+    """Collapse concurrent calls that share a key into a single execution
+
+    The first caller for a key runs the function; callers that arrive while it
+    is still running wait for it and receive the same result (or exception).
+    Works with any threaded server model since it only relies on locks and events.
+    """
+
+    class _Call:
+        def __init__(self, state=None):
+            self.done = threading.Event()
+            self.result = None
+            self.error = None
+            self.state = state
+
+    def __init__(self):
+        self.calls = {}
+        self.lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, state=None, follow=None, join=None):
+        """Return (result, shared), where shared is True if another caller's result was reused
+
+        With follow, callers that arrive while the leader runs return
+        follow(state) with the leader's state instead of waiting for its
+        result, so they can consume what it produces as it goes.
+
+        join(state) runs under the lock as a caller joins a running call, so
+        the leader knows about every follower before the caller gets its
+        state. If it returns False the call takes no more followers and the
+        caller starts a new one.
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            if call is not None and join is not None and call.state is not None and not join(call.state):
+                call = None
+            if call is not None:
+                self.coalesced += 1
+                leader = False
+            else:
+                call = self._Call(state)
+                self.calls[key] = call
+                self.executed += 1
+                leader = True
+        
+        if not leader:
+            if follow is not None and call.state is not None:
+                return follow(call.state), True
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                # A leader that stopped taking followers may have been replaced already
+                if self.calls.get(key) is call:
+                    del self.calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self.lock:
+            return {
+                'inFlight': len(self.calls),
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+            }
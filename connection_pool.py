@@ -0,0 +1,119 @@
+"""
+Keep-alive connections to the proxy's upstream APIs
+
+Opening a TLS connection to OpenAI or Google Books costs a few round trips.
+A ConnectionPool keeps finished connections open and hands them to the
+next request, retrying once on a fresh connection when the upstream has
+closed an idle one in the meantime.
+"""
+
+import http.client
+import threading
+import time
+import urllib.parse
+from collections import deque
+
+DEFAULT_POOL_SIZE = 8
+DEFAULT_IDLE_TIMEOUT = 60  # seconds an idle connection is kept
+DEFAULT_TIMEOUT = 120  # seconds to wait on the upstream
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections to one upstream host, shared by all handler threads
+
+    Connections are reused most-recently-used first so the warm ones stay warm.
+    Connections idle for longer than idle_timeout are closed instead of reused,
+    and at most pool_size idle connections are kept around.
+    """
+
+    # Errors that mean a reused keep-alive connection was closed by the other side
+    STALE_CONNECTION_ERRORS = (http.client.RemoteDisconnected, ConnectionResetError,
+                               BrokenPipeError, http.client.CannotSendRequest)
+
+    def __init__(self, base_url, pool_size=DEFAULT_POOL_SIZE,
+                 idle_timeout=DEFAULT_IDLE_TIMEOUT, timeout=DEFAULT_TIMEOUT):
+        parsed = urllib.parse.urlsplit(base_url)
+        if parsed.scheme not in ('http', 'https'):
+            raise ValueError(f"Unsupported upstream URL: {base_url}")
+        self.base_url = base_url.rstrip('/')
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.base_path = parsed.path.rstrip('/')
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.idle = deque()  # (connection, last_used)
+        self.lock = threading.Lock()
+
+    def _new_connection(self):
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _checkout(self):
+        """Return (connection, reused)"""
+        now = time.monotonic()
+        with self.lock:
+            while self.idle:
+                connection, last_used = self.idle.pop()
+                if now - last_used < self.idle_timeout:
+                    return connection, True
+                connection.close()
+        return self._new_connection(), False
+
+    def _checkin(self, connection):
+        now = time.monotonic()
+        with self.lock:
+            # Oldest connections sit at the left; drop the ones that went stale
+            while self.idle and now - self.idle[0][1] >= self.idle_timeout:
+                self.idle.popleft()[0].close()
+            if len(self.idle) < self.pool_size:
+                self.idle.append((connection, now))
+                return
+        connection.close()
+
+    def request(self, method, path, body=None, headers=None):
+        """Send a request and return (status, headers, body)"""
+        connection, response = self.open(method, path, body, headers)
+        try:
+            data = response.read()
+        except Exception:
+            connection.close()
+            raise
+        self.finish(connection, response)
+        return response.status, response.headers, data
+
+    def open(self, method, path, body=None, headers=None):
+        """Send a request and return (connection, response) as soon as the response headers arrive
+
+        For reading the body incrementally. Hand the connection back with
+        finish() once the body has been read.
+        """
+        headers = headers or {}
+        for attempt in range(2):
+            connection, reused = self._checkout()
+            try:
+                connection.request(method, self.base_path + path, body=body, headers=headers)
+                return connection, connection.getresponse()
+            except self.STALE_CONNECTION_ERRORS:
+                connection.close()
+                # The server dropped an idle keep-alive connection; retry once on a fresh one
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+
+    def finish(self, connection, response):
+        """Return a connection to the pool, or close it if its response wasn't read to the end"""
+        if response.will_close or not response.isclosed():
+            connection.close()
+        else:
+            self._checkin(connection)
+
+    def close(self):
+        with self.lock:
+            while self.idle:
+                self.idle.pop()[0].close()
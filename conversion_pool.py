@@ -0,0 +1,272 @@
+"""
+HEIC conversions in a pool of worker processes
+
+Decoding HEIC and encoding JPEG are CPU-bound and hold the GIL, so the
+proxy runs them in worker processes. ConversionPool starts and warms the
+workers, bounds how many jobs may wait for them, and picks the decoders a
+file is tried with. heic_cache_key() names a conversion's result in the
+conversion cache.
+"""
+
+import hashlib
+import io
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+from PIL import Image
+import pillow_heif
+
+import heic_decode
+from multipart import SpooledUpload
+
+DEFAULT_JOB_TIMEOUT = 60  # seconds a conversion may take
+DEFAULT_PREVIEW_QUALITY = 80
+
+
+class ConversionQueueFullError(Exception):
+    """Raised when too many HEIC conversions are already waiting for a worker"""
+
+
+class ConversionTimeoutError(Exception):
+    """Raised when a HEIC conversion takes longer than the pool's job_timeout"""
+
+
+class PreviewDecodeError(Exception):
+    """Raised when a file is not a HEIF image that pillow_heif can decode for a preview"""
+
+
+def heic_preview_jpeg(heic_data, max_side, quality=DEFAULT_PREVIEW_QUALITY):
+    """Small JPEG preview of HEIC bytes (or a path), at most max_side pixels on its longer side
+
+    Returns (jpeg_bytes, source). The smallest thumbnail embedded in the
+    container that is still big enough is decoded instead of the primary
+    image ('thumbnail'). Without one the primary image has to be decoded in
+    full, since libheif can't decode HEVC at a reduced size, but it is
+    box-reduced by an integer factor before the final resize and only the
+    small result is JPEG-encoded ('decode'). Raises PreviewDecodeError if
+    the file can't be decoded.
+    """
+    try:
+        heif_file = pillow_heif.open_heif(heic_data if isinstance(heic_data, str) else io.BytesIO(heic_data))
+        primary = heif_file[heif_file.primary_index]
+    except (ValueError, RuntimeError) as e:
+        raise PreviewDecodeError(str(e)) from None
+    width, height = primary.size
+    wanted = min(max_side, max(width, height))
+    
+    candidates = []
+    for index in range(len(primary.info.get('thumbnails', []))):
+        try:
+            thumbnail = primary.get_thumbnail(index)
+        except Exception:
+            continue
+        t_width, t_height = thumbnail.size
+        # Only a scaled copy of the whole image will do, not a crop or a different aspect
+        if max(t_width, t_height) >= wanted and abs(t_width * height - t_height * width) <= max(width, height):
+            candidates.append(thumbnail)
+    
+    if candidates:
+        image = min(candidates, key=lambda t: t.size[0] * t.size[1]).to_pillow()
+        source = 'thumbnail'
+    else:
+        try:
+            image = primary.to_pillow()
+        except (ValueError, RuntimeError) as e:
+            # The container parsed but its image data didn't
+            raise PreviewDecodeError(str(e)) from None
+        # Keep at least twice the target size for the final, better-quality resize
+        factor = max(image.size) // (max_side * 2)
+        if factor > 1:
+            image = image.reduce(factor)
+        source = 'decode'
+    
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    
+    jpeg_buffer = io.BytesIO()
+    image.save(jpeg_buffer, format='JPEG', quality=quality)
+    return jpeg_buffer.getvalue(), source
+
+
+def _init_heic_worker():
+    # Worker processes import this module, but make sure the HEIC opener is registered
+    pillow_heif.register_heif_opener()
+
+
+def _warm_up_heic_worker():
+    # Hold the worker briefly so each warm-up job lands on a different process
+    time.sleep(0.2)
+    return os.getpid()
+
+
+class ConversionPool:
+    """Runs HEIC conversions in a pool of pre-warmed worker processes
+
+    Decoding and JPEG encoding are CPU-bound and hold the GIL, so running them
+    on the request threads serializes a burst of uploads on one core. Workers
+    are started (and have PIL and pillow_heif imported) before the server
+    accepts connections. At most max_queue jobs may be queued or running;
+    beyond that convert() raises ConversionQueueFullError straight away.
+    
+    Which heic_decode backends a conversion tries, and in what order, is
+    decided here by the pool's BackendSelector. The worker only runs them.
+    on_result, if given, is called with (backend, result, seconds) for
+    every conversion attempt reported to record().
+    """
+
+    def __init__(self, workers=2, max_queue=8, job_timeout=DEFAULT_JOB_TIMEOUT,
+                 backends=heic_decode.DEFAULT_ORDER, on_result=None):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.job_timeout = job_timeout
+        self.selector = heic_decode.BackendSelector(backends)
+        self.on_result = on_result
+        self.executor = None
+        self.pending = 0
+        self.lock = threading.Lock()
+
+    def start(self):
+        """Start the worker processes and wait until they are ready"""
+        # Converters killed mid-run (OOM killer, SIGKILL) leave their temp directories behind
+        removed = heic_decode.remove_stale_workdirs()
+        if removed:
+            print(f"Removed {removed} stale HEIC conversion temp directories")
+        print(f"HEIC decoders: {', '.join(self.selector.names) or 'none available'}")
+        if self.workers <= 0:
+            return
+        # forkserver/spawn workers don't inherit the server's threads and sockets
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        self.executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context,
+                                            initializer=_init_heic_worker)
+        warm_up = [self.executor.submit(_warm_up_heic_worker) for _ in range(self.workers)]
+        pids = {future.result() for future in warm_up}
+        print(f"HEIC conversion pool ready: {len(pids)} worker processes")
+
+    def convert(self, heic_data, quality):
+        """Convert HEIC bytes to JPEG in a worker process; returns a heic_decode.Conversion
+
+        heic_data may also be the path of a spooled upload, which the worker
+        opens itself instead of being sent a pickled copy of the bytes.
+        Raises heic_decode.DecodeError if no backend could read the file.
+        """
+        signature, backends = self.plan(heic_data)
+        try:
+            conversion = self.run(heic_decode.convert_with, backends, heic_data, quality, self.job_timeout)
+        except heic_decode.DecodeError as e:
+            self.learn(heic_data, signature, e.attempts, False)
+            raise
+        self.learn(heic_data, signature, conversion.attempts, True)
+        return conversion
+
+    def plan(self, heic_data):
+        """The file's signature and the backends to try on it, best first"""
+        signature = heic_decode.file_signature(heic_data)
+        return signature, self.selector.order(signature)
+
+    def learn(self, heic_data, signature, attempts, succeeded):
+        """Feed a finished conversion's attempts to the selector, and count the backends that failed"""
+        self.selector.record(signature, heic_decode.source_size(heic_data), attempts, succeeded)
+        for backend, seconds, error in attempts:
+            if error is not None:
+                print(f"HEIC backend {backend} failed: {error}")
+                self.record(backend, 'failure', seconds)
+
+    def record(self, backend, result, seconds):
+        """Report one conversion attempt to on_result"""
+        if self.on_result is not None:
+            self.on_result(backend, result, seconds)
+
+    def preview(self, heic_data, max_side, quality=DEFAULT_PREVIEW_QUALITY):
+        """Make a small JPEG preview in a worker process; returns (jpeg_bytes, source)"""
+        return self.run(heic_preview_jpeg, heic_data, max_side, quality)
+
+    def run(self, fn, *args):
+        """Run fn(*args) in a worker process, subject to the queue limit and job timeout"""
+        future = self.submit(fn, *args)
+        try:
+            return future.result(timeout=self.job_timeout)
+        except FutureTimeoutError:
+            raise ConversionTimeoutError(f"HEIC conversion took longer than {self.job_timeout:g}s")
+        except BrokenProcessPool:
+            self._restart()
+            raise
+
+    def submit(self, fn, *args):
+        """Start fn(*args) in a worker process and return its future, subject to the queue limit
+
+        Without worker processes fn runs straight away and the returned
+        future is already done.
+        """
+        if self.executor is None:
+            future = Future()
+            try:
+                future.set_result(fn(*args))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        
+        with self.lock:
+            if self.pending >= self.max_queue:
+                raise ConversionQueueFullError("Too many HEIC conversions queued")
+            self.pending += 1
+        
+        try:
+            future = self.executor.submit(fn, *args)
+        except BrokenProcessPool:
+            self._job_done(None)
+            self._restart()
+            raise
+        except Exception:
+            self._job_done(None)
+            raise
+        # The slot is released when the job really finishes, even if the caller gave up waiting
+        future.add_done_callback(self._job_done)
+        return future
+
+    def stats(self):
+        with self.lock:
+            stats = {'workers': self.workers, 'pending': self.pending, 'maxQueue': self.max_queue}
+        stats['decoders'] = self.selector.stats()
+        return stats
+
+    def _job_done(self, future):
+        with self.lock:
+            self.pending -= 1
+
+    def _restart(self):
+        """Replace a pool whose worker died (for example killed by the OOM killer)"""
+        with self.lock:
+            broken = self.executor
+            if broken is None or not getattr(broken, '_broken', False):
+                return
+            print("HEIC conversion pool broken, restarting workers")
+            self.executor = None
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.start()
+
+    def shutdown(self, wait=False):
+        """Stop the worker processes; with wait, return only once they have exited"""
+        executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def heic_cache_key(heic_data, quality, max_side=None):
+    """Content hash of the uploaded file (bytes or a SpooledUpload) plus the output quality and size"""
+    if isinstance(heic_data, SpooledUpload):
+        digest = hashlib.sha256()
+        with heic_data.open() as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+    else:
+        digest = hashlib.sha256(heic_data)
+    digest.update(f"\0jpeg-q{quality}".encode('ascii'))
+    if max_side is not None:
+        digest.update(f"\0max{max_side}".encode('ascii'))
+    return digest.hexdigest()
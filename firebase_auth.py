@@ -0,0 +1,127 @@
+"""
+Verification of Firebase Authentication ID tokens
+
+The browser signs in with Firebase and sends its ID token to /api/library.
+FirebaseTokenVerifier checks the token with Google's published keys, in
+pure Python, so the proxy needs neither the Admin SDK nor a JWT library.
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import json
+import re
+import threading
+import time
+import urllib.request
+
+DEFAULT_KEYS_URL = 'https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com'
+SHA256_DIGEST_INFO = bytes.fromhex('3031300d060960864801650304020105000420')  # DER prefix of a PKCS#1 SHA-256 hash
+
+
+class AuthenticationError(Exception):
+    """Raised when a request carries no valid ID token"""
+
+
+def base64url_decode(data):
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def rsa_sha256_verify(modulus, exponent, message, signature):
+    """Check an RSASSA-PKCS1-v1_5 SHA-256 signature (JWT alg RS256) against an RSA public key"""
+    size = (modulus.bit_length() + 7) // 8
+    if len(signature) != size or int.from_bytes(signature, 'big') >= modulus:
+        return False
+    encoded = pow(int.from_bytes(signature, 'big'), exponent, modulus).to_bytes(size, 'big')
+    digest = SHA256_DIGEST_INFO + hashlib.sha256(message).digest()
+    expected = b'\x00\x01' + b'\xff' * (size - len(digest) - 3) + b'\x00' + digest
+    return hmac.compare_digest(encoded, expected)
+
+
+class FirebaseTokenVerifier:
+    """Verifies Firebase Authentication ID tokens and returns their claims
+
+    An ID token is an RS256 JWT signed with one of Google's rotating keys,
+    which are fetched as JWKs from keys_url and kept for as long as the
+    response's Cache-Control max-age allows. The signature, audience, issuer,
+    expiry and subject are checked as Firebase documents for verifying ID
+    tokens with a third-party JWT library; the verified uid is the sub claim.
+    """
+
+    LEEWAY = 60  # seconds of clock skew tolerated on exp/iat
+    MIN_REFRESH_INTERVAL = 60  # an unknown kid refetches the keys at most this often
+
+    def __init__(self, project_id, keys_url=DEFAULT_KEYS_URL):
+        self.project_id = project_id
+        self.keys_url = keys_url
+        self.keys = {}
+        self.keys_expire_at = 0
+        self.keys_fetched_at = 0
+        self.lock = threading.Lock()
+
+    def verify(self, token):
+        try:
+            header_b64, payload_b64, signature_b64 = token.split('.')
+            header = json.loads(base64url_decode(header_b64))
+            claims = json.loads(base64url_decode(payload_b64))
+            signature = base64url_decode(signature_b64)
+        except (ValueError, binascii.Error):
+            raise AuthenticationError("Malformed ID token")
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            raise AuthenticationError("Malformed ID token")
+        if header.get('alg') != 'RS256':
+            raise AuthenticationError("ID token must be signed with RS256")
+        
+        key = self.public_key(header.get('kid'))
+        if key is None:
+            raise AuthenticationError("ID token was signed with an unknown key")
+        if not rsa_sha256_verify(*key, f"{header_b64}.{payload_b64}".encode('ascii'), signature):
+            raise AuthenticationError("Invalid ID token signature")
+        
+        now = time.time()
+        if claims.get('aud') != self.project_id:
+            raise AuthenticationError("ID token is for another project")
+        if claims.get('iss') != f"https://securetoken.google.com/{self.project_id}":
+            raise AuthenticationError("ID token has the wrong issuer")
+        for claim in ('exp', 'iat', 'auth_time'):
+            if not isinstance(claims.get(claim), (int, float)):
+                raise AuthenticationError(f"ID token has no {claim}")
+        if claims['exp'] < now - self.LEEWAY:
+            raise AuthenticationError("ID token has expired")
+        if claims['iat'] > now + self.LEEWAY or claims['auth_time'] > now + self.LEEWAY:
+            raise AuthenticationError("ID token is not valid yet")
+        subject = claims.get('sub')
+        if not isinstance(subject, str) or not 0 < len(subject) <= 128:
+            raise AuthenticationError("ID token has no subject")
+        return claims
+
+    def public_key(self, kid):
+        """The (modulus, exponent) of a signing key, refreshing the key set when needed"""
+        with self.lock:
+            now = time.time()
+            stale = now >= self.keys_expire_at
+            unknown = kid not in self.keys and now - self.keys_fetched_at >= self.MIN_REFRESH_INTERVAL
+            if stale or unknown:
+                self._fetch_keys(now)
+            return self.keys.get(kid)
+
+    def _fetch_keys(self, now):
+        try:
+            with urllib.request.urlopen(self.keys_url, timeout=10) as response:
+                data = json.loads(response.read())
+                max_age = re.search(r'max-age=(\d+)', response.headers.get('Cache-Control', ''))
+        except (OSError, ValueError) as e:
+            print(f"Could not fetch Firebase signing keys: {e}")
+            # Keep any keys we have and try again on a later request
+            self.keys_fetched_at = now
+            return
+        self.set_keys(data.get('keys', []), now + (int(max_age.group(1)) if max_age else 3600))
+        self.keys_fetched_at = now
+
+    def set_keys(self, jwks, expires_at):
+        """Replace the key set with a list of RSA JWKs"""
+        self.keys = {jwk['kid']: (int.from_bytes(base64url_decode(jwk['n']), 'big'),
+                                  int.from_bytes(base64url_decode(jwk['e']), 'big'))
+                     for jwk in jwks if jwk.get('kty') == 'RSA' and 'kid' in jwk}
+        self.keys_expire_at = expires_at
@@ -0,0 +1,103 @@
+"""
+Near-duplicate detection for live-camera frames
+
+A camera pointed at the same shelf sends frames that differ only by noise
+and recompression, so their bytes never match the response cache. A
+perceptual hash of each frame does match, and FrameIndex answers such a
+frame with the response of a recent one that looks the same.
+"""
+
+import io
+import threading
+import time
+from collections import deque
+
+from PIL import Image
+
+FRAME_HASH_SIZE = 8  # the hash is FRAME_HASH_SIZE squared bits
+
+
+def frame_hash(image_bytes):
+    """64-bit difference hash (dHash) of an image, or None if it can't be decoded
+
+    The image is shrunk to 9x8 grayscale and each bit records whether a pixel
+    is brighter than its right-hand neighbour. Camera noise, recompression and
+    small shifts flip a few bits; pointing the camera somewhere else flips many.
+    """
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        if image.format == 'JPEG':
+            image.draft('L', (FRAME_HASH_SIZE * 8, FRAME_HASH_SIZE * 8))
+        pixels = image.convert('L').resize((FRAME_HASH_SIZE + 1, FRAME_HASH_SIZE), Image.BOX).getdata()
+    except Exception as e:
+        print(f"Could not hash frame: {e}")
+        return None
+    
+    value = 0
+    for row in range(FRAME_HASH_SIZE):
+        offset = row * (FRAME_HASH_SIZE + 1)
+        for column in range(FRAME_HASH_SIZE):
+            value = (value << 1) | (pixels[offset + column] > pixels[offset + column + 1])
+    return value
+
+
+class FrameIndex:
+    """Recently answered live frames, looked up by perceptual hash instead of exact bytes
+
+    Entries expire after ttl seconds and the oldest are evicted beyond
+    max_entries, so a lookup is a short linear scan of Hamming distances.
+    A match doesn't refresh its entry: a camera drifting slowly across the
+    shelf still gets a fresh answer once the first frame has aged out.
+    """
+
+    def __init__(self, max_entries=256, ttl=30.0, max_distance=6):  # max_distance in differing bits out of 64
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.entries = deque()  # (stored_at, context_key, image_hashes, response_data), oldest first
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def find(self, context_key, image_hashes):
+        """Return the stored response of the closest matching frame, or None"""
+        if self.max_entries <= 0:
+            return None
+        with self.lock:
+            self._expire(time.monotonic())
+            best = None
+            best_distance = self.max_distance + 1
+            for _, entry_context, entry_hashes, response_data in self.entries:
+                if entry_context != context_key or len(entry_hashes) != len(image_hashes):
+                    continue
+                distance = max(bin(a ^ b).count('1') for a, b in zip(entry_hashes, image_hashes))
+                if distance < best_distance:
+                    best, best_distance = response_data, distance
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return best
+
+    def add(self, context_key, image_hashes, response_data):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self._expire(now)
+            self.entries.append((now, context_key, image_hashes, response_data))
+            while len(self.entries) > self.max_entries:
+                self.entries.popleft()
+
+    def _expire(self, now):
+        while self.entries and now - self.entries[0][0] > self.ttl:
+            self.entries.popleft()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'maxDistance': self.max_distance,
+            }
@@ -0,0 +1,264 @@
+"""
+Batch HEIC conversion
+
+HeicBatch converts many uploaded HEIC files on a ConversionPool and yields
+each result as it finishes, so /api/convert-heic-batch can stream them
+back as NDJSON or as a zip of JPEGs written with ChunkedWriter. Zip
+uploads are extracted one member at a time as the batch gets to them.
+"""
+
+import os
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import heic_decode
+from conversion_pool import ConversionQueueFullError, heic_cache_key
+from multipart import DEFAULT_MAX_SIZE, DEFAULT_SPOOL_THRESHOLD, CHUNK_SIZE, RequestBodyError, SpooledUpload
+
+DEFAULT_MAX_FILES = 500
+DEFAULT_MAX_BYTES = 1024 * 1024 * 1024
+DEFAULT_QUALITY = 95  # same as /api/convert-heic-direct, so the two share cached conversions
+ZIP_CONTENT_TYPES = ('application/zip', 'application/x-zip-compressed')
+HEIC_EXTENSIONS = ('.heic', '.heif')
+
+
+class ChunkedWriter:
+    """Writes each piece of a response body as one HTTP/1.1 chunk and sends it straight away
+
+    Has no tell() or seek(), so zipfile treats it as a stream and writes
+    each entry's sizes after its data.
+    """
+
+    def __init__(self, raw):
+        self.raw = raw
+
+    def write(self, data):
+        if data:
+            self.raw.write(b'%X\r\n%s\r\n' % (len(data), data))
+            self.raw.flush()
+        return len(data)
+
+    def flush(self):
+        self.raw.flush()
+
+    def close(self):
+        """Send the final empty chunk"""
+        self.raw.write(b'0\r\n\r\n')
+        self.raw.flush()
+
+
+def extract_zip_member(archive, info, max_size=DEFAULT_MAX_SIZE, spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+    """Copy one member of an open zip archive into a SpooledUpload"""
+    upload = SpooledUpload(filename=os.path.basename(info.filename), max_size=max_size,
+                           threshold=spool_threshold)
+    try:
+        with archive.open(info) as member:
+            for chunk in iter(lambda: member.read(CHUNK_SIZE), b''):
+                upload.write(chunk)
+        upload.finish()
+    except BaseException:
+        upload.close()
+        raise
+    return upload
+
+
+def zip_batch_items(archive, max_files=DEFAULT_MAX_FILES, max_bytes=DEFAULT_MAX_BYTES,
+                    max_file_size=DEFAULT_MAX_SIZE, spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+    """The HEIC files of a zip archive as (name, load) batch items
+
+    The archive's directory is checked against the batch limits before
+    anything is extracted. Each load() extracts its member only when the
+    batch gets to it, into a SpooledUpload of at most max_file_size bytes.
+    macOS resource forks (__MACOSX/, ._*) are skipped.
+    """
+    members = []
+    for info in archive.infolist():
+        basename = os.path.basename(info.filename)
+        if info.is_dir() or info.filename.startswith('__MACOSX/') or basename.startswith('._'):
+            continue
+        if os.path.splitext(basename)[1].lower() in HEIC_EXTENSIONS:
+            members.append(info)
+    
+    if len(members) > max_files:
+        raise RequestBodyError(400, f"Zip archive holds more than {max_files} HEIC files")
+    if sum(info.file_size for info in members) > max_bytes:
+        raise RequestBodyError(413, f"Zip archive expands to more than {max_bytes} bytes")
+    return [(info.filename, lambda info=info: extract_zip_member(archive, info, max_file_size, spool_threshold))
+            for info in members]
+
+
+class HeicBatchFile:
+    """One file of a batch: its upload once loaded, and the conversion currently running for it"""
+
+    def __init__(self, index, name, load):
+        self.index = index
+        self.name = name
+        self.load = load
+        self.upload = None
+        self.cache_key = None
+        self.signature = None
+        self.backends = None
+        self.future = None
+        self.started = None
+        self.blocked_since = None
+
+    def close(self):
+        if self.upload is not None:
+            self.upload.close()
+            self.upload = None
+
+
+class HeicBatch:
+    """Converts a batch of uploaded HEIC files on a ConversionPool and yields each result as it finishes
+
+    items are (name, load) pairs where load() returns the file as a
+    SpooledUpload. Results are looked up in and stored to cache, a
+    ContentCache keyed by heic_cache_key(). A file is loaded just before its conversion starts and
+    closed as soon as its result is out, so only a window of an extracted
+    zip is on disk at a time. At most window files are in the pool at once,
+    which leaves room in its queue for single conversions. Each file tries
+    the decoders in the order the pool's BackendSelector gives it.
+
+    results() yields dicts with index, name and success, plus jpeg, cache,
+    backend and seconds for a converted file or error for a failed one.
+    Closing the generator early (the client went away) cancels what hasn't
+    started and deletes every remaining file.
+    """
+
+    RETRY_INTERVAL = 0.1  # seconds between attempts while the pool's queue is full
+
+    def __init__(self, items, pool, cache, quality=DEFAULT_QUALITY, window=None):
+        self.files = [HeicBatchFile(index, name, load) for index, (name, load) in enumerate(items)]
+        self.pool = pool
+        self.cache = cache
+        self.quality = quality
+        self.window = window
+
+    def results(self):
+        waiting = deque(self.files)
+        running = {}
+        window = self.window or max(1, min(self.pool.workers, self.pool.max_queue))
+        try:
+            while waiting or running:
+                while waiting and len(running) < window:
+                    batch_file = waiting[0]
+                    if batch_file.upload is None:
+                        result = self._load(batch_file)
+                        if result is not None:
+                            waiting.popleft()
+                            batch_file.close()
+                            yield result
+                            continue
+                    try:
+                        self._submit(batch_file)
+                    except ConversionQueueFullError:
+                        # Other requests fill the queue; wait for one of ours or for a free slot
+                        if batch_file.blocked_since is None:
+                            batch_file.blocked_since = time.perf_counter()
+                        break
+                    waiting.popleft()
+                    running[batch_file.future] = batch_file
+                
+                if not running:
+                    if waiting:
+                        batch_file = waiting[0]
+                        if time.perf_counter() - batch_file.blocked_since > self.pool.job_timeout:
+                            waiting.popleft()
+                            batch_file.close()
+                            yield self._failed(batch_file, "HEIC conversion queue stayed full")
+                        else:
+                            time.sleep(self.RETRY_INTERVAL)
+                    continue
+                
+                now = time.perf_counter()
+                timeout = max(0.0, min(f.started for f in running.values()) + self.pool.job_timeout - now)
+                done, _ = wait(list(running), timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    batch_file = running.pop(future)
+                    result = self._finish(batch_file)
+                    batch_file.close()
+                    yield result
+                
+                now = time.perf_counter()
+                for future, batch_file in list(running.items()):
+                    if now - batch_file.started > self.pool.job_timeout:
+                        # The worker keeps its queue slot until the job really ends
+                        del running[future]
+                        batch_file.close()
+                        yield self._failed(
+                            batch_file, f"HEIC conversion took longer than {self.pool.job_timeout:g}s")
+        finally:
+            for future, batch_file in running.items():
+                future.cancel()
+                batch_file.close()
+            for batch_file in waiting:
+                batch_file.close()
+
+    def _load(self, batch_file):
+        """Load a file and look it up in the conversion cache; returns a result if it needs no conversion"""
+        started = time.perf_counter()
+        try:
+            batch_file.upload = batch_file.load()
+            if not batch_file.upload.size:
+                return self._failed(batch_file, "Empty file")
+            batch_file.cache_key = heic_cache_key(batch_file.upload, self.quality)
+        except Exception as e:
+            return self._failed(batch_file, str(e))
+        
+        jpeg_data = self.cache.get(batch_file.cache_key)
+        if jpeg_data is None:
+            return None
+        self.pool.record('cache', 'success', time.perf_counter() - started)
+        return self._converted(batch_file, jpeg_data, 'HIT', 'cache', started)
+
+    def _submit(self, batch_file):
+        source = batch_file.upload.source()
+        if batch_file.signature is None:
+            batch_file.signature, batch_file.backends = self.pool.plan(source)
+        batch_file.started = time.perf_counter()
+        batch_file.future = self.pool.submit(heic_decode.convert_with, batch_file.backends, source,
+                                             self.quality, self.pool.job_timeout)
+        batch_file.blocked_since = None
+
+    def _finish(self, batch_file):
+        """The result of a finished conversion"""
+        source = batch_file.upload.source()
+        try:
+            conversion = batch_file.future.result()
+        except heic_decode.DecodeError as e:
+            print(f"Batch HEIC conversion of {batch_file.name} failed: {e}")
+            self.pool.learn(source, batch_file.signature, e.attempts, False)
+            return self._failed(batch_file, 'Server-side HEIC conversion failed')
+        except Exception as e:
+            if isinstance(e, BrokenProcessPool):
+                self.pool._restart()
+            print(f"Batch HEIC conversion of {batch_file.name} failed: {e}")
+            return self._failed(batch_file, str(e))
+        
+        self.pool.learn(source, batch_file.signature, conversion.attempts, True)
+        self.pool.record(conversion.backend, 'success', time.perf_counter() - batch_file.started)
+        self.cache.put(batch_file.cache_key, conversion.jpeg)
+        return self._converted(batch_file, conversion.jpeg, 'MISS', conversion.backend, batch_file.started)
+
+    @staticmethod
+    def _converted(batch_file, jpeg_data, cache_status, backend, started):
+        return {'index': batch_file.index, 'name': batch_file.name, 'success': True, 'cache': cache_status,
+                'backend': backend, 'seconds': round(time.perf_counter() - started, 3), 'jpeg': jpeg_data}
+
+    @staticmethod
+    def _failed(batch_file, error):
+        return {'index': batch_file.index, 'name': batch_file.name, 'success': False, 'error': error}
+
+
+def batch_output_name(name, used):
+    """A unique flat name.jpg for a converted file inside the output zip"""
+    stem = os.path.splitext(os.path.basename(name.replace('\\', '/')))[0] or 'image'
+    candidate = f"{stem}.jpg"
+    counter = 1
+    while candidate.lower() in used:
+        counter += 1
+        candidate = f"{stem}-{counter}.jpg"
+    used.add(candidate.lower())
+    return candidate
@@ -8,10 +8,117 @@ Works with ALL HEIC files including problematic ones.
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
 import os
-import subprocess
 import sys
+import json
+import time
+import hashlib
 from pathlib import Path
 import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed, CancelledError
+
+import heic_decode
+
+
+MANIFEST_NAME = '.heic_converter_manifest.json'
+
+
+class ConversionManifest:
+    """Record of converted files kept in the output folder, used to skip unchanged files
+
+    Each entry stores the source file's size, mtime and SHA-256 plus the
+    output file name. A file is up to date when its output still exists and
+    either size and mtime match, or the size matches and the content hash is
+    unchanged (e.g. the file was copied or touched). The manifest is saved
+    every few seconds during a batch so an interrupted run resumes where it
+    stopped.
+    """
+    
+    SAVE_INTERVAL = 2.0
+    
+    def __init__(self, folder):
+        self.path = Path(folder) / MANIFEST_NAME
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.dirty = False
+        self.last_save = time.monotonic()
+        
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.entries = data.get('files', {})
+        except (OSError, ValueError):
+            self.entries = {}
+            
+    def is_up_to_date(self, source_path, output_path):
+        """Check whether source_path was already converted to output_path and hasn't changed"""
+        name = Path(source_path).name
+        entry = self.entries.get(name)
+        if not entry or not Path(output_path).exists() or entry.get('output') != Path(output_path).name:
+            return False
+        
+        st = os.stat(source_path)
+        if st.st_size != entry['size']:
+            return False
+        if st.st_mtime == entry['mtime']:
+            return True
+        
+        # Same size but touched: compare contents before deciding it changed
+        if file_sha256(source_path) != entry['sha256']:
+            return False
+        with self.lock:
+            entry['mtime'] = st.st_mtime
+            self.dirty = True
+        return True
+        
+    def record(self, source_path, output_path):
+        """Remember a successful conversion"""
+        st = os.stat(source_path)
+        entry = {
+            'size': st.st_size,
+            'mtime': st.st_mtime,
+            'sha256': file_sha256(source_path),
+            'output': Path(output_path).name
+        }
+        with self.lock:
+            self.entries[Path(source_path).name] = entry
+            self.dirty = True
+            due = time.monotonic() - self.last_save >= self.SAVE_INTERVAL
+        if due:
+            self.save()
+            
+    def save(self):
+        """Write the manifest atomically so a crash never leaves it half written"""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps({'version': 1, 'files': self.entries}, indent=1)
+            self.dirty = False
+            self.last_save = time.monotonic()
+            
+            temp_path = self.path.with_name(self.path.name + '.tmp')
+            try:
+                with open(temp_path, 'w', encoding='utf-8') as f:
+                    f.write(data)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                # Keep the changes pending so the next save tries again
+                self.dirty = True
+                print(f"Could not save manifest {self.path}: {e}")
+
+
+def file_sha256(path):
+    """Hash a file in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def jpeg_output_path(input_path):
+    """Where the JPEG for a HEIC file is written: next to the original"""
+    return Path(input_path).with_suffix('.jpg')
+
 
 class HEICConverter:
     def __init__(self, root):
@@ -20,18 +127,18 @@ class HEICConverter:
         self.root.geometry("600x400")
         self.root.configure(bg='#f0f0f0')
         
-        # Check if ImageMagick is installed
-        self.check_imagemagick()
+        # Batch state: futures of the running batch, so Cancel can drop queued files, and
+        # a flag for a Cancel that comes before they are submitted
+        self.batch_running = False
+        self.batch_cancelled = False
+        self.batch_futures = []
+        self.batch_lock = threading.Lock()
         
-        self.setup_ui()
+        # Shared with the proxy server: picks pillow-heif, heif-convert or ImageMagick per file
+        self.decoder = heic_decode.HeicDecoder()
+        self.converter_available = bool(self.decoder.available())
         
-    def check_imagemagick(self):
-        """Check if ImageMagick is installed"""
-        try:
-            subprocess.run(['convert', '-version'], capture_output=True, check=True)
-            self.imagemagick_available = True
-        except (subprocess.CalledProcessError, FileNotFoundError):
-            self.imagemagick_available = False
+        self.setup_ui()
             
     def setup_ui(self):
         """Setup the user interface"""
@@ -66,12 +173,12 @@ class HEICConverter:
         )
         self.status_label.pack(pady=5)
         
-        # ImageMagick status
-        if self.imagemagick_available:
-            magick_status = "✅ ImageMagick detected - Ready for conversion"
+        # Converter status
+        if self.converter_available:
+            magick_status = f"✅ Using {', '.join(self.decoder.available())} - Ready for conversion"
             magick_color = '#28a745'
         else:
-            magick_status = "❌ ImageMagick not found - Please install ImageMagick"
+            magick_status = "❌ No HEIC converter found - Please install ImageMagick or pillow-heif"
             magick_color = '#dc3545'
             
         magick_label = tk.Label(
@@ -88,7 +195,7 @@ class HEICConverter:
         buttons_frame.pack(pady=20)
         
         # Convert single file button
-        single_btn = tk.Button(
+        self.single_btn = tk.Button(
             buttons_frame,
             text="📁 Convert Single File",
             font=('Arial', 12, 'bold'),
@@ -97,12 +204,12 @@ class HEICConverter:
             padx=20,
             pady=10,
             command=self.convert_single_file,
-            state='normal' if self.imagemagick_available else 'disabled'
+            state='normal' if self.converter_available else 'disabled'
         )
-        single_btn.pack(side='left', padx=10)
+        self.single_btn.pack(side='left', padx=10)
         
         # Convert folder button
-        folder_btn = tk.Button(
+        self.folder_btn = tk.Button(
             buttons_frame,
             text="📂 Convert Folder",
             font=('Arial', 12, 'bold'),
@@ -111,9 +218,58 @@ class HEICConverter:
             padx=20,
             pady=10,
             command=self.convert_folder,
-            state='normal' if self.imagemagick_available else 'disabled'
+            state='normal' if self.converter_available else 'disabled'
+        )
+        self.folder_btn.pack(side='left', padx=10)
+        
+        # Cancel button, only active while a batch is running
+        self.cancel_btn = tk.Button(
+            buttons_frame,
+            text="⏹ Cancel",
+            font=('Arial', 12, 'bold'),
+            bg='#dc3545',
+            fg='white',
+            padx=20,
+            pady=10,
+            command=self.cancel_conversion,
+            state='disabled'
+        )
+        self.cancel_btn.pack(side='left', padx=10)
+        
+        # Parallelism setting
+        jobs_frame = tk.Frame(self.root, bg='#f0f0f0')
+        jobs_frame.pack()
+        
+        jobs_label = tk.Label(
+            jobs_frame,
+            text="Parallel conversions:",
+            font=('Arial', 10),
+            bg='#f0f0f0',
+            fg='#333'
+        )
+        jobs_label.pack(side='left')
+        
+        self.parallel_jobs = tk.IntVar(value=os.cpu_count() or 4)
+        jobs_spinbox = tk.Spinbox(
+            jobs_frame,
+            from_=1,
+            to=64,
+            width=4,
+            textvariable=self.parallel_jobs
         )
-        folder_btn.pack(side='left', padx=10)
+        jobs_spinbox.pack(side='left', padx=5)
+        
+        # Incremental mode
+        self.incremental = tk.BooleanVar(value=True)
+        incremental_check = tk.Checkbutton(
+            jobs_frame,
+            text="Skip files already converted",
+            variable=self.incremental,
+            font=('Arial', 10),
+            bg='#f0f0f0',
+            fg='#333'
+        )
+        incremental_check.pack(side='left', padx=15)
         
         # Progress bar
         self.progress = ttk.Progressbar(
@@ -135,13 +291,13 @@ class HEICConverter:
         self.results_text.pack(pady=10, padx=20, fill='both', expand=True)
         
         # Install instructions
-        if not self.imagemagick_available:
+        if not self.converter_available:
             install_frame = tk.Frame(self.root, bg='#f0f0f0')
             install_frame.pack(pady=10)
             
             install_label = tk.Label(
                 install_frame,
-                text="To install ImageMagick:",
+                text="To install a HEIC converter:",
                 font=('Arial', 10, 'bold'),
                 bg='#f0f0f0',
                 fg='#333'
@@ -158,9 +314,10 @@ class HEICConverter:
             )
             install_text.pack(pady=5)
             
-            install_instructions = """Mac: brew install imagemagick
+            install_instructions = """Any platform: pip install pillow pillow-heif
+Mac: brew install imagemagick
 Windows: Download from https://imagemagick.org/script/download.php
-Linux: sudo apt-get install imagemagick"""
+Linux: sudo apt-get install imagemagick (or libheif-examples)"""
             
             install_text.insert('1.0', install_instructions)
             install_text.config(state='disabled')
@@ -192,82 +349,168 @@ Linux: sudo apt-get install imagemagick"""
                 
     def convert_files(self, file_paths):
         """Convert multiple HEIC files"""
-        if not self.imagemagick_available:
-            messagebox.showerror("Error", "ImageMagick is not installed. Please install it first.")
+        if not self.converter_available:
+            messagebox.showerror("Error", "No HEIC converter is installed. Please install ImageMagick or pillow-heif first.")
+            return
+        
+        if self.batch_running:
+            messagebox.showinfo("Conversion running", "Please wait for the current conversion to finish or cancel it.")
             return
+        
+        try:
+            parallel_jobs = max(1, int(self.parallel_jobs.get()))
+        except (tk.TclError, ValueError):
+            parallel_jobs = os.cpu_count() or 4
+        
+        self.batch_running = True
+        with self.batch_lock:
+            self.batch_cancelled = False
+        self.single_btn.config(state='disabled')
+        self.folder_btn.config(state='disabled')
+        self.cancel_btn.config(state='normal')
+        self.progress.config(value=0)
+        self.results_text.delete('1.0', tk.END)
+        self.results_text.insert(tk.END, f"Converting {len(file_paths)} files ({parallel_jobs} at a time)...\n\n")
             
         # Run conversion in a separate thread
-        thread = threading.Thread(target=self._convert_files_thread, args=(file_paths,))
+        thread = threading.Thread(target=self._convert_files_thread,
+                                  args=(file_paths, parallel_jobs, self.incremental.get()))
         thread.daemon = True
         thread.start()
         
-    def _convert_files_thread(self, file_paths):
-        """Convert files in a separate thread"""
+    def cancel_conversion(self):
+        """Cancel the running batch; files already converting are allowed to finish"""
+        with self.batch_lock:
+            self.batch_cancelled = True
+            for future in self.batch_futures:
+                future.cancel()
+        self.cancel_btn.config(state='disabled')
+        self.status_label.config(text="Cancelling...")
+        
+    def _convert_files_thread(self, file_paths, parallel_jobs, incremental=False):
+        """Convert files on a pool of worker threads, each running its own conversion"""
         total_files = len(file_paths)
         successful = 0
         failed = 0
+        cancelled = 0
+        completed = 0
+        up_to_date = 0
         
-        self.results_text.delete('1.0', tk.END)
-        self.results_text.insert(tk.END, f"Converting {total_files} files...\n\n")
+        # One manifest per output folder; skip files whose JPEG is already current
+        manifests = {}
+        if incremental:
+            pending_paths = []
+            for file_path in file_paths:
+                folder = str(jpeg_output_path(file_path).parent)
+                if folder not in manifests:
+                    manifests[folder] = ConversionManifest(folder)
+                try:
+                    current = manifests[folder].is_up_to_date(file_path, jpeg_output_path(file_path))
+                except OSError:
+                    current = False
+                if current:
+                    up_to_date += 1
+                else:
+                    pending_paths.append(file_path)
+            completed = up_to_date
+            self.root.after(0, lambda p=(completed / total_files) * 100: self.progress.config(value=p))
+            if up_to_date:
+                self.root.after(0, lambda n=up_to_date: 
+                    self.results_text.insert(tk.END, f"⏭ {n} files already up to date\n\n"))
+        else:
+            pending_paths = list(file_paths)
         
-        for i, file_path in enumerate(file_paths):
-            try:
-                # Update progress
-                progress = (i / total_files) * 100
-                self.root.after(0, lambda p=progress: self.progress.config(value=p))
+        def convert_and_record(file_path):
+            output_path = self.convert_heic_to_jpeg(file_path)
+            if output_path and incremental:
+                manifests[str(Path(output_path).parent)].record(file_path, output_path)
+            return output_path
+        
+        with ThreadPoolExecutor(max_workers=parallel_jobs) as executor:
+            with self.batch_lock:
+                # Cancel may have been pressed while the manifests were being checked
+                if self.batch_cancelled:
+                    cancelled = len(pending_paths)
+                    pending_paths = []
+                futures = {executor.submit(convert_and_record, file_path): file_path
+                           for file_path in pending_paths}
+                self.batch_futures = list(futures)
+            
+            # Files finish out of order; count completions rather than positions
+            for future in as_completed(futures):
+                file_path = futures[future]
+                completed += 1
                 
-                # Convert file
-                output_path = self.convert_heic_to_jpeg(file_path)
+                try:
+                    output_path = future.result()
+                    
+                    if output_path:
+                        successful += 1
+                        self.root.after(0, lambda f=file_path, o=output_path: 
+                            self.results_text.insert(tk.END, f"✅ {os.path.basename(f)} → {os.path.basename(o)}\n"))
+                    else:
+                        failed += 1
+                        self.root.after(0, lambda f=file_path: 
+                            self.results_text.insert(tk.END, f"❌ Failed: {os.path.basename(f)}\n"))
                 
-                if output_path:
-                    successful += 1
-                    self.root.after(0, lambda f=file_path, o=output_path: 
-                        self.results_text.insert(tk.END, f"✅ {os.path.basename(f)} → {os.path.basename(o)}\n"))
-                else:
+                except CancelledError:
+                    cancelled += 1
+                            
+                except Exception as e:
                     failed += 1
-                    self.root.after(0, lambda f=file_path: 
-                        self.results_text.insert(tk.END, f"❌ Failed: {os.path.basename(f)}\n"))
-                        
-            except Exception as e:
-                failed += 1
-                self.root.after(0, lambda f=file_path, err=str(e): 
-                    self.results_text.insert(tk.END, f"❌ Error: {os.path.basename(f)} - {err}\n"))
+                    self.root.after(0, lambda f=file_path, err=str(e): 
+                        self.results_text.insert(tk.END, f"❌ Error: {os.path.basename(f)} - {err}\n"))
+                
+                # Update progress
+                progress = (completed / total_files) * 100
+                self.root.after(0, lambda p=progress, c=completed: (
+                    self.progress.config(value=p),
+                    self.status_label.config(text=f"Converting... {c}/{total_files}")))
         
-        # Update final progress
-        self.root.after(0, lambda: self.progress.config(value=100))
+        with self.batch_lock:
+            self.batch_futures = []
+        
+        for manifest in manifests.values():
+            manifest.save()
         
         # Show final results
-        self.root.after(0, lambda: self.results_text.insert(tk.END, 
-            f"\n🎉 Conversion complete!\n✅ Successful: {successful}\n❌ Failed: {failed}\n"))
+        if cancelled:
+            summary = f"\n⏹ Conversion cancelled\n✅ Successful: {successful}\n❌ Failed: {failed}\n⏭ Skipped: {cancelled}\n"
+        else:
+            summary = f"\n🎉 Conversion complete!\n✅ Successful: {successful}\n❌ Failed: {failed}\n"
+        if up_to_date:
+            summary += f"⏭ Already up to date: {up_to_date}\n"
+        self.root.after(0, lambda: self.results_text.insert(tk.END, summary))
             
-        self.root.after(0, lambda: self.status_label.config(text=f"Converted {successful}/{total_files} files"))
+        self.root.after(0, lambda: self.status_label.config(text=f"Converted {successful + up_to_date}/{total_files} files"))
+        self.root.after(0, self._finish_batch)
+        
+    def _finish_batch(self):
+        """Re-enable the buttons once a batch is over"""
+        self.batch_running = False
+        self.single_btn.config(state='normal')
+        self.folder_btn.config(state='normal')
+        self.cancel_btn.config(state='disabled')
         
     def convert_heic_to_jpeg(self, input_path):
-        """Convert a single HEIC file to JPEG using ImageMagick"""
+        """Convert a single HEIC file to JPEG with the best available decoder"""
         try:
             # Create output path
-            input_file = Path(input_path)
-            output_path = input_file.with_suffix('.jpg')
-            
-            # Use ImageMagick to convert
-            cmd = ['convert', str(input_path), '-quality', '90', str(output_path)]
+            output_path = jpeg_output_path(input_path)
             
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            
-            if result.returncode == 0:
-                return str(output_path)
-            else:
-                print(f"ImageMagick error: {result.stderr}")
-                return None
-                
+            self.decoder.convert_file(input_path, output_path, quality=90)
+            return str(output_path)
+
         except Exception as e:
             print(f"Conversion error: {e}")
             return None
 
+
 def main():
     root = tk.Tk()
     app = HEICConverter(root)
     root.mainloop()
 
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,336 @@
+"""
+HEIC to JPEG decoding shared by the desktop converter and the proxy server
+
+There are three backends: pillow_heif in the calling process, ImageMagick
+(magick or convert) and libheif's heif-convert. Which of them is installed
+differs from machine to machine, and none of them reads every file: some
+builds of ImageMagick lack a HEIC delegate, and older libheif versions
+reject some newer iPhone files. A BackendSelector keeps track of which
+backend works, and how fast, for each kind of file and tries the best one
+first. convert_with() does the actual work. It is a plain function, so it
+can run in a worker process while the selector stays with the caller.
+
+Command-line backends work in a private temp directory that is removed
+whatever happens, so a long-running server doesn't fill up /tmp.
+"""
+
+import io
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+
+# pillow_heif is optional; without it only the command-line backends are used
+try:
+    from PIL import Image
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+except ImportError:
+    Image = None
+    pillow_heif = None
+
+WORKDIR_PREFIX = 'heic-decode-'
+DEFAULT_TIMEOUT = 120  # seconds a command-line converter may run
+DEFAULT_ORDER = ('pillow', 'heif-convert', 'imagemagick')
+
+# jpeg is the output, backend the name of the one that produced it, and attempts
+# a list of (backend, seconds, error) for every backend tried, error being None on success
+Conversion = namedtuple('Conversion', 'jpeg backend attempts')
+
+
+class DecodeError(Exception):
+    """Raised when no backend could convert a file; attempts lists what each one said"""
+
+    def __init__(self, attempts):
+        details = '; '.join(f"{backend}: {error}" for backend, _, error in attempts)
+        super().__init__(f"HEIC conversion failed ({details})" if attempts else "No HEIC decoder is available")
+        self.attempts = attempts
+
+    def __reduce__(self):
+        # Keep attempts when the error comes back from a worker process
+        return (DecodeError, (self.attempts,))
+
+
+class Backend(ABC):
+    """One way of turning HEIC bytes, or the HEIC file at a path, into JPEG bytes"""
+
+    name = None
+    label = None
+
+    @abstractmethod
+    def available(self):
+        """True if the backend can run on this machine"""
+
+    @abstractmethod
+    def convert(self, source, quality, timeout=DEFAULT_TIMEOUT):
+        """JPEG bytes of source (HEIC bytes or a path); raises on any failure"""
+
+
+class PillowHeifBackend(Backend):
+    """Decodes in the calling process with pillow_heif (libheif linked into Python)"""
+
+    name = 'pillow'
+    label = 'pillow-heif'
+
+    def available(self):
+        return pillow_heif is not None
+
+    def convert(self, source, quality, timeout=DEFAULT_TIMEOUT):
+        image = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+
+        # Convert to RGB if necessary
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+
+        jpeg_buffer = io.BytesIO()
+        image.save(jpeg_buffer, format='JPEG', quality=quality)
+        return jpeg_buffer.getvalue()
+
+
+class CommandBackend(Backend):
+    """Runs a command-line converter on a file in a private temp directory"""
+
+    executables = ()
+
+    def __init__(self):
+        self._executable = None
+        self._checked = False
+
+    def executable(self):
+        """Full path of the first of executables found on PATH, or None"""
+        if not self._checked:
+            self._executable = next(filter(None, map(shutil.which, self.executables)), None)
+            self._checked = True
+        return self._executable
+
+    def available(self):
+        return self.executable() is not None
+
+    @abstractmethod
+    def command(self, input_path, output_path, quality):
+        """The argument list that converts input_path to a JPEG at output_path"""
+
+    def convert(self, source, quality, timeout=DEFAULT_TIMEOUT):
+        with tempfile.TemporaryDirectory(prefix=WORKDIR_PREFIX) as workdir:
+            input_path = source
+            if not isinstance(source, str):
+                input_path = os.path.join(workdir, 'input.heic')
+                with open(input_path, 'wb') as f:
+                    f.write(source)
+            output_path = os.path.join(workdir, 'output.jpg')
+
+            result = subprocess.run(self.command(input_path, output_path, quality),
+                                    capture_output=True, text=True, timeout=timeout)
+            if result.returncode != 0:
+                raise RuntimeError(f"{self.label} exited with {result.returncode}: {result.stderr.strip()[:500]}")
+
+            output_path = self.find_output(workdir, output_path)
+            with open(output_path, 'rb') as f:
+                return f.read()
+
+    def find_output(self, workdir, output_path):
+        if not os.path.exists(output_path):
+            raise RuntimeError(f"{self.label} wrote no output")
+        return output_path
+
+
+class ImageMagickBackend(CommandBackend):
+    """ImageMagick 7's magick, or convert from ImageMagick 6"""
+
+    name = 'imagemagick'
+    label = 'ImageMagick'
+    # Windows ships an unrelated convert.exe (it converts FAT volumes to NTFS)
+    executables = ('magick',) if os.name == 'nt' else ('magick', 'convert')
+
+    def command(self, input_path, output_path, quality):
+        return [self.executable(), input_path, '-quality', str(quality), output_path]
+
+
+class HeifConvertBackend(CommandBackend):
+    """libheif's own converter, named heif-dec since libheif 1.17"""
+
+    name = 'heif-convert'
+    label = 'heif-convert'
+    executables = ('heif-dec', 'heif-convert')
+
+    def command(self, input_path, output_path, quality):
+        return [self.executable(), '-q', str(quality), input_path, output_path]
+
+    def find_output(self, workdir, output_path):
+        # Files holding several images come out as output-1.jpg, output-2.jpg, ... with the primary first
+        if not os.path.exists(output_path):
+            numbered = sorted((name for name in os.listdir(workdir)
+                               if name.startswith('output-') and name.endswith('.jpg')),
+                              key=lambda name: int(name[7:-4]) if name[7:-4].isdigit() else 0)
+            if numbered:
+                return os.path.join(workdir, numbered[0])
+        return super().find_output(workdir, output_path)
+
+
+BACKENDS = {backend.name: backend for backend in (PillowHeifBackend(), HeifConvertBackend(), ImageMagickBackend())}
+
+
+def convert_with(names, source, quality, timeout=DEFAULT_TIMEOUT):
+    """Try the named backends in order and return the Conversion of the first that works
+
+    source is HEIC bytes or a path. Raises DecodeError with every attempt
+    if none of them worked.
+    """
+    attempts = []
+    for name in names:
+        started = time.perf_counter()
+        try:
+            jpeg_data = BACKENDS[name].convert(source, quality, timeout)
+        except Exception as e:
+            attempts.append((name, time.perf_counter() - started, str(e) or type(e).__name__))
+            continue
+        attempts.append((name, time.perf_counter() - started, None))
+        return Conversion(jpeg_data, name, attempts)
+    raise DecodeError(attempts)
+
+
+def file_signature(source):
+    """What kind of HEIF file this is, from the brands in its ftyp box: 'heic/mif1,heic,miaf' or 'unknown'"""
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            header = f.read(64)
+    else:
+        header = bytes(source[:64])
+
+    if len(header) < 16 or header[4:8] != b'ftyp':
+        return 'unknown'
+    box_end = min(int.from_bytes(header[:4], 'big'), len(header))
+    major = header[8:12]
+    compatible = [header[i:i + 4] for i in range(16, box_end - 3, 4)]
+    brands = [brand.decode('ascii', 'replace').strip() for brand in [major] + compatible]
+    return f"{brands[0]}/{','.join(sorted(set(brands[1:])))}"
+
+
+def source_size(source):
+    return os.path.getsize(source) if isinstance(source, str) else len(source)
+
+
+def remove_stale_workdirs(older_than=3600):
+    """Delete temp directories left behind by converters that were killed mid-run"""
+    root = tempfile.gettempdir()
+    cutoff = time.time() - older_than
+    removed = 0
+    try:
+        entries = list(os.scandir(root))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.name.startswith(WORKDIR_PREFIX) and entry.is_dir() and entry.stat().st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+
+class BackendSelector:
+    """Orders the installed backends for each kind of file by what has worked and how fast
+
+    Files are grouped by file_signature(). A backend that failed on a file
+    that another backend then converted is moved behind the others for that
+    signature. If every backend fails, the file is blamed and not the
+    backends. Backends that work are ordered by a moving average of the
+    seconds they took per megabyte of input. One that hasn't been timed on a
+    signature yet goes first once every explore_every conversions, so it
+    gets measured too. It is thread-safe.
+    """
+
+    SMOOTHING = 0.3  # weight of the newest timing in the moving average
+
+    def __init__(self, names=DEFAULT_ORDER, explore_every=20):
+        unknown = [name for name in names if name not in BACKENDS]
+        if unknown:
+            raise ValueError(f"Unknown HEIC backends: {', '.join(unknown)} (choose from {', '.join(BACKENDS)})")
+        self.names = [name for name in names if BACKENDS[name].available()]
+        self.explore_every = explore_every
+        self.speed = {}
+        self.failures = {}
+        self.conversions = {}
+        self.lock = threading.Lock()
+
+    def order(self, signature):
+        """Backend names to try for a file with this signature, best first"""
+        with self.lock:
+            count = self.conversions.get(signature, 0)
+            self.conversions[signature] = count + 1
+            working = [name for name in self.names if not self.failures.get((signature, name))]
+            failing = [name for name in self.names if self.failures.get((signature, name))]
+
+            measured = sorted((name for name in working if (signature, name) in self.speed),
+                              key=lambda name: self.speed[signature, name])
+            unmeasured = [name for name in working if (signature, name) not in self.speed]
+            if unmeasured and (not measured or count % self.explore_every == 0):
+                return unmeasured[:1] + measured + unmeasured[1:] + failing
+            return measured + unmeasured + failing
+
+    def record(self, signature, size, attempts, succeeded):
+        """Learn from the attempts of one conversion"""
+        megabytes = max(size / (1024 * 1024), 0.1)
+        with self.lock:
+            for name, seconds, error in attempts:
+                key = (signature, name)
+                if error is None:
+                    rate = seconds / megabytes
+                    previous = self.speed.get(key)
+                    self.speed[key] = rate if previous is None else previous + self.SMOOTHING * (rate - previous)
+                    self.failures.pop(key, None)
+                elif succeeded:
+                    self.failures[key] = self.failures.get(key, 0) + 1
+
+    def stats(self):
+        with self.lock:
+            signatures = {}
+            for (signature, name), rate in self.speed.items():
+                signatures.setdefault(signature, {}).setdefault(name, {})['secondsPerMB'] = round(rate, 4)
+            for (signature, name), count in self.failures.items():
+                signatures.setdefault(signature, {}).setdefault(name, {})['failures'] = count
+            return {'backends': list(self.names), 'signatures': signatures}
+
+
+class HeicDecoder:
+    """Converts HEIC files in the calling thread with the best backend a BackendSelector knows of"""
+
+    def __init__(self, selector=None, timeout=DEFAULT_TIMEOUT):
+        self.selector = selector or BackendSelector()
+        self.timeout = timeout
+
+    def available(self):
+        """Labels of the installed backends"""
+        return [BACKENDS[name].label for name in self.selector.names]
+
+    def convert(self, source, quality):
+        """Convert HEIC bytes or a file path; returns a Conversion or raises DecodeError"""
+        signature = file_signature(source)
+        try:
+            conversion = convert_with(self.selector.order(signature), source, quality, self.timeout)
+        except DecodeError as e:
+            self.selector.record(signature, source_size(source), e.attempts, False)
+            raise
+        self.selector.record(signature, source_size(source), conversion.attempts, True)
+        return conversion
+
+    def convert_file(self, input_path, output_path, quality):
+        """Convert a file to a JPEG at output_path, which is replaced only once the JPEG is complete"""
+        conversion = self.convert(str(input_path), quality)
+        fd, temp_path = tempfile.mkstemp(prefix='.', suffix='.tmp', dir=os.path.dirname(os.path.abspath(output_path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(conversion.jpeg)
+            os.replace(temp_path, output_path)
+        except BaseException:
+            try:
+                os.unlink(temp_path)
+            except OSError:
+                pass
+            raise
+        return conversion
@@ -0,0 +1,231 @@
+"""
+The SQLite store behind the proxy's /api/library
+
+Every user's books share one table, a row per book, so saving one edit
+writes one row instead of the whole library. An FTS5 index over titles and
+authors answers searches without loading the library.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+
+
+class LibraryConflictError(Exception):
+    """Raised when a book is appended with an id the library already holds"""
+
+
+class LibraryStore:
+    """Per-user book libraries in SQLite with a full-text index over title and authors
+
+    Each book is one row holding its JSON, so adding or editing a book writes
+    that row alone. Rows keep their insertion order in seq, which listing pages
+    through with a keyset cursor. Triggers keep the FTS5 index in step with the
+    table; on SQLite builds without FTS5, search falls back to LIKE.
+    """
+
+    EXPORT_BATCH = 500
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = None
+        self.fts = False
+        self.lock = threading.Lock()
+
+    def _connect(self):
+        if self.connection is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript('''
+                CREATE TABLE IF NOT EXISTS library_books (
+                    seq INTEGER PRIMARY KEY,
+                    user TEXT NOT NULL,
+                    id TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    authors TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    UNIQUE (user, id)
+                );
+                CREATE INDEX IF NOT EXISTS library_books_user ON library_books (user);
+            ''')
+            try:
+                connection.executescript('''
+                    CREATE VIRTUAL TABLE IF NOT EXISTS library_fts USING fts5(
+                        title, authors, content='library_books', content_rowid='seq',
+                        tokenize='unicode61 remove_diacritics 2'
+                    );
+                    CREATE TRIGGER IF NOT EXISTS library_books_insert AFTER INSERT ON library_books BEGIN
+                        INSERT INTO library_fts (rowid, title, authors) VALUES (new.seq, new.title, new.authors);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS library_books_delete AFTER DELETE ON library_books BEGIN
+                        INSERT INTO library_fts (library_fts, rowid, title, authors)
+                        VALUES ('delete', old.seq, old.title, old.authors);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS library_books_update AFTER UPDATE ON library_books BEGIN
+                        INSERT INTO library_fts (library_fts, rowid, title, authors)
+                        VALUES ('delete', old.seq, old.title, old.authors);
+                        INSERT INTO library_fts (rowid, title, authors) VALUES (new.seq, new.title, new.authors);
+                    END;
+                ''')
+                self.fts = True
+            except sqlite3.OperationalError as e:
+                print(f"Full-text search unavailable, library search will use LIKE: {e}")
+            self.connection = connection
+        return self.connection
+
+    @staticmethod
+    def _row(user, book, now):
+        """Column values for a book, giving it an id if it has none"""
+        if not isinstance(book, dict):
+            raise ValueError("Each book must be a JSON object")
+        if book.get('id') in (None, ''):
+            book = {**book, 'id': uuid.uuid4().hex}
+        authors = book.get('authors') or []
+        if isinstance(authors, list):
+            authors = ', '.join(str(author) for author in authors)
+        return (user, str(book['id']), str(book.get('title') or ''), str(authors),
+                json.dumps(book, separators=(',', ':')), now), book
+
+    def append(self, user, book):
+        """Add one book and return it (with its id)"""
+        row, book = self._row(user, book, time.time())
+        with self.lock:
+            try:
+                self._connect().execute(
+                    'INSERT INTO library_books (user, id, title, authors, data, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?)', row
+                )
+            except sqlite3.IntegrityError:
+                raise LibraryConflictError(f"Book {row[1]} already exists") from None
+        return book
+
+    def import_books(self, user, books, replace=False):
+        """Upsert many books in one transaction; replace drops the user's other books first"""
+        now = time.time()
+        rows = [self._row(user, book, now)[0] for book in books]
+        with self.lock:
+            connection = self._connect()
+            connection.execute('BEGIN')
+            try:
+                if replace:
+                    connection.execute('DELETE FROM library_books WHERE user = ?', (user,))
+                connection.executemany(
+                    'INSERT INTO library_books (user, id, title, authors, data, updated_at) '
+                    'VALUES (?, ?, ?, ?, ?, ?) '
+                    'ON CONFLICT (user, id) DO UPDATE SET title = excluded.title, authors = excluded.authors, '
+                    'data = excluded.data, updated_at = excluded.updated_at',
+                    rows
+                )
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        return len(rows)
+
+    def get(self, user, book_id):
+        with self.lock:
+            row = self._connect().execute(
+                'SELECT data FROM library_books WHERE user = ? AND id = ?', (user, book_id)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def patch(self, user, book_id, changes):
+        """Merge changes into one book (null removes a field) and return it, or None if missing"""
+        if not isinstance(changes, dict):
+            raise ValueError("Patch body must be a JSON object")
+        with self.lock:
+            connection = self._connect()
+            connection.execute('BEGIN')
+            try:
+                row = connection.execute(
+                    'SELECT data FROM library_books WHERE user = ? AND id = ?', (user, book_id)
+                ).fetchone()
+                if row is None:
+                    connection.execute('ROLLBACK')
+                    return None
+                book = json.loads(row[0])
+                for key, value in changes.items():
+                    if key == 'id':
+                        continue
+                    if value is None:
+                        book.pop(key, None)
+                    else:
+                        book[key] = value
+                values = self._row(user, book, time.time())[0]
+                connection.execute(
+                    'UPDATE library_books SET title = ?, authors = ?, data = ?, updated_at = ? '
+                    'WHERE user = ? AND id = ?',
+                    (*values[2:], user, book_id)
+                )
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+        return book
+
+    def delete(self, user, book_id):
+        with self.lock:
+            cursor = self._connect().execute(
+                'DELETE FROM library_books WHERE user = ? AND id = ?', (user, book_id)
+            )
+        return cursor.rowcount > 0
+
+    def list(self, user, limit, cursor=None):
+        """Return (books, next_cursor, total) in insertion order, starting after cursor"""
+        after = int(cursor) if cursor else 0
+        with self.lock:
+            connection = self._connect()
+            rows = connection.execute(
+                'SELECT seq, data FROM library_books WHERE user = ? AND seq > ? ORDER BY seq LIMIT ?',
+                (user, after, limit + 1)
+            ).fetchall()
+            total = connection.execute('SELECT COUNT(*) FROM library_books WHERE user = ?', (user,)).fetchone()[0]
+        next_cursor = str(rows[limit - 1][0]) if len(rows) > limit else None
+        return [json.loads(data) for _, data in rows[:limit]], next_cursor, total
+
+    def search(self, user, query, limit, cursor=None):
+        """Return (books, next_cursor) matching every word of query as a prefix, best matches first"""
+        words = re.findall(r'\w+', query)
+        if not words:
+            return [], None
+        offset = int(cursor) if cursor else 0
+        with self.lock:
+            connection = self._connect()
+            if self.fts:
+                match = ' '.join(f'"{word}"*' for word in words)
+                rows = connection.execute(
+                    'SELECT b.data FROM library_fts JOIN library_books b ON b.seq = library_fts.rowid '
+                    'WHERE library_fts MATCH ? AND b.user = ? ORDER BY library_fts.rank LIMIT ? OFFSET ?',
+                    (match, user, limit + 1, offset)
+                ).fetchall()
+            else:
+                conditions = ' AND '.join('(title LIKE ? OR authors LIKE ?)' for _ in words)
+                patterns = [pattern for word in words for pattern in (f'%{word}%', f'%{word}%')]
+                rows = connection.execute(
+                    f'SELECT data FROM library_books WHERE user = ? AND {conditions} ORDER BY seq LIMIT ? OFFSET ?',
+                    (user, *patterns, limit + 1, offset)
+                ).fetchall()
+        next_cursor = str(offset + limit) if len(rows) > limit else None
+        return [json.loads(data) for (data,) in rows[:limit]], next_cursor
+
+    def export(self, user):
+        """Yield the stored JSON of every book, fetched in batches so the lock is never held for long"""
+        after = 0
+        while True:
+            with self.lock:
+                rows = self._connect().execute(
+                    'SELECT seq, data FROM library_books WHERE user = ? AND seq > ? ORDER BY seq LIMIT ?',
+                    (user, after, self.EXPORT_BATCH)
+                ).fetchall()
+            for _, data in rows:
+                yield data
+            if len(rows) < self.EXPORT_BATCH:
+                return
+            after = rows[-1][0]
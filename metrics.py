@@ -0,0 +1,100 @@
+"""
+Prometheus metrics for the proxy server
+
+Metrics is a small registry of counters, gauges and histograms that the
+handlers update on every request and that /metrics renders in the
+Prometheus text exposition format. CountingWriter sits in front of a
+handler's output stream so response sizes can be measured.
+"""
+
+import bisect
+import threading
+from collections import OrderedDict
+
+
+class Metrics:
+    """Small thread-safe registry of counters, gauges and histograms in Prometheus text format
+
+    Every update is one lock acquisition and a dict lookup (plus a bisect for
+    histograms), so it is cheap enough to call on every request.
+    """
+
+    LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+    SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+    # Label values escape backslash, double quote and newline
+    LABEL_ESCAPES = str.maketrans({'\\': '\\\\', '"': '\\"', '\n': '\\n'})
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.families = OrderedDict()  # name -> (type, help, buckets)
+        self.values = {}  # (name, labels) -> value, or [bucket counts, sum, count] for histograms
+
+    def describe(self, name, metric_type, help_text, buckets=None):
+        self.families[name] = (metric_type, help_text, buckets)
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + value
+
+    def set(self, name, labels=(), value=0):
+        with self.lock:
+            self.values[(name, labels)] = value
+
+    def observe(self, name, labels, value):
+        buckets = self.families[name][2]
+        key = (name, labels)
+        index = bisect.bisect_left(buckets, value)
+        with self.lock:
+            histogram = self.values.get(key)
+            if histogram is None:
+                histogram = self.values[key] = [[0] * (len(buckets) + 1), 0.0, 0]
+            histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def render(self):
+        with self.lock:
+            snapshot = {key: (list(value[0]), value[1], value[2]) if isinstance(value, list) else value
+                        for key, value in self.values.items()}
+        
+        lines = []
+        for name, (metric_type, help_text, buckets) in self.families.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (metric_name, labels), value in sorted(snapshot.items(), key=lambda item: item[0]):
+                if metric_name != name:
+                    continue
+                if metric_type != 'histogram':
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip((*buckets, '+Inf'), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{self._labels(labels + (('le', str(bound)),))} {cumulative}")
+                lines.append(f"{name}_sum{self._labels(labels)} {total}")
+                lines.append(f"{name}_count{self._labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+    @classmethod
+    def _labels(cls, labels):
+        if not labels:
+            return ''
+        escaped = (f'{key}="{str(value).translate(cls.LABEL_ESCAPES)}"' for key, value in labels)
+        return '{' + ','.join(escaped) + '}'
+
+
+class CountingWriter:
+    """Wraps a handler's wfile to count the bytes sent"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.bytes_written += len(data)
+        return self.raw.write(data)
+
+    def __getattr__(self, name):
+        return getattr(self.raw, name)
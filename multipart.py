@@ -0,0 +1,245 @@
+"""
+Request body reading for the proxy server: size limits and a streaming multipart parser
+
+parse_multipart() reads a multipart/form-data body as it arrives and
+writes every part to a SpooledUpload, which moves to a temp file once it
+passes its threshold. A 50 MB photo is never held in memory whole, and the
+HEIC workers can open the spooled file by path. Limits are enforced while
+reading, and a body that breaks them raises RequestBodyError with the HTTP
+status to answer with.
+"""
+
+import io
+import os
+import tempfile
+from email.message import Message
+from email.parser import BytesHeaderParser
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024  # bytes per uploaded file
+DEFAULT_SPOOL_THRESHOLD = 1024 * 1024  # larger parts go to a temp file
+MAX_PARTS = 32
+MAX_FIELD_BYTES = 1024 * 1024  # non-file fields are kept in memory
+MAX_HEADER_BYTES = 16 * 1024
+CHUNK_SIZE = 64 * 1024
+
+
+class RequestBodyError(Exception):
+    """Raised when a request body is missing, too large or malformed; status is the HTTP code to answer with"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class BoundedReader:
+    """File-like view of exactly length bytes of a request body
+
+    Keeps a parser from reading past the end of the request into the next
+    one on the connection, and turns a client that hangs up early into a
+    RequestBodyError instead of a short read.
+    """
+
+    def __init__(self, raw, length):
+        self.raw = raw
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.raw.read(size)
+        if not data:
+            raise RequestBodyError(400, "Request body ended early")
+        self.remaining -= len(data)
+        return data
+
+
+class SpooledUpload:
+    """An uploaded file, kept in memory while small and moved to a temp file past threshold bytes
+
+    The temp file has a real path so conversion workers and command-line
+    tools can open it directly instead of receiving a copy of the bytes.
+    Call close() to delete it.
+    """
+
+    def __init__(self, name=None, filename=None, content_type=None, max_size=DEFAULT_MAX_SIZE,
+                 threshold=DEFAULT_SPOOL_THRESHOLD):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.max_size = max_size
+        self.threshold = threshold
+        self.size = 0
+        self.path = None
+        self.buffer = io.BytesIO()
+        self.file = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.size > self.max_size:
+            raise RequestBodyError(413, f"Upload is larger than {self.max_size} bytes")
+        if self.file is None and self.path is None and self.size > self.threshold:
+            suffix = os.path.splitext(self.filename or '')[1][:16]
+            fd, self.path = tempfile.mkstemp(prefix='upload-', suffix=suffix)
+            self.file = os.fdopen(fd, 'wb')
+            self.file.write(self.buffer.getvalue())
+            self.buffer = None
+        (self.file or self.buffer).write(data)
+
+    def finish(self):
+        """Flush a spooled file so it can be opened by path"""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+    def source(self):
+        """The temp file's path if the upload was spooled, otherwise its bytes"""
+        return self.path if self.path is not None else self.buffer.getvalue()
+
+    def open(self):
+        """A binary file object over the upload, positioned at the start"""
+        if self.path is not None:
+            return open(self.path, 'rb')
+        return io.BytesIO(self.buffer.getvalue())
+
+    def read(self):
+        with self.open() as f:
+            return f.read()
+
+    def close(self):
+        self.finish()
+        if self.path is not None:
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+            self.path = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class MultipartForm:
+    """The parts of a multipart/form-data body, by field name; a context manager that deletes spooled files"""
+
+    def __init__(self):
+        self.parts = {}
+
+    def __contains__(self, name):
+        return name in self.parts
+
+    def get(self, name):
+        """The first part with this name, or None"""
+        parts = self.parts.get(name)
+        return parts[0] if parts else None
+
+    def getfirst(self, name, default=None):
+        """The first value of a text field, decoded as UTF-8"""
+        part = self.get(name)
+        if part is None:
+            return default
+        return part.read().decode('utf-8', 'replace')
+
+    def close(self):
+        for parts in self.parts.values():
+            for part in parts:
+                part.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+def multipart_boundary(content_type):
+    """The boundary parameter of a multipart/form-data Content-Type"""
+    message = Message()
+    message['Content-Type'] = content_type
+    boundary = message.get_param('boundary')
+    if message.get_content_type() != 'multipart/form-data' or not boundary:
+        raise RequestBodyError(400, "Expected multipart/form-data with a boundary")
+    return boundary.encode('latin-1')
+
+
+def parse_multipart(stream, content_type, max_part_size=DEFAULT_MAX_SIZE, max_parts=MAX_PARTS,
+                    spool_threshold=DEFAULT_SPOOL_THRESHOLD):
+    """Parse a multipart/form-data body incrementally into a MultipartForm
+
+    Reads the stream in CHUNK_SIZE pieces and writes each part into a
+    SpooledUpload as it goes, so memory use is about one chunk plus
+    spool_threshold per part however large the upload is.
+    """
+    delimiter = b'--' + multipart_boundary(content_type)
+    separator = b'\r\n' + delimiter
+    form = MultipartForm()
+    buffer = bytearray()
+    
+    def fill():
+        data = stream.read(CHUNK_SIZE)
+        if not data:
+            raise RequestBodyError(400, "Multipart body ended before its closing boundary")
+        buffer.extend(data)
+    
+    try:
+        # Skip the preamble up to the first boundary
+        while True:
+            index = buffer.find(delimiter)
+            if index >= 0:
+                del buffer[:index + len(delimiter)]
+                break
+            del buffer[:max(0, len(buffer) - len(delimiter))]
+            fill()
+        
+        part_count = 0
+        while True:
+            while len(buffer) < 2:
+                fill()
+            if buffer[:2] == b'--':
+                return form
+            
+            while True:
+                index = buffer.find(b'\r\n\r\n')
+                if index >= 0:
+                    break
+                if len(buffer) > MAX_HEADER_BYTES:
+                    raise RequestBodyError(400, "Multipart part headers are too large")
+                fill()
+            # The rest of the boundary line (normally just CRLF) comes before the headers
+            headers = BytesHeaderParser().parsebytes(bytes(buffer[:index]).split(b'\r\n', 1)[-1] + b'\r\n\r\n')
+            del buffer[:index + 4]
+            
+            part_count += 1
+            if part_count > max_parts:
+                raise RequestBodyError(400, f"More than {max_parts} multipart parts")
+            name = headers.get_param('name', header='content-disposition')
+            filename = headers.get_filename()
+            part = SpooledUpload(
+                name=name,
+                filename=filename,
+                content_type=headers.get_content_type() if 'content-type' in headers else None,
+                max_size=max_part_size if filename is not None else MAX_FIELD_BYTES,
+                threshold=spool_threshold,
+            )
+            form.parts.setdefault(name, []).append(part)
+            
+            while True:
+                index = buffer.find(separator)
+                if index >= 0:
+                    part.write(buffer[:index])
+                    del buffer[:index + len(separator)]
+                    break
+                # Keep enough of the tail to recognise a separator split across reads
+                safe = len(buffer) - len(separator) + 1
+                if safe > 0:
+                    part.write(buffer[:safe])
+                    del buffer[:safe]
+                fill()
+            part.finish()
+    except BaseException:
+        form.close()
+        raise
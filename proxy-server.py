@@ -4,19 +4,45 @@ Simple proxy server to handle OpenAI API calls and avoid CORS issues
 Now includes HEIC to JPEG conversion capability
 """
 
+import http.client
 import http.server
 import socketserver
 import json
-import urllib.request
+import time
 import urllib.parse
 from urllib.error import HTTPError
 import os
+import re
 import base64
+import binascii
+import hashlib
 import io
-from PIL import Image
+import random
+from collections import OrderedDict
+import contextlib
+import sqlite3
+import zipfile
+from email.utils import parsedate_to_datetime
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageOps
 import pillow_heif
-import subprocess
-import tempfile
+
+import heic_decode
+from book_cache import BookLookupCache
+from cache import ContentCache, SingleFlight
+from connection_pool import ConnectionPool
+from conversion_pool import (ConversionPool, ConversionQueueFullError, ConversionTimeoutError, PreviewDecodeError,
+                             heic_cache_key)
+from firebase_auth import AuthenticationError, FirebaseTokenVerifier
+from frame_index import FrameIndex, frame_hash
+from heic_batch import ZIP_CONTENT_TYPES, ChunkedWriter, HeicBatch, batch_output_name, zip_batch_items
+from library_store import LibraryConflictError, LibraryStore
+from metrics import CountingWriter, Metrics
+from multipart import BoundedReader, RequestBodyError, SpooledUpload, parse_multipart
+from scheduler import RequestExpiredError, UpstreamBusyError, UpstreamScheduler
+from server import PreforkMaster, ThreadPoolHTTPServer
+from static_files import StaticFileCache, is_private_static_path
+from streaming import ChatStreamAssembler, StreamRelay, completion_as_events
 
 # Register HEIC plugin
 pillow_heif.register_heif_opener()
@@ -24,29 +50,1120 @@ pillow_heif.register_heif_opener()
 # Get OpenAI API key from environment variable
 OPENAI_API_KEY = os.getenv('OPENAI_API_KEY')
 
+# Databases live here, outside the current directory that is served as static files
+DATA_DIR = os.getenv('PROXY_DATA_DIR') or os.path.join(
+    os.getenv('XDG_DATA_HOME') or os.path.join(os.path.expanduser('~'), '.local', 'share'), 'bookshelf-scanner')
+
+# Server concurrency settings
+PORT = int(os.getenv('PROXY_PORT', '8080'))
+SERVER_MODE = os.getenv('PROXY_SERVER_MODE', 'threaded')  # 'threaded', 'single' or 'prefork'
+WORKER_THREADS = int(os.getenv('PROXY_WORKER_THREADS', '16'))
+PREFORK_PROCESSES = int(os.getenv('PROXY_PROCESSES', str(os.cpu_count() or 2)))
+GRACEFUL_TIMEOUT = float(os.getenv('PROXY_GRACEFUL_TIMEOUT', '30'))  # seconds a stopping worker may finish requests
+REQUEST_QUEUE_SIZE = int(os.getenv('PROXY_QUEUE_SIZE', '64'))
+MAX_UPSTREAM_INFLIGHT = int(os.getenv('MAX_UPSTREAM_INFLIGHT', '8'))
+UPSTREAM_WAIT_TIMEOUT = float(os.getenv('UPSTREAM_WAIT_TIMEOUT', '30'))
+RETRY_AFTER_SECONDS = int(os.getenv('PROXY_RETRY_AFTER', '2'))
+SERVER_OPTIONS = {'worker_threads': WORKER_THREADS, 'queue_size': REQUEST_QUEUE_SIZE,
+                  'retry_after': RETRY_AFTER_SECONDS}
+
+# Upstream budget shared by everyone behind this proxy's API key
+OPENAI_RPM_LIMIT = int(os.getenv('OPENAI_RPM_LIMIT', '500'))  # 0 disables the request bucket
+OPENAI_TPM_LIMIT = int(os.getenv('OPENAI_TPM_LIMIT', '200000'))  # 0 disables the token bucket
+OPENAI_IMAGE_TOKEN_ESTIMATE = int(os.getenv('OPENAI_IMAGE_TOKEN_ESTIMATE', '765'))
+OPENAI_MAX_RETRIES = int(os.getenv('OPENAI_MAX_RETRIES', '3'))
+OPENAI_RETRY_BASE_DELAY = float(os.getenv('OPENAI_RETRY_BASE_DELAY', '1'))
+OPENAI_RETRY_MAX_DELAY = float(os.getenv('OPENAI_RETRY_MAX_DELAY', '20'))
+LIVE_FRAME_MAX_AGE = float(os.getenv('LIVE_FRAME_MAX_AGE', '5'))  # seconds before a queued live frame is dropped
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+METRICS = Metrics()
+METRICS.describe('proxy_requests_total', 'counter', 'HTTP requests handled, by route, method and status')
+METRICS.describe('proxy_request_duration_seconds', 'histogram', 'Time to handle a request, by route',
+                 Metrics.LATENCY_BUCKETS)
+METRICS.describe('proxy_request_size_bytes', 'histogram', 'Request body size, by route', Metrics.SIZE_BUCKETS)
+METRICS.describe('proxy_response_size_bytes', 'histogram', 'Response size, by route', Metrics.SIZE_BUCKETS)
+METRICS.describe('proxy_requests_in_flight', 'gauge', 'Requests currently being handled, by route')
+METRICS.describe('proxy_request_queue_depth', 'gauge', 'Connections waiting for a worker thread')
+METRICS.describe('proxy_upstream_requests_total', 'counter', 'Calls to upstream APIs, by upstream and status')
+METRICS.describe('proxy_upstream_duration_seconds', 'histogram', 'Upstream call duration, by upstream',
+                 Metrics.LATENCY_BUCKETS)
+METRICS.describe('proxy_upstream_in_flight', 'gauge', 'Upstream calls currently in progress')
+METRICS.describe('proxy_upstream_retries_total', 'counter', 'OpenAI calls retried by the proxy, by status')
+METRICS.describe('proxy_upstream_dropped_total', 'counter', 'OpenAI calls dropped past their deadline, by priority')
+METRICS.describe('proxy_upstream_waiting', 'gauge', 'OpenAI calls queued for the scheduler, by priority')
+METRICS.describe('proxy_stream_first_chunk_seconds', 'histogram',
+                 'Time from a streaming request to its first relayed chunk', Metrics.LATENCY_BUCKETS)
+METRICS.describe('proxy_heic_conversions_total', 'counter', 'HEIC conversions, by backend and result')
+METRICS.describe('proxy_heic_conversion_duration_seconds', 'histogram', 'HEIC conversion duration, by backend',
+                 Metrics.LATENCY_BUCKETS)
+METRICS.describe('proxy_cache_hits_total', 'counter', 'Cache hits, by cache')
+METRICS.describe('proxy_cache_misses_total', 'counter', 'Cache misses, by cache')
+METRICS.describe('proxy_cache_bytes', 'gauge', 'Bytes held by a cache, by cache and tier')
+METRICS.describe('proxy_coalesced_requests_total', 'counter', 'OpenAI requests answered by an identical in-flight call')
+
+# Routes with their own metrics labels; everything else is reported as static
+METRIC_ROUTES = {'/api/openai', '/api/openai-image', '/api/scan-shelf', '/api/convert-heic',
+                 '/api/convert-heic-direct', '/api/convert-heic-batch', '/api/heic-preview',
+                 '/api/books/lookup', '/api/library', '/api/stats', '/metrics'}
+
+
+def record_conversion(backend, result, started):
+    """Count a HEIC conversion attempt and how long it took"""
+    record_conversion_seconds(backend, result, time.perf_counter() - started)
+
+
+def record_conversion_seconds(backend, result, seconds):
+    METRICS.inc('proxy_heic_conversions_total', (('backend', backend), ('result', result)))
+    METRICS.observe('proxy_heic_conversion_duration_seconds', (('backend', backend),), seconds)
+
+
+# Upstream connection settings
+OPENAI_BASE_URL = os.getenv('OPENAI_BASE_URL', 'https://api.openai.com/v1')
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', str(MAX_UPSTREAM_INFLIGHT)))
+UPSTREAM_IDLE_TIMEOUT = float(os.getenv('UPSTREAM_IDLE_TIMEOUT', '60'))
+UPSTREAM_TIMEOUT = float(os.getenv('UPSTREAM_TIMEOUT', '120'))
+
+OPENAI_POOL = ConnectionPool(OPENAI_BASE_URL, pool_size=UPSTREAM_POOL_SIZE, idle_timeout=UPSTREAM_IDLE_TIMEOUT,
+                             timeout=UPSTREAM_TIMEOUT)
+
+# OpenAI response cache settings (set both max entries and dir to disable)
+OPENAI_CACHE_MAX_ENTRIES = int(os.getenv('OPENAI_CACHE_MAX_ENTRIES', '512'))
+OPENAI_CACHE_MAX_BYTES = int(os.getenv('OPENAI_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+OPENAI_CACHE_TTL = float(os.getenv('OPENAI_CACHE_TTL', str(7 * 24 * 3600)))
+OPENAI_CACHE_DIR = os.getenv('OPENAI_CACHE_DIR')  # unset keeps the cache in memory only
+OPENAI_CACHE_DISK_MAX_BYTES = int(os.getenv('OPENAI_CACHE_DISK_MAX_BYTES', str(512 * 1024 * 1024)))
+
+OPENAI_CACHE = ContentCache(
+    'OpenAI',
+    max_entries=OPENAI_CACHE_MAX_ENTRIES,
+    max_bytes=OPENAI_CACHE_MAX_BYTES,
+    ttl=OPENAI_CACHE_TTL,
+    disk_dir=OPENAI_CACHE_DIR,
+    disk_max_bytes=OPENAI_CACHE_DISK_MAX_BYTES,
+)
+
+
+def vision_cache_key(openai_data):
+    """Hash everything that determines an OpenAI answer: model and parameters, prompt text and image bytes
+
+    Images in data URLs are hashed on their decoded bytes, so the same photo
+    always maps to the same key regardless of how the browser labelled it.
+    """
+    params = {key: value for key, value in openai_data.items() if key != 'messages'}
+    digest = _new_vision_digest(params)
+    
+    for message in openai_data.get('messages', []):
+        digest.update(b'\0role\0' + str(message.get('role', '')).encode('utf-8'))
+        content = message.get('content')
+        if isinstance(content, str):
+            digest.update(b'\0text\0' + content.encode('utf-8'))
+            continue
+        for part in content or []:
+            if part.get('type') == 'text':
+                digest.update(b'\0text\0' + part.get('text', '').encode('utf-8'))
+            elif part.get('type') == 'image_url':
+                url = part.get('image_url', {}).get('url', '')
+                if url.startswith('data:') and ',' in url:
+                    digest.update(b'\0image\0' + base64.b64decode(url.split(',', 1)[1]))
+                else:
+                    digest.update(b'\0image_url\0' + url.encode('utf-8'))
+    
+    return digest.hexdigest()
+
+
+def single_image_cache_key(params, prompt, image_bytes):
+    """Cache key for a one-message prompt-plus-image request, without building the request first
+
+    Produces the same key as vision_cache_key for the equivalent JSON request,
+    so binary and data-URL uploads of the same photo share cache entries.
+    """
+    digest = _new_vision_digest(params)
+    digest.update(b'\0role\0user')
+    digest.update(b'\0text\0' + prompt.encode('utf-8'))
+    digest.update(b'\0image\0')
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+
+def _new_vision_digest(params):
+    digest = hashlib.sha256()
+    digest.update(json.dumps(params, sort_keys=True).encode('utf-8'))
+    return digest
+
+
+def build_vision_payload(params, prompt, image_bytes, mime_type):
+    """Build the chat-completions JSON body for one prompt and one image, as bytes
+
+    The small parts go through json.dumps; the image is base64-encoded in
+    chunks straight into the output buffer, so the only full-size copies are
+    the raw image and the finished body.
+    """
+    payload = dict(params)
+    payload['messages'] = [
+        {
+            'role': 'user',
+            'content': [
+                {'type': 'text', 'text': prompt},
+                {'type': 'image_url', 'image_url': {'url': '__IMAGE_DATA_URL__'}}
+            ]
+        }
+    ]
+    head, tail = json.dumps(payload).encode('utf-8').split(b'__IMAGE_DATA_URL__')
+    
+    body = bytearray(head)
+    body += f'data:{mime_type};base64,'.encode('ascii')
+    view = memoryview(image_bytes)
+    chunk_size = 3 * 64 * 1024  # a multiple of 3 keeps padding out of the middle of the output
+    for offset in range(0, len(view), chunk_size):
+        body += binascii.b2a_base64(view[offset:offset + chunk_size], newline=False)
+    body += tail
+    return body
+
+
+def count_dropped_call(priority):
+    METRICS.inc('proxy_upstream_dropped_total', (('priority', priority),))
+
+
+OPENAI_SCHEDULER = UpstreamScheduler(MAX_UPSTREAM_INFLIGHT, OPENAI_RPM_LIMIT, OPENAI_TPM_LIMIT,
+                                     wait_timeout=UPSTREAM_WAIT_TIMEOUT, on_drop=count_dropped_call)
+
+
+def estimate_request_tokens(body):
+    """Rough token cost of a chat-completions body: text at ~4 bytes a token, a flat cost per image,
+    plus the completion budget"""
+    images = 0
+    image_bytes = 0
+    position = 0
+    while True:
+        start = body.find(b'data:image/', position)
+        if start < 0:
+            break
+        end = body.find(b'"', start)
+        end = len(body) if end < 0 else end
+        images += 1
+        image_bytes += end - start
+        position = end
+    match = re.search(rb'"max_tokens"\s*:\s*(\d+)', body)
+    completion = int(match.group(1)) if match else 500
+    return (len(body) - image_bytes) // 4 + images * OPENAI_IMAGE_TOKEN_ESTIMATE + completion
+
+
+def retry_delay(headers, attempt):
+    """Seconds to wait before retrying: the upstream's Retry-After if it sent one, else jittered backoff"""
+    retry_after = None
+    if headers is not None:
+        try:
+            if headers.get('retry-after-ms'):
+                retry_after = float(headers['retry-after-ms']) / 1000
+            elif headers.get('Retry-After'):
+                value = headers['Retry-After']
+                try:
+                    retry_after = float(value)
+                except ValueError:
+                    retry_after = parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            retry_after = None
+    if retry_after is not None:
+        # A little jitter so everyone told the same Retry-After doesn't return at once
+        return max(0.0, retry_after) + random.uniform(0, OPENAI_RETRY_BASE_DELAY)
+    return random.uniform(0, min(OPENAI_RETRY_MAX_DELAY, OPENAI_RETRY_BASE_DELAY * 2 ** attempt))
+
+
+def reported_tokens(response_data):
+    """total_tokens from a chat-completions response body, or None"""
+    try:
+        return int(json.loads(response_data)['usage']['total_tokens'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+OPENAI_FLIGHTS = SingleFlight()
+
+
+def post_to_openai(body, priority=UpstreamScheduler.INTERACTIVE, deadline=None):
+    """Send a chat-completions request through the connection pool and return (status, headers, data)
+
+    The scheduler decides when it may go (so a burst of requests can't flood
+    OpenAI), and 429s and 5xx errors are retried here with backoff. The last
+    response is returned if every attempt fails.
+    """
+    estimated_tokens = estimate_request_tokens(body)
+    labels = (('upstream', 'openai'),)
+    seq = None
+    for attempt in range(OPENAI_MAX_RETRIES + 1):
+        seq = OPENAI_SCHEDULER.acquire(priority, estimated_tokens, deadline, seq=seq)
+        METRICS.inc('proxy_upstream_in_flight', labels)
+        started = time.perf_counter()
+        status = 'error'
+        response_headers = None
+        used_tokens = None
+        try:
+            status, response_headers, response_data = OPENAI_POOL.request(
+                'POST',
+                '/chat/completions',
+                body=body,
+                headers={
+                    'Authorization': f'Bearer {OPENAI_API_KEY}',
+                    'Content-Type': 'application/json',
+                }
+            )
+            if status == 200:
+                used_tokens = reported_tokens(response_data)
+        finally:
+            OPENAI_SCHEDULER.release(estimated_tokens, used_tokens, response_headers)
+            METRICS.inc('proxy_upstream_in_flight', labels, -1)
+            METRICS.observe('proxy_upstream_duration_seconds', labels, time.perf_counter() - started)
+            METRICS.inc('proxy_upstream_requests_total', labels + (('status', str(status)),))
+        
+        if status not in RETRYABLE_STATUSES or attempt == OPENAI_MAX_RETRIES:
+            return status, response_headers, response_data
+        wait_for_retry(status, response_headers, attempt, priority, deadline)
+
+
+def wait_for_retry(status, response_headers, attempt, priority, deadline):
+    """Back off before another attempt; a 429 pauses every queued call, not just this one"""
+    delay = retry_delay(response_headers, attempt)
+    if deadline is not None and time.monotonic() + delay >= deadline:
+        OPENAI_SCHEDULER.drop(priority, f"Live frame dropped: upstream answered {status} and a retry would be too late")
+    METRICS.inc('proxy_upstream_retries_total', (('status', str(status)),))
+    print(f"OpenAI returned {status}, retrying in {delay:.1f}s (attempt {attempt + 2}/{OPENAI_MAX_RETRIES + 1})")
+    if status == 429:
+        # The queue holds this call's place while the cool-down keeps everyone back
+        OPENAI_SCHEDULER.cool_down(delay)
+    else:
+        time.sleep(delay)
+
+
+def fetch_openai_response(cache_key, body, priority=UpstreamScheduler.INTERACTIVE, deadline=None):
+    """Call OpenAI for a cache miss and store a successful response under cache_key"""
+    status, response_headers, response_data = post_to_openai(body, priority, deadline)
+    if status == 200:
+        OPENAI_CACHE.put(cache_key, response_data)
+    return status, response_headers, response_data
+
+
+def call_openai(openai_data, priority=UpstreamScheduler.INTERACTIVE, deadline=None):
+    """Answer a chat-completions request from the cache, an identical in-flight call, or OpenAI
+
+    Returns (status, headers, data, cache_status) where cache_status is
+    'HIT', 'COALESCED' or 'MISS'. headers is None for cache hits.
+    """
+    frame = frame_signature(openai_data) if priority == UpstreamScheduler.LIVE else None
+    return call_openai_cached(vision_cache_key(openai_data),
+                              lambda: json.dumps(prepare_openai_images(openai_data)).encode('utf-8'),
+                              priority, deadline, frame)
+
+
+def call_openai_cached(cache_key, build_body, priority=UpstreamScheduler.INTERACTIVE, deadline=None, frame=None):
+    """Like call_openai, for callers that computed the cache key themselves
+
+    build_body is only called when the request actually has to go upstream.
+    frame is the (context_key, image_hashes) signature of a live frame; a
+    recent frame that looks the same answers it with cache_status 'NEAR'.
+    """
+    # Identical requests (same model, prompt and image bytes) are answered from cache
+    cached_response = OPENAI_CACHE.get(cache_key)
+    if cached_response is not None:
+        print(f"OpenAI cache hit: {cache_key[:12]}")
+        return 200, None, cached_response, 'HIT'
+    
+    # A live frame of an unchanged view reuses the earlier frame's answer
+    if frame is not None:
+        near_response = FRAME_INDEX.find(*frame)
+        if near_response is not None:
+            print(f"Near-duplicate live frame: {cache_key[:12]}")
+            return 200, None, near_response, 'NEAR'
+    
+    # Identical requests already on their way to OpenAI share that call's response. Live frames
+    # coalesce among themselves only, so an upload never inherits a dropped frame's error
+    flight_key = cache_key if priority == UpstreamScheduler.INTERACTIVE else cache_key + ':live'
+    (status, response_headers, response_data), shared = OPENAI_FLIGHTS.do(
+        flight_key,
+        lambda: fetch_openai_response(cache_key, build_body(), priority, deadline)
+    )
+    if shared:
+        print(f"Coalesced with in-flight OpenAI request: {cache_key[:12]}")
+    elif status == 200 and frame is not None:
+        FRAME_INDEX.add(*frame, response_data)
+    return status, response_headers, response_data, 'COALESCED' if shared else 'MISS'
+
+
+class OpenAIStream:
+    """A streaming chat-completions call that holds an upstream slot until it is closed
+
+    Use as a context manager: status is set on entry, chunks() yields the raw
+    server-sent-event bytes as they arrive. Leaving the block before the
+    stream ended closes the upstream connection, which stops the generation.
+    429s and 5xx errors are retried on entry, before anything was relayed.
+    """
+
+    def __init__(self, body, priority=UpstreamScheduler.INTERACTIVE, deadline=None):
+        self.body = body
+        self.priority = priority
+        self.deadline = deadline
+        self.estimated_tokens = estimate_request_tokens(body)
+        self.labels = (('upstream', 'openai'),)
+
+    def __enter__(self):
+        seq = None
+        for attempt in range(OPENAI_MAX_RETRIES + 1):
+            seq = OPENAI_SCHEDULER.acquire(self.priority, self.estimated_tokens, self.deadline, seq=seq)
+            METRICS.inc('proxy_upstream_in_flight', self.labels)
+            self.started = time.perf_counter()
+            try:
+                self.connection, self.response = OPENAI_POOL.open(
+                    'POST',
+                    '/chat/completions',
+                    body=self.body,
+                    headers={
+                        'Authorization': f'Bearer {OPENAI_API_KEY}',
+                        'Content-Type': 'application/json',
+                        'Accept': 'text/event-stream',
+                    }
+                )
+            except BaseException:
+                self._release('error')
+                raise
+            self.status = self.response.status
+            if self.status not in RETRYABLE_STATUSES or attempt == OPENAI_MAX_RETRIES:
+                return self
+            
+            self.read()
+            OPENAI_POOL.finish(self.connection, self.response)
+            self._release(self.status)
+            wait_for_retry(self.status, self.response.headers, attempt, self.priority, self.deadline)
+
+    def chunks(self, size=16384):
+        """Yield whatever bytes have arrived, without waiting to fill a buffer"""
+        while True:
+            data = self.response.read1(size)
+            if not data:
+                return
+            yield data
+
+    def read(self):
+        return self.response.read()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            OPENAI_POOL.finish(self.connection, self.response)
+        else:
+            self.connection.close()
+        self._release(self.status)
+
+    def _release(self, status):
+        headers = self.response.headers if status != 'error' else None
+        OPENAI_SCHEDULER.release(self.estimated_tokens, headers=headers)
+        METRICS.inc('proxy_upstream_in_flight', self.labels, -1)
+        METRICS.observe('proxy_upstream_duration_seconds', self.labels, time.perf_counter() - self.started)
+        METRICS.inc('proxy_upstream_requests_total', self.labels + (('status', str(status)),))
+
+
+# Image preprocessing before images are sent upstream
+PREPROCESS_IMAGES = os.getenv('PREPROCESS_IMAGES', '1') != '0'
+MODEL_MAX_IMAGE_SIDE = int(os.getenv('MODEL_MAX_IMAGE_SIDE', '2048'))
+MODEL_JPEG_QUALITY = int(os.getenv('MODEL_JPEG_QUALITY', '85'))
+
+EXIF_ORIENTATION_TAG = 0x0112
+
+
+def decode_data_url(data_url):
+    """Return (mime_type, bytes) for a base64 data URL"""
+    if not data_url.startswith('data:') or ',' not in data_url:
+        raise ValueError("Expected a base64 data URL")
+    header, encoded = data_url.split(',', 1)
+    mime_type = header[len('data:'):].split(';')[0] or 'application/octet-stream'
+    return mime_type, base64.b64decode(encoded)
+
+
+def prepare_image_for_model(image_bytes, mime_type):
+    """Decode, orient, downscale and re-encode an image for the vision model
+
+    Returns (image_bytes, mime_type). Anything larger than MODEL_MAX_IMAGE_SIDE
+    is shrunk (JPEGs are decoded at reduced scale with draft() where libjpeg
+    allows it), EXIF orientation is applied, and the result is a JPEG at
+    MODEL_JPEG_QUALITY. JPEGs that are already small enough and upright pass
+    through untouched. If the image can't be decoded the original bytes are
+    returned so the request still goes out.
+    """
+    if not PREPROCESS_IMAGES:
+        return image_bytes, mime_type
+    
+    try:
+        image = Image.open(io.BytesIO(image_bytes))
+        orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+        if (image.format == 'JPEG' and orientation == 1 and image.mode in ('RGB', 'L')
+                and max(image.size) <= MODEL_MAX_IMAGE_SIDE):
+            return image_bytes, 'image/jpeg'
+        
+        original_size = image.size
+        if image.format == 'JPEG':
+            # Ask libjpeg for a 1/2, 1/4 or 1/8 scale decode that is still at least the target size
+            scale = MODEL_MAX_IMAGE_SIDE / max(image.size)
+            if scale < 1:
+                image.draft('RGB', (int(image.size[0] * scale), int(image.size[1] * scale)))
+        
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        image.thumbnail((MODEL_MAX_IMAGE_SIDE, MODEL_MAX_IMAGE_SIDE), Image.LANCZOS)
+        
+        jpeg_buffer = io.BytesIO()
+        image.save(jpeg_buffer, format='JPEG', quality=MODEL_JPEG_QUALITY)
+        jpeg_data = jpeg_buffer.getvalue()
+        print(f"Prepared image for model: {original_size[0]}x{original_size[1]} {len(image_bytes)} bytes "
+              f"→ {image.size[0]}x{image.size[1]} {len(jpeg_data)} bytes")
+        return jpeg_data, 'image/jpeg'
+    except Exception as e:
+        print(f"Image preprocessing failed, sending original: {e}")
+        return image_bytes, mime_type
+
+
+def prepare_openai_images(openai_data):
+    """Run prepare_image_for_model over every data-URL image in a chat-completions request, in place"""
+    if not PREPROCESS_IMAGES:
+        return openai_data
+    
+    for message in openai_data.get('messages', []):
+        content = message.get('content')
+        if not isinstance(content, list):
+            continue
+        for part in content:
+            if part.get('type') != 'image_url':
+                continue
+            url = part.get('image_url', {}).get('url', '')
+            if not url.startswith('data:'):
+                continue
+            mime_type, image_bytes = decode_data_url(url)
+            image_bytes, mime_type = prepare_image_for_model(image_bytes, mime_type)
+            part['image_url']['url'] = f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('ascii')}"
+    return openai_data
+
+
+# Near-duplicate live frames
+FRAME_DEDUP_MAX_ENTRIES = int(os.getenv('FRAME_DEDUP_MAX_ENTRIES', '256'))  # 0 disables it
+FRAME_DEDUP_TTL = float(os.getenv('FRAME_DEDUP_TTL', '30'))
+FRAME_DEDUP_DISTANCE = int(os.getenv('FRAME_DEDUP_DISTANCE', '6'))  # differing bits out of 64
+
+
+def frame_signature(openai_data):
+    """(context_key, image_hashes) for a chat-completions request, or None if it has no hashable images
+
+    context_key covers everything except the images, so only frames sent
+    with the same model, parameters and prompt can stand in for each other.
+    """
+    params = {key: value for key, value in openai_data.items() if key not in ('messages', 'stream', 'stream_options')}
+    digest = _new_vision_digest(params)
+    hashes = []
+    for message in openai_data.get('messages', []):
+        digest.update(b'\0role\0' + str(message.get('role', '')).encode('utf-8'))
+        content = message.get('content')
+        if isinstance(content, str):
+            digest.update(b'\0text\0' + content.encode('utf-8'))
+            continue
+        for part in content or []:
+            if part.get('type') == 'text':
+                digest.update(b'\0text\0' + part.get('text', '').encode('utf-8'))
+            elif part.get('type') == 'image_url':
+                url = part.get('image_url', {}).get('url', '')
+                if not url.startswith('data:') or ',' not in url:
+                    return None
+                digest.update(b'\0image\0')
+                hashes.append(frame_hash(base64.b64decode(url.split(',', 1)[1])))
+    
+    if not hashes or None in hashes:
+        return None
+    return digest.hexdigest(), tuple(hashes)
+
+
+def single_frame_signature(params, prompt, image_bytes):
+    """frame_signature for a one-message prompt-plus-image request, without building the request"""
+    image_hash = frame_hash(image_bytes)
+    if image_hash is None:
+        return None
+    digest = _new_vision_digest(params)
+    digest.update(b'\0role\0user')
+    digest.update(b'\0text\0' + prompt.encode('utf-8'))
+    digest.update(b'\0image\0')
+    return digest.hexdigest(), (image_hash,)
+
+
+FRAME_INDEX = FrameIndex(FRAME_DEDUP_MAX_ENTRIES, FRAME_DEDUP_TTL, FRAME_DEDUP_DISTANCE)
+
+
+# Shelf scan settings
+SCAN_MODEL = os.getenv('SCAN_MODEL', 'gpt-4o-mini')
+SCAN_MAX_SECTIONS = int(os.getenv('SCAN_MAX_SECTIONS', '48'))
+SCAN_SECTION_QUALITY = int(os.getenv('SCAN_SECTION_QUALITY', '85'))
+
+# Same librarian prompt the browser sends for each section
+SHELF_SECTION_PROMPT = """You are a professional librarian cataloging books. Analyze this bookshelf section with extreme precision.
+
+ACCURACY PROTOCOL:
+1. SCAN SYSTEMATICALLY: Examine every book spine from left to right, top to bottom
+2. READ CAREFULLY: Only include titles where you can clearly read the text
+3. BE THOROUGH: Don't miss books due to small text or unusual fonts
+4. VERIFY VISIBILITY: Only include books that are actually visible in this image section
+
+WHAT TO DETECT:
+- Book titles on spines (main title text)
+- Author names if clearly visible
+- Series names if part of the main title
+- Partial titles if the visible portion is clearly readable
+
+WHAT TO EXCLUDE:
+- Magazines, DVDs, decorative objects
+- Text that's too blurry to read
+- Titles you're not certain about
+- Non-book items
+
+CONFIDENCE LEVELS:
+- HIGH: Text is clearly readable and obviously a book title
+- MEDIUM: Text is readable but might be partial or unclear
+- LOW: Text is barely visible or questionable
+
+Return a JSON array with confidence levels:
+[
+  {"title": "Clear Book Title", "confidence": "high"},
+  {"title": "Partial Title", "confidence": "medium"},
+  {"title": "Questionable Text", "confidence": "low"}
+]
+
+If no books detected, return: []
+
+Be thorough but accurate. Better to include questionable titles with low confidence than miss real books."""
+
+CONFIDENCE_RANK = {'low': 0, 'medium': 1, 'high': 2}
+
+# Runs section uploads for /api/scan-shelf; OpenAI calls are still admitted by OPENAI_SCHEDULER
+SECTION_EXECUTOR = ThreadPoolExecutor(max_workers=max(4, MAX_UPSTREAM_INFLIGHT * 2),
+                                      thread_name_prefix='scan-section')
+
+
+def tile_image(image, sections_x, sections_y, overlap=0.5):
+    """Cut an image into a sections_x by sections_y grid of overlapping crop boxes
+
+    Matches createImageSectionsCustom in script.js: every cell is widened by
+    overlap times its size on each side, clamped to the image.
+    """
+    width, height = image.size
+    section_width = width // sections_x
+    section_height = height // sections_y
+    overlap_x = int(section_width * overlap)
+    overlap_y = int(section_height * overlap)
+    
+    boxes = []
+    for row in range(sections_y):
+        for col in range(sections_x):
+            boxes.append((
+                max(0, col * section_width - overlap_x),
+                max(0, row * section_height - overlap_y),
+                min(width, (col + 1) * section_width + overlap_x),
+                min(height, (row + 1) * section_height + overlap_y),
+            ))
+    return boxes
+
+
+def parse_book_titles(content):
+    """Pull the list of {title, confidence} entries out of a model reply"""
+    content = content.strip()
+    if '```' in content:
+        content = re.sub(r'```(?:json)?\n?', '', content).strip()
+    
+    try:
+        books = json.loads(content)
+    except ValueError:
+        # Try to extract a JSON array from a mixed response
+        match = re.search(r'\[[\s\S]*?\]', content)
+        if not match:
+            return []
+        try:
+            books = json.loads(match.group(0))
+        except ValueError:
+            return []
+    
+    if not isinstance(books, list):
+        return []
+    
+    titles = []
+    for item in books:
+        if isinstance(item, str):
+            item = {'title': item}
+        if isinstance(item, dict) and isinstance(item.get('title'), str) and item['title'].strip():
+            titles.append({
+                'title': item['title'].strip(),
+                'confidence': item.get('confidence') if item.get('confidence') in CONFIDENCE_RANK else 'medium'
+            })
+    return titles
+
+
+def merge_section_titles(section_titles):
+    """Merge per-section title lists, keeping the highest confidence seen for each title"""
+    merged = OrderedDict()
+    for section_index, titles in section_titles:
+        for book in titles:
+            key = ' '.join(re.sub(r'[^\w\s]', ' ', book['title'].lower()).split())
+            if not key:
+                continue
+            existing = merged.get(key)
+            if existing is None:
+                merged[key] = {
+                    'title': book['title'],
+                    'confidence': book['confidence'],
+                    'sections': [section_index]
+                }
+                continue
+            if CONFIDENCE_RANK[book['confidence']] > CONFIDENCE_RANK[existing['confidence']]:
+                existing['title'] = book['title']
+                existing['confidence'] = book['confidence']
+            if section_index not in existing['sections']:
+                existing['sections'].append(section_index)
+    
+    return sorted(merged.values(), key=lambda book: -CONFIDENCE_RANK[book['confidence']])
+
+
+def analyze_shelf_section(image, box, model, prompt, max_tokens):
+    """Encode one tile and send it through the cached OpenAI path
+
+    Returns (status, titles, cache_status).
+    """
+    jpeg_buffer = io.BytesIO()
+    image.crop(box).save(jpeg_buffer, format='JPEG', quality=SCAN_SECTION_QUALITY)
+    section_data_url = 'data:image/jpeg;base64,' + base64.b64encode(jpeg_buffer.getvalue()).decode('ascii')
+    
+    status, _, response_data, cache_status = call_openai({
+        'model': model,
+        'messages': [
+            {
+                'role': 'user',
+                'content': [
+                    {'type': 'text', 'text': prompt},
+                    {'type': 'image_url', 'image_url': {'url': section_data_url}}
+                ]
+            }
+        ],
+        'max_tokens': max_tokens
+    })
+    if status != 200:
+        return status, [], cache_status
+    
+    content = json.loads(response_data)['choices'][0]['message']['content'] or ''
+    return status, parse_book_titles(content), cache_status
+
+
+# Google Books lookup settings
+BOOKS_API_BASE_URL = os.getenv('BOOKS_API_BASE_URL', 'https://www.googleapis.com/books/v1')
+BOOKS_API_KEY = os.getenv('GOOGLE_BOOKS_API_KEY')  # optional, raises the daily quota
+BOOKS_API_TIMEOUT = float(os.getenv('BOOKS_API_TIMEOUT', '15'))
+BOOKS_CACHE_PATH = os.getenv('BOOKS_CACHE_PATH', os.path.join(DATA_DIR, 'books-cache.sqlite3'))
+BOOKS_CACHE_TTL = float(os.getenv('BOOKS_CACHE_TTL', str(30 * 24 * 3600)))
+BOOKS_CACHE_MISS_TTL = float(os.getenv('BOOKS_CACHE_MISS_TTL', str(24 * 3600)))  # queries that matched nothing
+BOOKS_LOOKUP_CONCURRENCY = int(os.getenv('BOOKS_LOOKUP_CONCURRENCY', '8'))
+BOOKS_MAX_TITLES = int(os.getenv('BOOKS_MAX_TITLES', '300'))
+BOOKS_MAX_RESULTS = 40  # Google Books' own limit
+
+BOOKS_CACHE = BookLookupCache(BOOKS_CACHE_PATH, BOOKS_CACHE_TTL, BOOKS_CACHE_MISS_TTL)
+BOOKS_POOL = ConnectionPool(BOOKS_API_BASE_URL, pool_size=BOOKS_LOOKUP_CONCURRENCY, timeout=BOOKS_API_TIMEOUT)
+BOOKS_FLIGHTS = SingleFlight()
+# Caps concurrent Google Books calls across all requests, not just within one
+BOOKS_EXECUTOR = ThreadPoolExecutor(max_workers=BOOKS_LOOKUP_CONCURRENCY, thread_name_prefix='books')
+
+
+def normalize_book_query(title):
+    """Clean a detected title into a search query (same rules as cleanOCRText in script.js)"""
+    query = re.sub(r"[^\w\s\-']", ' ', title)
+    return re.sub(r'\s+', ' ', query).strip()[:100]
+
+
+def fetch_book_volumes(query, max_results):
+    """Search Google Books and return (status, items) with each item cut down to id and volumeInfo"""
+    params = {'q': query, 'maxResults': max_results}
+    if BOOKS_API_KEY:
+        params['key'] = BOOKS_API_KEY
+    
+    labels = (('upstream', 'books'),)
+    started = time.perf_counter()
+    status = 'error'
+    try:
+        status, _, data = BOOKS_POOL.request('GET', '/volumes?' + urllib.parse.urlencode(params),
+                                             headers={'Accept': 'application/json'})
+    finally:
+        METRICS.observe('proxy_upstream_duration_seconds', labels, time.perf_counter() - started)
+        METRICS.inc('proxy_upstream_requests_total', labels + (('status', str(status)),))
+    
+    if status != 200:
+        return status, None
+    items = json.loads(data).get('items') or []
+    return status, [{'id': item.get('id'), 'volumeInfo': item.get('volumeInfo', {})} for item in items]
+
+
+def lookup_books(titles, max_results):
+    """Resolve many titles at once from the cache and concurrent Google Books searches
+
+    Titles are normalized and deduplicated first, so each distinct query costs at
+    most one upstream call. Returns (results, summary, statuses) where results
+    follows the order of titles and statuses holds the failed upstream statuses.
+    """
+    queries = OrderedDict()  # cache key -> query
+    per_title = []
+    for title in titles:
+        query = normalize_book_query(title) if isinstance(title, str) else ''
+        key = f"{max_results}:{query.casefold()}" if query else None
+        per_title.append((title, query, key))
+        if key:
+            queries.setdefault(key, query)
+    
+    try:
+        cached = BOOKS_CACHE.get_many(list(queries))
+    except sqlite3.Error as e:
+        print(f"Book cache unavailable: {e}")
+        cached = {}
+    
+    futures = {
+        key: BOOKS_EXECUTOR.submit(BOOKS_FLIGHTS.do, key,
+                                   lambda query=query: fetch_book_volumes(query, max_results))
+        for key, query in queries.items() if key not in cached
+    }
+    fetched = {}
+    errors = {}
+    statuses = []
+    for key, future in futures.items():
+        try:
+            (status, items), _ = future.result()
+        except Exception as e:
+            print(f"Book lookup failed for {queries[key]!r}: {e}")
+            errors[key] = str(e)
+            statuses.append(502)
+            continue
+        if status == 200:
+            fetched[key] = items
+        else:
+            errors[key] = f"Google Books returned {status}"
+            statuses.append(status)
+    
+    if fetched:
+        try:
+            BOOKS_CACHE.put_many((key, queries[key], items) for key, items in fetched.items())
+        except sqlite3.Error as e:
+            print(f"Could not store book lookups: {e}")
+    
+    results = []
+    for title, query, key in per_title:
+        result = {'title': title, 'query': query}
+        if key is None:
+            result.update(items=[], error='Empty title')
+        elif key in cached:
+            result.update(items=cached[key], cache='HIT')
+        elif key in fetched:
+            result.update(items=fetched[key], cache='MISS')
+        else:
+            result.update(items=[], error=errors[key])
+        results.append(result)
+    
+    summary = {
+        'titles': len(per_title),
+        'unique': len(queries),
+        'cached': len(cached),
+        'fetched': len(fetched),
+        'failed': len(errors)
+    }
+    return results, summary, statuses
+
+
+# Library store settings
+LIBRARY_DB_PATH = os.getenv('LIBRARY_DB_PATH', os.path.join(DATA_DIR, 'library.sqlite3'))
+LIBRARY_PAGE_SIZE = int(os.getenv('LIBRARY_PAGE_SIZE', '100'))
+LIBRARY_MAX_PAGE_SIZE = 1000
+
+LIBRARY = LibraryStore(LIBRARY_DB_PATH)
+
+# Library users are identified by Firebase ID tokens; the default project is the one index.html signs in to
+FIREBASE_PROJECT_ID = os.getenv('FIREBASE_PROJECT_ID', 'bookshelf-c2c6d')  # empty disables /api/library
+FIREBASE_KEYS_URL = os.getenv(
+    'FIREBASE_KEYS_URL', 'https://www.googleapis.com/service_accounts/v1/jwk/securetoken@system.gserviceaccount.com')
+
+LIBRARY_AUTH = FirebaseTokenVerifier(FIREBASE_PROJECT_ID, FIREBASE_KEYS_URL) if FIREBASE_PROJECT_ID else None
+
+
+# HEIC conversion process pool settings
+HEIC_WORKERS = int(os.getenv('HEIC_WORKERS', str(os.cpu_count() or 2)))  # 0 converts on the request thread
+HEIC_JOB_TIMEOUT = float(os.getenv('HEIC_JOB_TIMEOUT', '60'))
+HEIC_MAX_QUEUE = int(os.getenv('HEIC_MAX_QUEUE', str(max(1, HEIC_WORKERS) * 4)))
+HEIC_PREVIEW_SIZE = int(os.getenv('HEIC_PREVIEW_SIZE', '320'))  # iPhone photos embed a thumbnail about this size
+HEIC_PREVIEW_MAX_SIZE = int(os.getenv('HEIC_PREVIEW_MAX_SIZE', '2048'))
+HEIC_PREVIEW_QUALITY = int(os.getenv('HEIC_PREVIEW_QUALITY', '80'))
+HEIC_BACKENDS = [name.strip() for name in os.getenv('HEIC_BACKENDS', ','.join(heic_decode.DEFAULT_ORDER)).split(',')
+                 if name.strip()]
+
+HEIC_POOL = ConversionPool(HEIC_WORKERS, HEIC_MAX_QUEUE, HEIC_JOB_TIMEOUT, HEIC_BACKENDS,
+                           on_result=record_conversion_seconds)
+
+# Converted JPEG cache settings
+HEIC_CACHE_MAX_ENTRIES = int(os.getenv('HEIC_CACHE_MAX_ENTRIES', '64'))
+HEIC_CACHE_MAX_BYTES = int(os.getenv('HEIC_CACHE_MAX_BYTES', str(256 * 1024 * 1024)))
+HEIC_CACHE_TTL = float(os.getenv('HEIC_CACHE_TTL', str(30 * 24 * 3600)))
+HEIC_CACHE_DIR = os.getenv('HEIC_CACHE_DIR')  # unset keeps the cache in memory only
+HEIC_CACHE_DISK_MAX_BYTES = int(os.getenv('HEIC_CACHE_DISK_MAX_BYTES', str(2 * 1024 * 1024 * 1024)))
+
+HEIC_CACHE = ContentCache(
+    'HEIC',
+    max_entries=HEIC_CACHE_MAX_ENTRIES,
+    max_bytes=HEIC_CACHE_MAX_BYTES,
+    ttl=HEIC_CACHE_TTL,
+    disk_dir=HEIC_CACHE_DIR,
+    disk_max_bytes=HEIC_CACHE_DISK_MAX_BYTES,
+)
+
+
+# Static file serving settings
+STATIC_MAX_CACHED_FILE = int(os.getenv('STATIC_MAX_CACHED_FILE', str(1024 * 1024)))  # larger files use sendfile
+
+STATIC_FILES = StaticFileCache(STATIC_MAX_CACHED_FILE)
+
+# Request body limits
+MAX_JSON_BODY_BYTES = int(os.getenv('MAX_JSON_BODY_BYTES', str(50 * 1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.getenv('MAX_UPLOAD_BYTES', str(64 * 1024 * 1024)))
+UPLOAD_SPOOL_THRESHOLD = int(os.getenv('UPLOAD_SPOOL_THRESHOLD', str(1024 * 1024)))  # larger parts go to a temp file
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
+def int_param(value, name, minimum=1, maximum=None):
+    """A request parameter (JSON number, form field or header) as an int within bounds; anything else is a 400"""
+    try:
+        if isinstance(value, bool) or isinstance(value, float) and not value.is_integer():
+            raise ValueError(value)
+        number = int(value)
+    except (TypeError, ValueError, OverflowError):
+        number = None
+    if number is None or number < minimum or maximum is not None and number > maximum:
+        bounds = f"between {minimum} and {maximum}" if maximum is not None else f"of at least {minimum}"
+        raise RequestBodyError(400, f"{name} must be an integer {bounds}")
+    return number
+
+
+def float_param(value, name, minimum, maximum):
+    """A request parameter as a float between minimum and maximum inclusive; anything else is a 400"""
+    try:
+        if isinstance(value, bool):
+            raise ValueError(value)
+        number = float(value)
+    except (TypeError, ValueError):
+        number = None
+    # NaN fails the comparison too
+    if number is None or not minimum <= number <= maximum:
+        raise RequestBodyError(400, f"{name} must be a number between {minimum:g} and {maximum:g}")
+    return number
+
+# Batch HEIC conversion settings
+HEIC_BATCH_MAX_FILES = int(os.getenv('HEIC_BATCH_MAX_FILES', '500'))
+HEIC_BATCH_MAX_BYTES = int(os.getenv('HEIC_BATCH_MAX_BYTES', str(1024 * 1024 * 1024)))
+HEIC_BATCH_QUALITY = 95  # same as /api/convert-heic-direct, so the two share cached conversions
+
+
 class ProxyHandler(http.server.SimpleHTTPRequestHandler):
+    # Drop idle client connections so they can't pin a worker thread
+    timeout = 60
+    
+    def setup(self):
+        super().setup()
+        self.wfile = CountingWriter(self.wfile)
+    
+    def send_response(self, code, message=None):
+        self.response_status = code
+        super().send_response(code, message)
+    
+    def track_request(self, route_handler):
+        """Run a route handler and record its latency, sizes and status"""
+        path = self.path.split('?', 1)[0]
+        if path in METRIC_ROUTES:
+            route = path
+        elif path.startswith('/api/library/'):
+            route = '/api/library'
+        else:
+            route = 'static'
+        labels = (('route', route),)
+        self.response_status = None
+        bytes_before = self.wfile.bytes_written
+        METRICS.inc('proxy_requests_in_flight', labels)
+        started = time.perf_counter()
+        try:
+            route_handler()
+        finally:
+            METRICS.inc('proxy_requests_in_flight', labels, -1)
+            METRICS.observe('proxy_request_duration_seconds', labels, time.perf_counter() - started)
+            METRICS.inc('proxy_requests_total', labels + (('method', self.command),
+                                                          ('status', str(self.response_status))))
+            try:
+                request_bytes = int(self.headers.get('Content-Length') or 0)
+            except ValueError:
+                request_bytes = 0
+            METRICS.observe('proxy_request_size_bytes', labels, request_bytes)
+            METRICS.observe('proxy_response_size_bytes', labels, self.wfile.bytes_written - bytes_before)
+    
     def do_POST(self):
+        self.track_request(self.route_post)
+    
+    def do_GET(self):
+        self.track_request(self.route_get)
+    
+    def do_HEAD(self):
+        self.track_request(lambda: self.serve_static(head_only=True))
+    
+    def do_PATCH(self):
+        self.track_request(self.route_library_only)
+    
+    def do_DELETE(self):
+        self.track_request(self.route_library_only)
+    
+    def route_library_only(self):
+        if self.is_library_path():
+            self.handle_library()
+        else:
+            self.send_error(405, "Method Not Allowed")
+    
+    def is_library_path(self):
+        path = self.path.split('?', 1)[0]
+        return path == '/api/library' or path.startswith('/api/library/')
+    
+    def route_post(self):
         if self.path == '/api/openai':
             self.handle_openai_request()
+        elif self.path == '/api/openai-image':
+            self.handle_openai_image_request()
+        elif self.path == '/api/scan-shelf':
+            self.handle_shelf_scan()
         elif self.path == '/api/convert-heic':
             self.handle_heic_conversion()
         elif self.path == '/api/convert-heic-direct':
             self.handle_heic_direct_upload()
+        elif self.path.split('?', 1)[0] == '/api/convert-heic-batch':
+            self.handle_heic_batch()
+        elif self.path.split('?', 1)[0] == '/api/heic-preview':
+            self.handle_heic_preview()
+        elif self.path == '/api/books/lookup':
+            self.handle_books_lookup()
+        elif self.is_library_path():
+            self.handle_library()
         else:
             self.send_error(404, "Not Found")
     
-    def do_GET(self):
-        # Serve static files normally
-        super().do_GET()
+    def route_get(self):
+        if self.path == '/api/stats':
+            self.handle_stats()
+            return
+        if self.path == '/metrics':
+            self.handle_metrics()
+            return
+        if self.is_library_path():
+            self.handle_library()
+            return
+        self.serve_static()
+    
+    def serve_static(self, head_only=False):
+        """Serve a file from the in-memory cache with validators, compression and sendfile"""
+        path = self.translate_path(self.path)
+        if is_private_static_path(path, self.directory):
+            self.send_error(404, "File not found")
+            return
+        if os.path.isdir(path):
+            index_path = os.path.join(path, 'index.html')
+            if not self.path.split('?', 1)[0].endswith('/') or not os.path.isfile(index_path):
+                # Redirects and directory listings are left to SimpleHTTPRequestHandler
+                super().do_HEAD() if head_only else super().do_GET()
+                return
+            path = index_path
+        
+        try:
+            entry = STATIC_FILES.get(path)
+        except OSError:
+            self.send_error(404, "File not found")
+            return
+        
+        encoding = self.choose_static_encoding(entry)
+        if self.static_not_modified(entry):
+            self.send_response(304)
+            self.send_header('ETag', entry.etag_for(encoding))
+            self.send_header('Cache-Control', entry.cache_control)
+            self.send_header('Vary', 'Accept-Encoding')
+            self.end_headers()
+            return
+        
+        body = entry.encodings[encoding] if encoding else entry.data
+        
+        self.send_response(200)
+        self.send_header('Content-Type', entry.content_type)
+        self.send_header('Content-Length', str(len(body) if body is not None else entry.size))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.send_header('ETag', entry.etag_for(encoding))
+        self.send_header('Last-Modified', entry.last_modified)
+        self.send_header('Cache-Control', entry.cache_control)
+        self.send_header('Vary', 'Accept-Encoding')
+        self.end_headers()
+        
+        if head_only:
+            return
+        if body is not None:
+            self.wfile.write(body)
+            return
+        
+        # Large files go straight from the page cache to the socket
+        try:
+            with open(entry.path, 'rb') as f:
+                self.wfile.bytes_written += self.connection.sendfile(f, count=entry.size)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+    
+    def static_not_modified(self, entry):
+        if_none_match = self.headers.get('If-None-Match')
+        if if_none_match:
+            tags = [tag.strip() for tag in if_none_match.split(',')]
+            etags = entry.all_etags()
+            return '*' in tags or any((tag[2:] if tag.startswith('W/') else tag) in etags for tag in tags)
+        
+        if_modified_since = self.headers.get('If-Modified-Since')
+        if if_modified_since:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError, IndexError, OverflowError):
+                return False
+            return entry.mtime_ns // 1_000_000_000 <= since
+        return False
+    
+    def choose_static_encoding(self, entry):
+        """Pick br or gzip if the client accepts it and a compressed variant exists"""
+        if not entry.encodings:
+            return None
+        accepted = set()
+        for item in self.headers.get('Accept-Encoding', '').split(','):
+            name, _, params = item.strip().partition(';')
+            if params.replace(' ', '') not in ('q=0', 'q=0.0'):
+                accepted.add(name.strip().lower())
+        for encoding in ('br', 'gzip'):
+            if encoding in entry.encodings and encoding in accepted:
+                return encoding
+        return None
+    
+    def upstream_priority(self):
+        """(priority, deadline) for this request's OpenAI calls
+
+        Clients mark live-camera frames with X-Request-Priority: live. They may
+        set X-Frame-Deadline to the milliseconds a frame stays worth answering.
+        """
+        if self.headers.get('X-Request-Priority', '').strip().lower() != 'live':
+            return UpstreamScheduler.INTERACTIVE, None
+        try:
+            max_age = float(self.headers['X-Frame-Deadline']) / 1000
+        except (KeyError, TypeError, ValueError):
+            max_age = LIVE_FRAME_MAX_AGE
+        return UpstreamScheduler.LIVE, time.monotonic() + max_age
     
     def handle_openai_request(self):
+        priority, deadline = self.upstream_priority()
         try:
-            # Get the content length and read the request body
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            
             # Parse the JSON data - now we only expect the OpenAI request data
-            openai_data = json.loads(post_data.decode('utf-8'))
+            openai_data = self.read_json_body()
             
             # Debug: Check the image format being sent and handle HEIC
             if 'messages' in openai_data:
@@ -60,8 +1177,9 @@ class ProxyHandler(http.server.SimpleHTTPRequestHandler):
                                     format_part = url.split(';')[0].replace('data:image/', '')
                                     print(f"Image format detected: {format_part}")
                                     
-                                    # Handle HEIC format - OpenAI doesn't officially support it
-                                    # but it might work if we tell it it's JPEG
+                                    # Handle HEIC format - OpenAI doesn't officially support it.
+                                    # prepare_openai_images transcodes it to a real JPEG before
+                                    # sending; the relabel covers PREPROCESS_IMAGES=0
                                     if format_part.lower() in ['heic', 'heif']:
                                         print("HEIC format detected, converting MIME type to JPEG for OpenAI")
                                         # Replace the MIME type in the data URL
@@ -78,27 +1196,24 @@ class ProxyHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_error(500, "API key not configured on server")
                 return
             
-            # Make request to OpenAI
-            req = urllib.request.Request(
-                'https://api.openai.com/v1/chat/completions',
-                data=json.dumps(openai_data).encode('utf-8'),
-                headers={
-                    'Authorization': f'Bearer {OPENAI_API_KEY}',
-                    'Content-Type': 'application/json',
-                }
-            )
+            if openai_data.get('stream'):
+                self.relay_openai_stream(openai_data, priority, deadline)
+                return
             
-            with urllib.request.urlopen(req) as response:
-                response_data = response.read()
-                
-                # Send successful response
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
-                self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-                self.end_headers()
-                self.wfile.write(response_data)
+            status, response_headers, response_data, cache_status = call_openai(openai_data, priority, deadline)
+            
+            if status != 200:
+                raise HTTPError(f"{OPENAI_POOL.base_url}/chat/completions", status,
+                                http.client.responses.get(status, ''), response_headers,
+                                io.BytesIO(response_data))
+            
+            self.send_openai_response(response_data, cache_status)
+            
+        except RequestBodyError as e:
+            self.send_json_response(e.status, {'success': False, 'error': str(e)})
+        
+        except UpstreamBusyError as e:
+            self.send_busy_response(str(e))
                 
         except HTTPError as e:
             error_response = e.read().decode('utf-8')
@@ -114,23 +1229,755 @@ class ProxyHandler(http.server.SimpleHTTPRequestHandler):
             print(f"Proxy Error: {str(e)}")
             self.send_error(500, f"Internal Server Error: {str(e)}")
     
+    def relay_openai_stream(self, openai_data, priority, deadline):
+        """Relay a stream: true request's server-sent events to the client chunk by chunk
+
+        Shares the response cache with ordinary requests: a cached answer is
+        replayed as events, and a stream that completes is stored as the
+        equivalent non-streaming response. Identical streams requested while
+        one is in flight follow that one instead of calling OpenAI again.
+        """
+        started = time.perf_counter()
+        cache_key = vision_cache_key({key: value for key, value in openai_data.items()
+                                      if key not in ('stream', 'stream_options')})
+        cached_response = OPENAI_CACHE.get(cache_key)
+        cache_status = 'HIT'
+        frame = frame_signature(openai_data) if priority == UpstreamScheduler.LIVE else None
+        if cached_response is None and frame is not None:
+            cached_response = FRAME_INDEX.find(*frame)
+            cache_status = 'NEAR'
+        if cached_response is not None:
+            print(f"OpenAI cache {cache_status.lower()} (streamed): {cache_key[:12]}")
+            events = completion_as_events(cached_response)
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Content-Length', str(len(events)))
+            self.send_header('Cache-Control', 'no-cache')
+            self.send_header('X-Cache', cache_status)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(events)
+            return
+        
+        # Identical streams already on their way share the upstream call: the first request relays
+        # it and the others follow along, each from the first chunk
+        flight_key = cache_key + (':stream' if frame is None else ':stream:live')
+        relay = StreamRelay()
+        completed, shared = OPENAI_FLIGHTS.do(
+            flight_key,
+            lambda: self.lead_openai_stream(relay, openai_data, priority, deadline, started),
+            state=relay,
+            follow=self.follow_openai_stream,
+            join=StreamRelay.attach
+        )
+        if shared:
+            print(f"Coalesced with in-flight OpenAI stream: {cache_key[:12]}")
+        elif completed is not None:
+            OPENAI_CACHE.put(cache_key, completed)
+            if frame is not None:
+                FRAME_INDEX.add(*frame, completed)
+    
+    def lead_openai_stream(self, relay, openai_data, priority, deadline, started):
+        """Open the upstream stream, relay it to this client and publish it for followers
+
+        Returns the assembled completion, or None if the stream did not finish.
+        """
+        error = None
+        complete = False
+        try:
+            body = json.dumps(prepare_openai_images(openai_data)).encode('utf-8')
+            with OpenAIStream(body, priority, deadline) as stream:
+                if stream.status != 200:
+                    error_data = stream.read()
+                    relay.start(stream.status, stream.response.headers, error_data)
+                    raise HTTPError(f"{OPENAI_POOL.base_url}/chat/completions", stream.status,
+                                    http.client.responses.get(stream.status, ''), stream.response.headers,
+                                    io.BytesIO(error_data))
+                relay.start(200)
+                self.send_stream_headers('MISS')
+                
+                assembler = ChatStreamAssembler()
+                client_connected = True
+                first_chunk = True
+                try:
+                    for data in stream.chunks():
+                        relay.publish(data)
+                        assembler.feed(data)
+                        if client_connected:
+                            client_connected = self.write_stream_chunk(data)
+                        if not client_connected and relay.abandon():
+                            # Leaving the stream unread closes the upstream connection, so OpenAI stops generating
+                            print("Client disconnected mid-stream, abandoning the upstream stream")
+                            return None
+                        if first_chunk:
+                            METRICS.observe('proxy_stream_first_chunk_seconds', (), time.perf_counter() - started)
+                            first_chunk = False
+                except (OSError, http.client.HTTPException) as e:
+                    # Headers are already out; ending without the final chunk tells the client it was cut short
+                    print(f"Upstream stream failed: {e}")
+                    return None
+                complete = True
+                if client_connected:
+                    self.write_stream_chunk(b'')
+            return assembler.completion() if assembler.done else None
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            relay.finish(error, complete)
+    
+    def follow_openai_stream(self, relay):
+        """Relay the stream another request opened, from its first chunk
+
+        SingleFlight already attached this request to the relay.
+        """
+        try:
+            status, headers, error_data = relay.wait_start()
+            if status != 200:
+                raise HTTPError(f"{OPENAI_POOL.base_url}/chat/completions", status,
+                                http.client.responses.get(status, ''), headers, io.BytesIO(error_data))
+            self.send_stream_headers('COALESCED')
+            for data in relay.chunks():
+                if not self.write_stream_chunk(data):
+                    return None
+            if relay.complete:
+                self.write_stream_chunk(b'')
+        finally:
+            relay.detach()
+        return None
+    
+    def send_stream_headers(self, cache_status):
+        # Chunked encoding needs HTTP/1.1; the connection is closed afterwards either way
+        self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('X-Cache', cache_status)
+        self.send_header('Connection', 'close')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.close_connection = True
+    
+    def write_stream_chunk(self, data):
+        """Send one chunk (an empty one ends the body); False once the client has gone away"""
+        try:
+            self.wfile.write(b'%X\r\n%s\r\n' % (len(data), data))
+            self.wfile.flush()
+            return True
+        except (BrokenPipeError, ConnectionResetError):
+            return False
+    
+    def handle_openai_image_request(self):
+        """Analyze an image sent as raw bytes or multipart, without a base64 JSON body
+
+        Raw uploads carry the prompt and parameters in X-Prompt (URL-encoded),
+        X-Model and X-Max-Tokens headers; multipart uploads use image, prompt,
+        model and max_tokens fields. Missing values default to the shelf scan
+        prompt and settings.
+        """
+        priority, deadline = self.upstream_priority()
+        try:
+            content_type = self.headers.get('Content-Type', '')
+            if content_type.startswith('multipart/form-data'):
+                with self.read_multipart() as form:
+                    image_item = form.get('image')
+                    if image_item is None or not image_item.filename:
+                        self.send_json_response(400, {'success': False, 'error': 'No image file provided'})
+                        return
+                    # The image goes upstream base64-encoded in one body, so it is read into memory here
+                    image_bytes = image_item.read()
+                    mime_type = image_item.content_type or 'image/jpeg'
+                    prompt = form.getfirst('prompt')
+                    model = form.getfirst('model')
+                    max_tokens = form.getfirst('max_tokens')
+            elif content_type.startswith('image/'):
+                image_bytes = self.read_body(MAX_UPLOAD_BYTES)
+                mime_type = content_type.split(';')[0].strip()
+                prompt = self.headers.get('X-Prompt')
+                prompt = urllib.parse.unquote(prompt) if prompt else None
+                model = self.headers.get('X-Model')
+                max_tokens = self.headers.get('X-Max-Tokens')
+            else:
+                self.send_json_response(415, {
+                    'success': False,
+                    'error': 'Send the image as image/* bytes or multipart/form-data'
+                })
+                return
+            
+            if not image_bytes:
+                self.send_json_response(400, {'success': False, 'error': 'Empty image upload'})
+                return
+            
+            if not OPENAI_API_KEY:
+                self.send_error(500, "API key not configured on server")
+                return
+            
+            # OpenAI doesn't officially take HEIC; label it JPEG like /api/openai does
+            if mime_type in ('image/heic', 'image/heif'):
+                mime_type = 'image/jpeg'
+            
+            try:
+                max_tokens = int(max_tokens or 500)
+            except ValueError:
+                max_tokens = 0
+            if max_tokens < 1:
+                self.send_json_response(400, {'success': False, 'error': 'max_tokens must be a positive integer'})
+                return
+            
+            prompt = prompt or SHELF_SECTION_PROMPT
+            params = {
+                'model': model or SCAN_MODEL,
+                'max_tokens': max_tokens
+            }
+            print(f"Received binary image upload: {len(image_bytes)} bytes, {mime_type}")
+            
+            cache_key = single_image_cache_key(params, prompt, image_bytes)
+            frame = single_frame_signature(params, prompt, image_bytes) if priority == UpstreamScheduler.LIVE else None
+            status, response_headers, response_data, cache_status = call_openai_cached(
+                cache_key,
+                lambda: build_vision_payload(params, prompt, *prepare_image_for_model(image_bytes, mime_type)),
+                priority, deadline, frame
+            )
+            
+            if status != 200:
+                raise HTTPError(f"{OPENAI_POOL.base_url}/chat/completions", status,
+                                http.client.responses.get(status, ''), response_headers,
+                                io.BytesIO(response_data))
+            
+            self.send_openai_response(response_data, cache_status)
+            
+        except RequestBodyError as e:
+            self.send_json_response(e.status, {'success': False, 'error': str(e)})
+        
+        except UpstreamBusyError as e:
+            self.send_busy_response(str(e))
+        
+        except HTTPError as e:
+            error_response = e.read()
+            print(f"OpenAI API Error: {e.code} - {error_response.decode('utf-8', 'replace')}")
+            
+            self.send_response(e.code)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(error_response)
+            
+        except Exception as e:
+            print(f"Binary image proxy error: {str(e)}")
+            self.send_json_response(500, {'success': False, 'error': str(e)})
+    
+    def handle_shelf_scan(self):
+        """Tile a full shelf photo on the server and analyze all sections concurrently"""
+        try:
+            data = self.read_json_body()
+            if not isinstance(data, dict):
+                raise RequestBodyError(400, "Expected a JSON object")
+            
+            image_data_url = data.get('imageDataUrl')
+            if not image_data_url or not isinstance(image_data_url, str):
+                self.send_json_response(400, {'success': False, 'error': 'Missing imageDataUrl'})
+                return
+            
+            sections_x = int_param(data.get('sectionsX', 5), 'sectionsX', 1, SCAN_MAX_SECTIONS)
+            sections_y = int_param(data.get('sectionsY', 4), 'sectionsY', 1, SCAN_MAX_SECTIONS)
+            # Past 0.5 every tile would be more than twice its share of the image
+            overlap = float_param(data.get('overlap', 0.5), 'overlap', 0, 0.5)
+            max_tokens = int_param(data.get('max_tokens', 500), 'max_tokens')
+            if sections_x * sections_y > SCAN_MAX_SECTIONS:
+                self.send_json_response(400, {
+                    'success': False,
+                    'error': f'Grid must have between 1 and {SCAN_MAX_SECTIONS} sections'
+                })
+                return
+            
+            if not OPENAI_API_KEY:
+                self.send_error(500, "API key not configured on server")
+                return
+            
+            try:
+                _, image_bytes = decode_data_url(image_data_url)
+                image = ImageOps.exif_transpose(Image.open(io.BytesIO(image_bytes)))
+                if image.mode != 'RGB':
+                    image = image.convert('RGB')
+                # Decode once up front; the section threads only crop the loaded pixels
+                image.load()
+            except (ValueError, OSError) as e:
+                # binascii.Error and PIL's UnidentifiedImageError are a ValueError and an OSError
+                raise RequestBodyError(400, f"imageDataUrl is not a readable image: {e}")
+            
+            boxes = tile_image(image, sections_x, sections_y, overlap)
+            print(f"Shelf scan: {image.size[0]}x{image.size[1]} image, {len(boxes)} sections")
+            
+            model = data.get('model', SCAN_MODEL)
+            prompt = data.get('prompt', SHELF_SECTION_PROMPT)
+            futures = [
+                SECTION_EXECUTOR.submit(analyze_shelf_section, image, box, model, prompt, max_tokens)
+                for box in boxes
+            ]
+            
+            section_titles = []
+            statuses = []
+            cached = 0
+            for index, future in enumerate(futures):
+                try:
+                    status, titles, cache_status = future.result()
+                except Exception as e:
+                    print(f"Shelf scan section {index + 1} failed: {e}")
+                    statuses.append(502)
+                    continue
+                statuses.append(status)
+                if status == 200:
+                    section_titles.append((index, titles))
+                    if cache_status != 'MISS':
+                        cached += 1
+                else:
+                    print(f"Shelf scan section {index + 1} failed with status {status}")
+            
+            summary = {
+                'total': len(boxes),
+                'successful': len(section_titles),
+                'failed': len(boxes) - len(section_titles),
+                'cached': cached
+            }
+            if not section_titles:
+                # Pass rate limits through so the browser's retry logic still applies
+                status = 429 if 429 in statuses else 502
+                self.send_json_response(status, {
+                    'success': False,
+                    'error': 'All sections failed',
+                    'sections': summary
+                })
+                return
+            
+            books = merge_section_titles(section_titles)
+            print(f"Shelf scan complete: {summary['successful']}/{summary['total']} sections, {len(books)} unique titles")
+            self.send_json_response(200, {
+                'success': True,
+                'books': books,
+                'sections': summary
+            })
+            
+        except RequestBodyError as e:
+            self.send_json_response(e.status, {'success': False, 'error': str(e)})
+        
+        except Exception as e:
+            print(f"Shelf scan error: {str(e)}")
+            self.send_json_response(500, {'success': False, 'error': str(e)})
+    
+    def handle_books_lookup(self):
+        """Look up a batch of titles in Google Books, answering repeats from the local cache"""
+        try:
+            data = self.read_json_body()
+            if not isinstance(data, dict):
+                raise RequestBodyError(400, "Expected a JSON object")
+            
+            titles = data.get('titles')
+            if not isinstance(titles, list) or not titles:
+                self.send_json_response(400, {'success': False, 'error': 'Missing titles'})
+                return
+            if len(titles) > BOOKS_MAX_TITLES:
+                self.send_json_response(400, {
+                    'success': False,
+                    'error': f'At most {BOOKS_MAX_TITLES} titles per request'
+                })
+                return
+            max_results = int_param(data.get('maxResults', 3), 'maxResults', 1, BOOKS_MAX_RESULTS)
+            
+            results, summary, statuses = lookup_books(titles, max_results)
+            print(f"Book lookup: {summary['titles']} titles, {summary['unique']} unique, "
+                  f"{summary['cached']} cached, {summary['fetched']} fetched, {summary['failed']} failed")
+            
+            if summary['failed'] and not summary['cached'] and not summary['fetched']:
+                # Pass rate limits through so the browser can back off
+                status = 429 if 429 in statuses else 502
+                self.send_json_response(status, {
+                    'success': False,
+                    'error': 'All lookups failed',
+                    'summary': summary
+                })
+                return
+            
+            self.send_json_response(200, {
+                'success': True,
+                'results': results,
+                'summary': summary
+            })
+            
+        except RequestBodyError as e:
+            self.send_json_response(e.status, {'success': False, 'error': str(e)})
+        
+        except Exception as e:
+            print(f"Book lookup error: {str(e)}")
+            self.send_json_response(500, {'success': False, 'error': str(e)})
+    
+    def handle_library(self):
+        """Per-user library store: list/search, single-book append/patch/delete, bulk import/export
+
+        The user is the uid of the Firebase ID token sent as
+        Authorization: Bearer <token>, so a client can only reach its own
+        library.
+        """
+        parsed = urllib.parse.urlsplit(self.path)
+        params = urllib.parse.parse_qs(parsed.query)
+        subpath = urllib.parse.unquote(parsed.path[len('/api/library'):].strip('/'))
+        
+        if LIBRARY_AUTH is None:
+            self.send_json_response(503, {'success': False, 'error': 'Library store is disabled (no FIREBASE_PROJECT_ID)'})
+            return
+        try:
+            user = self.authenticated_user()
+        except AuthenticationError as e:
+            self.send_json_response(401, {'success': False, 'error': str(e)})
+            return
+        
+        try:
+            if self.command == 'GET' and not subpath:
+                limit = min(int(params.get('limit', [LIBRARY_PAGE_SIZE])[0]), LIBRARY_MAX_PAGE_SIZE)
+                if limit < 1:
+                    raise ValueError("limit must be positive")
+                cursor = params.get('cursor', [None])[0]
+                query = params.get('q', [''])[0].strip()
+                if query:
+                    books, next_cursor = LIBRARY.search(user, query, limit, cursor)
+                    self.send_json_response(200, {'success': True, 'books': books, 'next': next_cursor})
+                else:
+                    books, next_cursor, total = LIBRARY.list(user, limit, cursor)
+                    self.send_json_response(200, {'success': True, 'books': books, 'next': next_cursor,
+                                                  'total': total})
+            elif self.command == 'GET' and subpath == 'export':
+                self.send_library_export(user, params.get('format', ['json'])[0])
+            elif self.command == 'GET':
+                book = LIBRARY.get(user, subpath)
+                if book is None:
+                    self.send_json_response(404, {'success': False, 'error': 'Book not found'})
+                else:
+                    self.send_json_response(200, {'success': True, 'book': book})
+            elif self.command == 'POST' and not subpath:
+                book = LIBRARY.append(user, self.read_json_body())
+                self.send_json_response(201, {'success': True, 'book': book})
+            elif self.command == 'POST' and subpath == 'import':
+                data = self.read_json_body()
+                books = data.get('books') if isinstance(data, dict) else data
+                if not isinstance(books, list):
+                    raise ValueError("Send a JSON array of books or {\"books\": [...]}")
+                mode = params.get('mode', ['merge'])[0]
+                if mode not in ('merge', 'replace'):
+                    raise ValueError("mode must be merge or replace")
+                count = LIBRARY.import_books(user, books, replace=mode == 'replace')
+                print(f"Library import for {user}: {count} books ({mode})")
+                self.send_json_response(200, {'success': True, 'imported': count})
+            elif self.command == 'PATCH' and subpath and subpath not in ('import', 'export'):
+                book = LIBRARY.patch(user, subpath, self.read_json_body())
+                if book is None:
+                    self.send_json_response(404, {'success': False, 'error': 'Book not found'})
+                else:
+                    self.send_json_response(200, {'success': True, 'book': book})
+            elif self.command == 'DELETE' and subpath and subpath not in ('import', 'export'):
+                if LIBRARY.delete(user, subpath):
+                    self.send_json_response(200, {'success': True})
+                else:
+                    self.send_json_response(404, {'success': False, 'error': 'Book not found'})
+            else:
+                self.send_json_response(405, {'success': False, 'error': 'Method not allowed'})
+        
+        except RequestBodyError as e:
+            self.send_json_response(e.status, {'success': False, 'error': str(e)})
+        except LibraryConflictError as e:
+            self.send_json_response(409, {'success': False, 'error': str(e)})
+        except (ValueError, UnicodeDecodeError) as e:
+            # json.JSONDecodeError is a ValueError too
+            self.send_json_response(400, {'success': False, 'error': str(e)})
+        except Exception as e:
+            print(f"Library error: {str(e)}")
+            self.send_json_response(500, {'success': False, 'error': str(e)})
+    
+    def authenticated_user(self):
+        """The uid of the verified Firebase ID token in the Authorization header"""
+        scheme, _, token = self.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token.strip():
+            raise AuthenticationError("Sign in required: send Authorization: Bearer <Firebase ID token>")
+        return LIBRARY_AUTH.verify(token.strip())['sub']
+    
+    def send_library_export(self, user, export_format):
+        """Stream every book as a JSON array or NDJSON without building the whole document"""
+        if export_format not in ('json', 'ndjson'):
+            raise ValueError("format must be json or ndjson")
+        
+        self.send_response(200)
+        if export_format == 'ndjson':
+            self.send_header('Content-Type', 'application/x-ndjson')
+        else:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Disposition', f'attachment; filename="library.{export_format}"')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        
+        if export_format == 'ndjson':
+            for data in LIBRARY.export(user):
+                self.wfile.write(data.encode('utf-8') + b'\n')
+            return
+        
+        separator = b'['
+        for data in LIBRARY.export(user):
+            self.wfile.write(separator + data.encode('utf-8'))
+            separator = b',\n'
+        self.wfile.write(b'[]\n' if separator == b'[' else b']\n')
+    
+    def request_body_length(self, limit):
+        """Content-Length of the request, rejecting bodies over limit bytes before any of it is read"""
+        try:
+            length = int(self.headers['Content-Length'])
+        except TypeError:
+            raise RequestBodyError(411, "Content-Length required")
+        except ValueError:
+            raise RequestBodyError(400, "Invalid Content-Length")
+        if length < 0:
+            raise RequestBodyError(400, "Invalid Content-Length")
+        if length > limit:
+            # The body is left unread, so the connection can't carry another request
+            self.close_connection = True
+            raise RequestBodyError(413, f"Request body is larger than {limit} bytes")
+        return length
+    
+    def read_body(self, limit=MAX_JSON_BODY_BYTES):
+        """The whole request body as bytes, for bodies that have to be parsed in one piece"""
+        length = self.request_body_length(limit)
+        data = self.rfile.read(length)
+        if len(data) < length:
+            raise RequestBodyError(400, "Request body ended early")
+        return data
+    
+    def read_json_body(self, limit=MAX_JSON_BODY_BYTES):
+        return json.loads(self.read_body(limit))
+    
+    def read_multipart(self, limit=MAX_UPLOAD_BYTES):
+        """Parse a multipart/form-data body as it arrives; use the result as a context manager"""
+        length = self.request_body_length(limit)
+        return parse_multipart(BoundedReader(self.rfile, length), self.headers.get('Content-Type', ''), limit,
+                               spool_threshold=UPLOAD_SPOOL_THRESHOLD)
+    
+    def read_file_upload(self, field, limit=MAX_UPLOAD_BYTES):
+        """The uploaded file as a SpooledUpload, from a raw request body or a multipart field
+
+        Returns None if a multipart body has no file under field. The caller
+        closes the result to delete any temp file.
+        """
+        if self.headers.get('Content-Type', '').startswith('multipart/form-data'):
+            form = self.read_multipart(limit)
+            upload = form.get(field)
+            if upload is None or not upload.filename:
+                form.close()
+                return None
+            for parts in form.parts.values():
+                for part in parts:
+                    if part is not upload:
+                        part.close()
+            return upload
+        
+        reader = BoundedReader(self.rfile, self.request_body_length(limit))
+        upload = SpooledUpload(content_type=self.headers.get('Content-Type'), max_size=limit,
+                               threshold=UPLOAD_SPOOL_THRESHOLD)
+        try:
+            for chunk in iter(lambda: reader.read(UPLOAD_CHUNK_SIZE), b''):
+                upload.write(chunk)
+            upload.finish()
+        except BaseException:
+            upload.close()
+            raise
+        return upload
+    
+    def send_json_response(self, status, data):
+        """Send a JSON body with the usual CORS headers"""
+        response_data = json.dumps(data).encode('utf-8')
+        
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_data)))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(response_data)
+    
+    def send_openai_response(self, response_data, cache_status):
+        """Send a successful OpenAI response body back to the browser"""
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_data)))
+        self.send_header('X-Cache', cache_status)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+        self.wfile.write(response_data)
+    
+    def handle_metrics(self):
+        """Prometheus text exposition of the proxy's metrics"""
+        if hasattr(self.server, 'pending'):
+            METRICS.set('proxy_request_queue_depth', (), self.server.pending.qsize())
+        for name, cache in (('openai', OPENAI_CACHE), ('heic', HEIC_CACHE)):
+            stats = cache.stats()
+            labels = (('cache', name),)
+            METRICS.set('proxy_cache_hits_total', labels, stats['hits'])
+            METRICS.set('proxy_cache_misses_total', labels, stats['misses'])
+            METRICS.set('proxy_cache_bytes', labels + (('tier', 'memory'),), stats['memoryBytes'])
+            METRICS.set('proxy_cache_bytes', labels + (('tier', 'disk'),), stats['diskBytes'])
+        books_stats = BOOKS_CACHE.stats()
+        METRICS.set('proxy_cache_hits_total', (('cache', 'books'),), books_stats['hits'])
+        METRICS.set('proxy_cache_misses_total', (('cache', 'books'),), books_stats['misses'])
+        frame_stats = FRAME_INDEX.stats()
+        METRICS.set('proxy_cache_hits_total', (('cache', 'frames'),), frame_stats['hits'])
+        METRICS.set('proxy_cache_misses_total', (('cache', 'frames'),), frame_stats['misses'])
+        METRICS.set('proxy_coalesced_requests_total', (), OPENAI_FLIGHTS.stats()['coalesced'])
+        for priority, waiting in OPENAI_SCHEDULER.stats()['waiting'].items():
+            METRICS.set('proxy_upstream_waiting', (('priority', priority),), waiting)
+        
+        response_data = METRICS.render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(response_data)))
+        self.send_header('Cache-Control', 'no-store')
+        self.end_headers()
+        self.wfile.write(response_data)
+    
+    def handle_stats(self):
+        """Report cache counters as JSON"""
+        response_data = json.dumps({
+            'openaiCache': OPENAI_CACHE.stats(),
+            'openaiCoalescing': OPENAI_FLIGHTS.stats(),
+            'heicPool': HEIC_POOL.stats(),
+            'openaiScheduler': OPENAI_SCHEDULER.stats(),
+            'heicCache': HEIC_CACHE.stats(),
+            'booksCache': BOOKS_CACHE.stats(),
+            'liveFrames': FRAME_INDEX.stats(),
+            'process': {'pid': os.getpid(), 'mode': SERVER_MODE}
+        })
+        
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(response_data.encode('utf-8'))
+    
+    def send_busy_response(self, message):
+        """Send a 503 asking the client to retry after a short delay"""
+        response_data = json.dumps({
+            'success': False,
+            'error': message
+        })
+        
+        self.send_response(503)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Retry-After', str(RETRY_AFTER_SECONDS))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(response_data.encode('utf-8'))
+    
     def do_OPTIONS(self):
         # Handle CORS preflight requests
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'POST, GET, PATCH, DELETE, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Authorization, Content-Type, Accept, If-None-Match, X-Prompt, X-Model, X-Max-Tokens, X-Request-Priority, X-Frame-Deadline')
+        self.end_headers()
+
+    def wants_raw_jpeg(self):
+        """True if the client asked for image/jpeg instead of the JSON data URL format"""
+        for media_range in self.headers.get('Accept', '').split(','):
+            media_type, _, params = media_range.strip().partition(';')
+            if media_type.strip().lower() == 'image/jpeg':
+                return params.replace(' ', '') not in ('q=0', 'q=0.0')
+        return False
+
+    def conversion_etag(self, cache_key):
+        """Strong ETag for a conversion result; raw and JSON responses are different representations"""
+        return f'"{cache_key}"' if self.wants_raw_jpeg() else f'"{cache_key}-json"'
+
+    def etag_matches(self, etag):
+        """Check If-None-Match against an ETag"""
+        if_none_match = self.headers.get('If-None-Match')
+        if not if_none_match:
+            return False
+        candidates = [tag.strip() for tag in if_none_match.split(',')]
+        # If-None-Match uses weak comparison, so W/ prefixes are ignored
+        return '*' in candidates or etag in (tag[2:] if tag.startswith('W/') else tag for tag in candidates)
+
+    def send_not_modified(self, etag):
+        self.send_response(304)
+        self.send_header('ETag', etag)
+        self.send_header('Vary', 'Accept')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+
+    def send_cached_conversion(self, cache_key):
+        """Answer a conversion from If-None-Match or the conversion cache; returns False on a miss"""
+        etag = self.conversion_etag(cache_key)
+        if self.etag_matches(etag):
+            print(f"HEIC conversion not modified: {cache_key[:12]}")
+            self.send_not_modified(etag)
+            return True
+        
+        started = time.perf_counter()
+        jpeg_data = HEIC_CACHE.get(cache_key)
+        if jpeg_data is None:
+            return False
+        record_conversion('cache', 'success', started)
+        print(f"HEIC conversion cache hit: {cache_key[:12]}")
+        self.send_jpeg_result(jpeg_data, cache_key, 'HIT')
+        return True
+
+    def send_converted_jpeg(self, cache_key, jpeg_data, backend, started):
+        """Store a fresh conversion in the cache, record which backend produced it, and send it"""
+        record_conversion(backend, 'success', started)
+        HEIC_CACHE.put(cache_key, jpeg_data)
+        self.send_jpeg_result(jpeg_data, cache_key, 'MISS')
+
+    def send_jpeg_result(self, jpeg_data, cache_key=None, cache_status=None):
+        """Send a converted JPEG as raw bytes or as the JSON data URL, depending on Accept"""
+        if self.wants_raw_jpeg():
+            self.send_response(200)
+            self.send_header('Content-Type', 'image/jpeg')
+            self.send_header('Content-Length', str(len(jpeg_data)))
+            self.send_conversion_cache_headers(cache_key, cache_status)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            self.wfile.write(jpeg_data)
+            return
+        
+        # Build the JSON around the base64 text directly rather than via json.dumps,
+        # which would copy the multi-megabyte string a few more times
+        response_data = b''.join((
+            b'{"success": true, "jpegDataUrl": "data:image/jpeg;base64,',
+            base64.b64encode(jpeg_data),
+            b'"}'
+        ))
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response_data)))
+        self.send_conversion_cache_headers(cache_key, cache_status)
+        self.send_header('Access-Control-Allow-Origin', '*')
         self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
+        self.wfile.write(response_data)
+
+    def send_conversion_cache_headers(self, cache_key, cache_status):
+        self.send_header('Vary', 'Accept')
+        if cache_key:
+            self.send_header('ETag', self.conversion_etag(cache_key))
+            # The URL is a POST endpoint; the ETag is only meant for If-None-Match on repeat uploads
+            self.send_header('Cache-Control', 'private, no-cache')
+        if cache_status:
+            self.send_header('X-Cache', cache_status)
 
     def handle_heic_conversion(self):
         try:
-            # Get the content length and read the request body
-            content_length = int(self.headers['Content-Length'])
-            post_data = self.rfile.read(content_length)
-            
             # Parse the JSON data
-            data = json.loads(post_data.decode('utf-8'))
-            heic_data_url = data.get('heicDataUrl')
+            heic_data_url = self.read_json_body().get('heicDataUrl')
             
             if not heic_data_url:
                 self.send_error(400, "Missing heicDataUrl")
@@ -145,102 +1992,48 @@ class ProxyHandler(http.server.SimpleHTTPRequestHandler):
                 self.send_error(400, "Invalid HEIC data URL format")
                 return
             
-            # Decode base64 data
+            # Decode base64 data, then drop the encoded copy before converting
             heic_data = base64.b64decode(base64_data)
+            del heic_data_url, base64_data
+            
+            # Repeat uploads are answered from the cache without decoding
+            cache_key = heic_cache_key(heic_data, 85)
+            if self.send_cached_conversion(cache_key):
+                return
             
-            # Convert HEIC to JPEG using Pillow
+            # Convert HEIC to JPEG in the worker process pool, with whichever decoder suits the file
+            conversion_started = time.perf_counter()
             try:
-                # Try to open with Pillow (supports HEIC if pillow-heif is installed)
-                image = Image.open(io.BytesIO(heic_data))
+                conversion = HEIC_POOL.convert(heic_data, quality=85)
                 
-                # Convert to RGB if necessary
-                if image.mode != 'RGB':
-                    image = image.convert('RGB')
+                # Send successful response
+                self.send_converted_jpeg(cache_key, conversion.jpeg, conversion.backend, conversion_started)
                 
-                # Save as JPEG
-                jpeg_buffer = io.BytesIO()
-                image.save(jpeg_buffer, format='JPEG', quality=85)
-                jpeg_data = jpeg_buffer.getvalue()
+            except ConversionQueueFullError as e:
+                self.send_busy_response(str(e))
+            
+            except ConversionTimeoutError as e:
+                print(f"HEIC conversion timed out: {e}")
+                self.send_json_response(504, {'success': False, 'error': str(e)})
                 
-                # Convert back to base64
-                jpeg_base64 = base64.b64encode(jpeg_data).decode('utf-8')
-                jpeg_data_url = f"data:image/jpeg;base64,{jpeg_base64}"
+            except heic_decode.DecodeError as e:
+                print(f"HEIC conversion failed: {e}")
                 
-                # Send successful response
+                # All conversion methods failed
                 response_data = json.dumps({
-                    'success': True,
-                    'jpegDataUrl': jpeg_data_url
+                    'success': False,
+                    'error': 'Server-side HEIC conversion failed'
                 })
                 
-                self.send_response(200)
+                self.send_response(500)
                 self.send_header('Content-Type', 'application/json')
                 self.send_header('Access-Control-Allow-Origin', '*')
-                self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
-                self.send_header('Access-Control-Allow-Headers', 'Content-Type')
                 self.end_headers()
                 self.wfile.write(response_data.encode('utf-8'))
                 
-            except Exception as e:
-                print(f"Pillow HEIC conversion failed: {e}")
-                
-                # Fallback: Try using ImageMagick if available
-                try:
-                    with tempfile.NamedTemporaryFile(suffix='.heic', delete=False) as temp_heic:
-                        temp_heic.write(heic_data)
-                        temp_heic_path = temp_heic.name
-                    
-                    with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as temp_jpg:
-                        temp_jpg_path = temp_jpg.name
-                    
-                    # Use ImageMagick to convert
-                    result = subprocess.run([
-                        'convert', temp_heic_path, '-quality', '85', temp_jpg_path
-                    ], capture_output=True, text=True)
-                    
-                    if result.returncode == 0:
-                        # Read converted JPEG
-                        with open(temp_jpg_path, 'rb') as f:
-                            jpeg_data = f.read()
-                        
-                        # Convert to base64
-                        jpeg_base64 = base64.b64encode(jpeg_data).decode('utf-8')
-                        jpeg_data_url = f"data:image/jpeg;base64,{jpeg_base64}"
-                        
-                        # Send successful response
-                        response_data = json.dumps({
-                            'success': True,
-                            'jpegDataUrl': jpeg_data_url
-                        })
-                        
-                        self.send_response(200)
-                        self.send_header('Content-Type', 'application/json')
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.send_header('Access-Control-Allow-Methods', 'POST, GET, OPTIONS')
-                        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-                        self.end_headers()
-                        self.wfile.write(response_data.encode('utf-8'))
-                    else:
-                        raise Exception(f"ImageMagick conversion failed: {result.stderr}")
-                    
-                    # Clean up temp files
-                    os.unlink(temp_heic_path)
-                    os.unlink(temp_jpg_path)
-                    
-                except Exception as e2:
-                    print(f"ImageMagick HEIC conversion also failed: {e2}")
-                    
-                    # All conversion methods failed
-                    response_data = json.dumps({
-                        'success': False,
-                        'error': 'Server-side HEIC conversion failed'
-                    })
-                    
-                    self.send_response(500)
-                    self.send_header('Content-Type', 'application/json')
-                    self.send_header('Access-Control-Allow-Origin', '*')
-                    self.end_headers()
-                    self.wfile.write(response_data.encode('utf-8'))
-                
+        except RequestBodyError as e:
+            self.send_json_response(e.status, {'success': False, 'error': str(e)})
+        
         except Exception as e:
             print(f"HEIC conversion error: {str(e)}")
             response_data = json.dumps({
@@ -254,111 +2047,93 @@ class ProxyHandler(http.server.SimpleHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(response_data.encode('utf-8'))
 
-    def handle_heic_direct_upload(self):
-        """Handle direct HEIC file upload and conversion"""
+    def handle_heic_preview(self):
+        """Return a small JPEG preview of a HEIC file, at most ?maxSize= pixels on its longer side
+
+        The file is the raw request body or the heicFile part of a multipart
+        upload. Previews are cached and answer If-None-Match like conversions,
+        and honour Accept: image/jpeg the same way.
+        """
         try:
-            import cgi
-            
-            # Parse multipart form data
-            form = cgi.FieldStorage(
-                fp=self.rfile,
-                headers=self.headers,
-                environ={'REQUEST_METHOD': 'POST'}
-            )
-            
-            if 'heicFile' not in form:
-                raise Exception("No HEIC file provided")
-            
-            file_item = form['heicFile']
-            if not file_item.filename:
-                raise Exception("No filename provided")
-            
-            print(f"Received direct HEIC upload: {file_item.filename}")
-            
-            # Read the file data
-            heic_data = file_item.file.read()
-            
-            # Try Pillow conversion first
+            params = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
             try:
-                from PIL import Image
-                import io
-                
-                # Open HEIC image
-                heic_image = Image.open(io.BytesIO(heic_data))
-                
-                # Convert to RGB (in case it's in a different mode)
-                if heic_image.mode != 'RGB':
-                    heic_image = heic_image.convert('RGB')
-                
-                # Save as JPEG
-                jpeg_buffer = io.BytesIO()
-                heic_image.save(jpeg_buffer, format='JPEG', quality=95)
-                jpeg_data = jpeg_buffer.getvalue()
-                
-                # Convert to base64
-                jpeg_base64 = base64.b64encode(jpeg_data).decode('utf-8')
-                jpeg_data_url = f"data:image/jpeg;base64,{jpeg_base64}"
-                
-                print("✅ Direct HEIC conversion successful with Pillow")
-                
-                response_data = json.dumps({
-                    'success': True,
-                    'jpegDataUrl': jpeg_data_url
+                max_side = int(params.get('maxSize', [HEIC_PREVIEW_SIZE])[0])
+            except ValueError:
+                max_side = 0
+            if not 16 <= max_side <= HEIC_PREVIEW_MAX_SIZE:
+                self.send_json_response(400, {
+                    'success': False,
+                    'error': f'maxSize must be between 16 and {HEIC_PREVIEW_MAX_SIZE}'
                 })
+                return
+            
+            upload = self.read_file_upload('heicFile')
+            if upload is None:
+                self.send_json_response(400, {'success': False, 'error': 'No HEIC file provided'})
+                return
+            
+            with upload:
+                if not upload.size:
+                    self.send_json_response(400, {'success': False, 'error': 'Empty upload'})
+                    return
+                if heic_decode.file_signature(upload.source()) == 'unknown':
+                    self.send_json_response(415, {'success': False, 'error': 'Not a HEIC/HEIF file'})
+                    return
                 
-                self.send_response(200)
-                self.send_header('Content-Type', 'application/json')
-                self.send_header('Access-Control-Allow-Origin', '*')
-                self.end_headers()
-                self.wfile.write(response_data.encode('utf-8'))
+                cache_key = heic_cache_key(upload, HEIC_PREVIEW_QUALITY, max_side)
+                if self.send_cached_conversion(cache_key):
+                    return
                 
-            except Exception as pillow_error:
-                print(f"Pillow conversion failed: {pillow_error}")
+                started = time.perf_counter()
+                jpeg_data, source = HEIC_POOL.preview(upload.source(), max_side, HEIC_PREVIEW_QUALITY)
+                print(f"HEIC preview from {source}: {upload.size} bytes → {len(jpeg_data)} bytes "
+                      f"in {time.perf_counter() - started:.2f}s")
+                self.send_converted_jpeg(cache_key, jpeg_data, f'preview-{source}', started)
+        
+        except RequestBodyError as e:
+            self.send_json_response(e.status, {'success': False, 'error': str(e)})
+        
+        except ConversionQueueFullError as e:
+            self.send_busy_response(str(e))
+        
+        except ConversionTimeoutError as e:
+            print(f"HEIC preview timed out: {e}")
+            self.send_json_response(504, {'success': False, 'error': str(e)})
+        
+        except PreviewDecodeError as e:
+            print(f"HEIC preview failed: {e}")
+            self.send_json_response(422, {'success': False, 'error': f'Could not decode the HEIC file: {e}'})
+        
+        except Exception as e:
+            print(f"HEIC preview error: {str(e)}")
+            self.send_json_response(500, {'success': False, 'error': str(e)})
+
+    def handle_heic_direct_upload(self):
+        """Handle direct HEIC file upload and conversion
+
+        The upload is parsed as it arrives and spooled to a temp file once it
+        passes UPLOAD_SPOOL_THRESHOLD, so the request thread never holds the
+        whole file; converters read it from disk.
+        """
+        try:
+            with self.read_multipart() as form:
+                file_item = form.get('heicFile')
+                if file_item is None:
+                    raise Exception("No HEIC file provided")
+                if not file_item.filename:
+                    raise Exception("No filename provided")
                 
-                # Fallback to ImageMagick
-                with tempfile.NamedTemporaryFile(suffix='.heic', delete=False) as temp_heic:
-                    temp_heic.write(heic_data)
-                    temp_heic_path = temp_heic.name
+                print(f"Received direct HEIC upload: {file_item.filename} ({file_item.size} bytes)")
                 
-                temp_jpg_path = temp_heic_path.replace('.heic', '.jpg')
+                # Repeat uploads are answered from the cache without decoding
+                cache_key = heic_cache_key(file_item, 95)
+                if self.send_cached_conversion(cache_key):
+                    return
                 
-                try:
-                    # Use ImageMagick to convert
-                    result = subprocess.run([
-                        'convert', temp_heic_path, temp_jpg_path
-                    ], capture_output=True, text=True)
-                    
-                    if result.returncode == 0:
-                        # Read converted JPEG
-                        with open(temp_jpg_path, 'rb') as f:
-                            jpeg_data = f.read()
-                        
-                        # Convert to base64
-                        jpeg_base64 = base64.b64encode(jpeg_data).decode('utf-8')
-                        jpeg_data_url = f"data:image/jpeg;base64,{jpeg_base64}"
-                        
-                        print("✅ Direct HEIC conversion successful with ImageMagick")
-                        
-                        response_data = json.dumps({
-                            'success': True,
-                            'jpegDataUrl': jpeg_data_url
-                        })
-                        
-                        self.send_response(200)
-                        self.send_header('Content-Type', 'application/json')
-                        self.send_header('Access-Control-Allow-Origin', '*')
-                        self.end_headers()
-                        self.wfile.write(response_data.encode('utf-8'))
-                    else:
-                        raise Exception(f"ImageMagick conversion failed: {result.stderr}")
-                    
-                    # Clean up temp files
-                    os.unlink(temp_heic_path)
-                    os.unlink(temp_jpg_path)
-                    
-                except Exception as magick_error:
-                    print(f"ImageMagick conversion failed: {magick_error}")
-                    raise Exception(f"Both Pillow and ImageMagick conversion failed. Pillow: {pillow_error}, ImageMagick: {magick_error}")
+                self.convert_heic_upload(file_item, cache_key)
+        
+        except RequestBodyError as e:
+            self.send_json_response(e.status, {'success': False, 'error': str(e)})
                 
         except Exception as e:
             print(f"Direct HEIC upload error: {str(e)}")
@@ -373,12 +2148,209 @@ class ProxyHandler(http.server.SimpleHTTPRequestHandler):
             self.end_headers()
             self.wfile.write(response_data.encode('utf-8'))
 
+    def convert_heic_upload(self, file_item, cache_key):
+        """Convert an uploaded HEIC file in the worker process pool and send the JPEG"""
+        conversion_started = time.perf_counter()
+        try:
+            conversion = HEIC_POOL.convert(file_item.source(), quality=95)
+            
+            print(f"✅ Direct HEIC conversion successful with {conversion.backend}")
+            
+            self.send_converted_jpeg(cache_key, conversion.jpeg, conversion.backend, conversion_started)
+            
+        except ConversionQueueFullError as e:
+            self.send_busy_response(str(e))
+        
+        except ConversionTimeoutError as e:
+            print(f"HEIC conversion timed out: {e}")
+            self.send_json_response(504, {'success': False, 'error': str(e)})
+
+    def handle_heic_batch(self):
+        """Convert many HEIC files from one request and stream each result back as it finishes
+
+        The files are the file parts of a multipart upload, or the .heic/.heif
+        members of a zip sent as the body with Content-Type: application/zip.
+        The response is NDJSON, one record per file in completion order and a
+        summary line at the end, or with ?format=zip (or Accept:
+        application/zip) a zip of the JPEGs plus manifest.json, written as
+        the conversions finish.
+        """
+        try:
+            params = urllib.parse.parse_qs(urllib.parse.urlsplit(self.path).query)
+            output_format = params.get('format', [None])[0]
+            if output_format is None:
+                output_format = 'zip' if 'application/zip' in self.headers.get('Accept', '') else 'ndjson'
+            if output_format not in ('ndjson', 'zip'):
+                self.send_json_response(400, {'success': False, 'error': 'format must be ndjson or zip'})
+                return
+            
+            with contextlib.ExitStack() as stack:
+                items = self.read_heic_batch(stack)
+                if not items:
+                    self.send_json_response(400, {'success': False, 'error': 'No HEIC files provided'})
+                    return
+                print(f"Received HEIC batch: {len(items)} files, streaming {output_format}")
+                self.stream_heic_batch(HeicBatch(items, HEIC_POOL, HEIC_CACHE, HEIC_BATCH_QUALITY), output_format)
+        
+        except RequestBodyError as e:
+            self.send_json_response(e.status, {'success': False, 'error': str(e)})
+        
+        except zipfile.BadZipFile as e:
+            self.send_json_response(400, {'success': False, 'error': f'Invalid zip archive: {e}'})
+        
+        except Exception as e:
+            print(f"HEIC batch error: {str(e)}")
+            self.send_json_response(500, {'success': False, 'error': str(e)})
+
+    def read_heic_batch(self, stack):
+        """The files of a batch request as (name, load) items; their temp files are cleaned up by stack"""
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/form-data'):
+            reader = BoundedReader(self.rfile, self.request_body_length(HEIC_BATCH_MAX_BYTES))
+            form = stack.enter_context(parse_multipart(reader, content_type, MAX_UPLOAD_BYTES,
+                                                       max_parts=HEIC_BATCH_MAX_FILES,
+                                                       spool_threshold=UPLOAD_SPOOL_THRESHOLD))
+            uploads = [part for parts in form.parts.values() for part in parts if part.filename]
+            return [(upload.filename, lambda upload=upload: upload) for upload in uploads]
+        
+        if content_type.split(';', 1)[0].strip().lower() in ZIP_CONTENT_TYPES:
+            body = stack.enter_context(self.read_file_upload(None, HEIC_BATCH_MAX_BYTES))
+            source = body.source()
+            archive = stack.enter_context(zipfile.ZipFile(source if isinstance(source, str) else io.BytesIO(source)))
+            return zip_batch_items(archive, HEIC_BATCH_MAX_FILES, HEIC_BATCH_MAX_BYTES, MAX_UPLOAD_BYTES,
+                                   UPLOAD_SPOOL_THRESHOLD)
+        
+        raise RequestBodyError(415, "Expected multipart/form-data or application/zip")
+
+    def stream_heic_batch(self, batch, output_format):
+        """Send a batch's results with chunked encoding as they come out of the conversion pool"""
+        # Chunked encoding needs HTTP/1.1; the connection is closed afterwards either way
+        self.protocol_version = 'HTTP/1.1'
+        self.send_response(200)
+        if output_format == 'zip':
+            self.send_header('Content-Type', 'application/zip')
+            self.send_header('Content-Disposition', 'attachment; filename="converted.zip"')
+        else:
+            self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.send_header('Cache-Control', 'no-store')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('Connection', 'close')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.close_connection = True
+        
+        started = time.perf_counter()
+        writer = ChunkedWriter(self.wfile)
+        summary = {'done': True, 'files': len(batch.files), 'converted': 0, 'failed': 0}
+        try:
+            with contextlib.closing(batch.results()) as results:
+                if output_format == 'zip':
+                    self.write_batch_zip(results, writer, summary)
+                else:
+                    self.write_batch_ndjson(results, writer, summary)
+            writer.close()
+        except (BrokenPipeError, ConnectionResetError):
+            print("Client disconnected during a HEIC batch, abandoning the rest")
+            return
+        except Exception as e:
+            # Headers are already out; ending without the final chunk tells the client it was cut short
+            print(f"HEIC batch failed mid-stream: {e}")
+            return
+        print(f"HEIC batch done: {summary['converted']} converted, {summary['failed']} failed "
+              f"in {time.perf_counter() - started:.2f}s")
+
+    @staticmethod
+    def count_batch_result(result, summary):
+        summary['converted' if result['success'] else 'failed'] += 1
+
+    def write_batch_ndjson(self, results, writer, summary):
+        started = time.perf_counter()
+        for result in results:
+            self.count_batch_result(result, summary)
+            jpeg_data = result.pop('jpeg', None)
+            record = json.dumps(result).encode('utf-8')
+            if jpeg_data is not None:
+                # Splice the base64 text in rather than have json.dumps copy it again
+                record = b''.join((record[:-1], b', "jpegDataUrl": "data:image/jpeg;base64,',
+                                   base64.b64encode(jpeg_data), b'"}'))
+            writer.write(record + b'\n')
+        summary['seconds'] = round(time.perf_counter() - started, 3)
+        writer.write(json.dumps(summary).encode('utf-8') + b'\n')
+
+    def write_batch_zip(self, results, writer, summary):
+        used_names = set()
+        manifest = []
+        with zipfile.ZipFile(writer, 'w') as archive:
+            for result in results:
+                self.count_batch_result(result, summary)
+                jpeg_data = result.pop('jpeg', None)
+                if jpeg_data is not None:
+                    result['output'] = batch_output_name(result['name'], used_names)
+                    # JPEGs don't compress, so they are stored as they are
+                    info = zipfile.ZipInfo(result['output'], date_time=time.localtime()[:6])
+                    archive.writestr(info, jpeg_data)
+                manifest.append(result)
+            manifest.sort(key=lambda entry: entry['index'])
+            report = {'converted': summary['converted'], 'failed': summary['failed'], 'files': manifest}
+            archive.writestr('manifest.json', json.dumps(report, indent=2), compress_type=zipfile.ZIP_DEFLATED)
+
+
+def share_limits_between_workers(processes):
+    """Give one prefork worker its share of the limits that apply to the whole server"""
+    global OPENAI_SCHEDULER
+    OPENAI_SCHEDULER = UpstreamScheduler(max(1, -(-MAX_UPSTREAM_INFLIGHT // processes)), OPENAI_RPM_LIMIT,
+                                         OPENAI_TPM_LIMIT, share=1.0 / processes,
+                                         wait_timeout=UPSTREAM_WAIT_TIMEOUT, on_drop=count_dropped_call)
+    if HEIC_POOL.workers > 0:
+        HEIC_POOL.workers = max(1, HEIC_POOL.workers // processes)
+        HEIC_POOL.max_queue = max(1, HEIC_POOL.max_queue // processes)
+
+
+def start_prefork_worker(processes):
+    """Set up a freshly forked worker before it accepts connections"""
+    share_limits_between_workers(processes)
+    HEIC_POOL.start()
+
+
+def stop_prefork_worker():
+    # os._exit follows, so wait for the pool processes; the forkserver and resource
+    # tracker this worker started exit by themselves once they are gone
+    HEIC_POOL.shutdown(wait=True)
+
+
+def create_server(port=PORT, mode=SERVER_MODE):
+    """Build the HTTP server for the configured concurrency mode"""
+    if mode == 'single':
+        return socketserver.TCPServer(("", port), ProxyHandler)
+    if mode == 'threaded':
+        return ThreadPoolHTTPServer(("", port), ProxyHandler, **SERVER_OPTIONS)
+    raise ValueError(f"Unknown PROXY_SERVER_MODE: {mode}")
+
+
 if __name__ == "__main__":
-    PORT = 8080
-    
     print(f"Starting proxy server on port {PORT}...")
     print(f"Access your bookshelf scanner at: http://localhost:{PORT}")
     print("The server will handle both static files and OpenAI API requests.")
+    if SERVER_MODE == 'threaded':
+        print(f"Concurrency: {WORKER_THREADS} worker threads, queue of {REQUEST_QUEUE_SIZE}, "
+              f"{MAX_UPSTREAM_INFLIGHT} OpenAI calls in flight")
+    elif SERVER_MODE == 'prefork':
+        print(f"Concurrency: {PREFORK_PROCESSES} processes of {WORKER_THREADS} worker threads, "
+              f"{MAX_UPSTREAM_INFLIGHT} OpenAI calls in flight in total")
     
-    with socketserver.TCPServer(("", PORT), ProxyHandler) as httpd:
-        httpd.serve_forever()
+    if SERVER_MODE == 'prefork':
+        # Loaded once in the master and shared copy-on-write by every worker
+        STATIC_FILES.preload(os.getcwd())
+        PreforkMaster(ProxyHandler, PORT, PREFORK_PROCESSES, GRACEFUL_TIMEOUT, SERVER_OPTIONS,
+                      on_worker_start=start_prefork_worker, on_worker_stop=stop_prefork_worker).run()
+    else:
+        # Start conversion workers before any server threads exist
+        HEIC_POOL.start()
+        STATIC_FILES.preload(os.getcwd())
+        
+        try:
+            with create_server() as httpd:
+                httpd.serve_forever()
+        finally:
+            HEIC_POOL.shutdown()
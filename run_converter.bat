@@ -12,13 +12,14 @@ if errorlevel 1 (
     exit /b 1
 )
 
-REM Check if ImageMagick is installed
-convert -version >nul 2>&1
+REM Check that a HEIC converter (pillow-heif, heif-convert or ImageMagick) is installed
+python -c "import sys, heic_decode; sys.exit(0 if heic_decode.HeicDecoder().available() else 1)" >nul 2>&1
 if errorlevel 1 (
-    echo ❌ ImageMagick is not installed.
+    echo ❌ No HEIC converter is installed.
     echo.
-    echo To install ImageMagick:
-    echo   Download from: https://imagemagick.org/script/download.php
+    echo To install one:
+    echo   pip install pillow pillow-heif
+    echo   or download ImageMagick from: https://imagemagick.org/script/download.php
     echo.
     pause
 )
@@ -12,11 +12,12 @@ if ! command -v python3 &> /dev/null; then
     exit 1
 fi
 
-# Check if ImageMagick is installed
-if ! command -v convert &> /dev/null; then
-    echo "❌ ImageMagick is not installed."
+# Check that a HEIC converter (pillow-heif, heif-convert or ImageMagick) is installed
+if ! python3 -c "import sys, heic_decode; sys.exit(0 if heic_decode.HeicDecoder().available() else 1)" &> /dev/null; then
+    echo "❌ No HEIC converter is installed."
     echo ""
-    echo "To install ImageMagick:"
+    echo "To install one:"
+    echo "  Any platform: pip install pillow pillow-heif"
     echo "  Mac: brew install imagemagick"
     echo "  Windows: Download from https://imagemagick.org/script/download.php"
     echo "  Linux: sudo apt-get install imagemagick"
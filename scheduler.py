@@ -0,0 +1,182 @@
+"""
+Admission control for the proxy's upstream calls
+
+OpenAI limits an account by requests and tokens per minute, and the proxy
+caps how many calls it has open at once. UpstreamScheduler holds callers
+back until a call fits within all three, letting interactive uploads go
+ahead of live-camera frames, and backs everyone off together after a 429.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class UpstreamBusyError(Exception):
+    """Raised when no upstream slot frees up within the scheduler's wait timeout"""
+
+
+class RequestExpiredError(UpstreamBusyError):
+    """Raised when a live frame's deadline passes before it could be sent upstream"""
+
+
+class TokenBucket:
+    """Refills continuously at rate_per_minute up to one minute's worth; not thread-safe on its own"""
+
+    def __init__(self, rate_per_minute):
+        self.capacity = float(rate_per_minute)
+        self.rate = rate_per_minute / 60.0
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount is available (0 if it is now)"""
+        if not self.rate:
+            return 0.0
+        self._refill(now)
+        amount = min(amount, self.capacity)  # an oversized request waits for a full bucket, not forever
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount, now):
+        if self.rate:
+            self._refill(now)
+            self.level -= amount
+
+    def limit_to(self, remaining, now):
+        """Don't believe we have more budget than the upstream says is left"""
+        if self.rate:
+            self._refill(now)
+            self.level = min(self.level, remaining)
+
+
+class UpstreamScheduler:
+    """Admits OpenAI calls in priority order within the concurrency, request and token budgets
+
+    Callers queue by priority (interactive uploads before live-camera frames),
+    then by arrival. The head of the queue is admitted once an in-flight slot is
+    free, both per-minute buckets cover it, and no 429 cool-down is running.
+    Token costs are estimated up front and corrected from the usage OpenAI
+    reports. Live frames carry a deadline and are dropped once it passes.
+    share is the fraction of the account's limits this process may use, for
+    prefork workers that split them between themselves. on_drop is called
+    with the priority name of every dropped live frame.
+    """
+
+    INTERACTIVE = 0
+    LIVE = 1
+    PRIORITY_NAMES = {INTERACTIVE: 'interactive', LIVE: 'live'}
+
+    def __init__(self, max_inflight, rpm=0, tpm=0, share=1.0, wait_timeout=30.0, on_drop=None):
+        self.max_inflight = max_inflight
+        self.share = share
+        self.wait_timeout = wait_timeout
+        self.on_drop = on_drop
+        self.requests = TokenBucket(rpm * share)
+        self.tokens = TokenBucket(tpm * share)
+        self.condition = threading.Condition()
+        self.waiting = []  # heap of [priority, seq]
+        self.sequence = itertools.count()
+        self.inflight = 0
+        self.blocked_until = 0.0
+        self.admitted = 0
+        self.dropped = 0
+        self.cooldowns = 0
+
+    def acquire(self, priority, tokens, deadline=None, timeout=None, seq=None):
+        """Wait for a turn and return its queue position (pass it back as seq to keep it on retries)
+
+        Raises UpstreamBusyError after timeout (the scheduler's wait_timeout by
+        default), or RequestExpiredError once deadline (a time.monotonic()
+        value) passes.
+        """
+        entry = [priority, next(self.sequence) if seq is None else seq]
+        give_up = time.monotonic() + (self.wait_timeout if timeout is None else timeout)
+        if deadline is not None:
+            give_up = min(give_up, deadline)
+        
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    if deadline is not None and now >= deadline:
+                        self._record_drop(priority)
+                        raise RequestExpiredError("Live frame dropped: too old by the time upstream had room")
+                    delay = None
+                    if self.waiting[0] is entry and self.inflight < self.max_inflight:
+                        delay = max(self.blocked_until - now,
+                                    self.requests.wait_time(1, now),
+                                    self.tokens.wait_time(tokens, now))
+                        if delay <= 0:
+                            heapq.heappop(self.waiting)
+                            self.inflight += 1
+                            self.requests.take(1, now)
+                            self.tokens.take(tokens, now)
+                            self.admitted += 1
+                            # The next in line may be admissible too
+                            self.condition.notify_all()
+                            return entry[1]
+                    
+                    remaining = give_up - now
+                    if remaining <= 0 and give_up != deadline:
+                        raise UpstreamBusyError("Too many OpenAI requests in flight")
+                    self.condition.wait(max(0.0, remaining) if delay is None else max(0.0, min(delay, remaining)))
+            except BaseException:
+                if entry in self.waiting:
+                    self.waiting.remove(entry)
+                    heapq.heapify(self.waiting)
+                    self.condition.notify_all()
+                raise
+
+    def release(self, estimated_tokens, used_tokens=None, headers=None):
+        """Free the slot and reconcile the token estimate with what the upstream reports"""
+        now = time.monotonic()
+        with self.condition:
+            self.inflight -= 1
+            if used_tokens is not None:
+                self.tokens.take(used_tokens - estimated_tokens, now)
+            if headers is not None:
+                for bucket, header in ((self.requests, 'x-ratelimit-remaining-requests'),
+                                       (self.tokens, 'x-ratelimit-remaining-tokens')):
+                    try:
+                        bucket.limit_to(float(headers[header]) * self.share, now)
+                    except (KeyError, TypeError, ValueError):
+                        pass
+            self.condition.notify_all()
+
+    def _record_drop(self, priority):
+        self.dropped += 1
+        if self.on_drop is not None:
+            self.on_drop(self.PRIORITY_NAMES[priority])
+
+    def drop(self, priority, reason):
+        """Count a call given up on outside the queue and raise RequestExpiredError"""
+        with self.condition:
+            self._record_drop(priority)
+        raise RequestExpiredError(reason)
+
+    def cool_down(self, seconds):
+        """Hold every queued call back after a 429, since they all share the exhausted limit"""
+        with self.condition:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.cooldowns += 1
+
+    def stats(self):
+        with self.condition:
+            waiting = {name: 0 for name in self.PRIORITY_NAMES.values()}
+            for priority, _ in self.waiting:
+                waiting[self.PRIORITY_NAMES[priority]] += 1
+            now = time.monotonic()
+            return {
+                'inFlight': self.inflight,
+                'waiting': waiting,
+                'admitted': self.admitted,
+                'droppedStale': self.dropped,
+                'rateLimitCooldowns': self.cooldowns,
+                'coolingDownFor': round(max(0.0, self.blocked_until - now), 2),
+            }
@@ -234,9 +234,12 @@ class BookshelfScanner {
     constructor() {
         this.stream = null;
         this.currentPhotoData = null; // Store current photo for position tracking
+        this.heicPreviewFile = null; // HEIC upload whose quick preview may still be shown
         this.detectionActive = false;
         this.currentUser = null;
         this.library = [];
+        this.serverLibrary = false; // true when the proxy's /api/library store is reachable
+        this.backupSyncTimer = null;
         
         // Clean up any existing photo data that might be causing storage issues
         this.cleanupExistingLibraryData();
@@ -259,6 +262,7 @@ class BookshelfScanner {
         }
         this.currentUser = window.authManager.currentUser;
         await this.loadUserLibrary();
+        await this.attachServerLibrary();
         this.updateLibraryDisplay();
     }
     
@@ -309,6 +313,110 @@ class BookshelfScanner {
         }
     }
     
+    async libraryRequest(method, path = '', body = undefined, query = '') {
+        // The server takes the user from the verified ID token, never from the URL
+        const headers = { 'Authorization': `Bearer ${await this.currentUser.getIdToken()}` };
+        if (body !== undefined) {
+            headers['Content-Type'] = 'application/json';
+        }
+        const response = await fetch(`/api/library${path}${query ? `?${query.replace(/^&/, '')}` : ''}`, {
+            method: method,
+            headers: headers,
+            body: body === undefined ? undefined : JSON.stringify(body)
+        });
+        
+        if (!response.ok) {
+            throw new Error(`Library request failed: ${response.status}`);
+        }
+        
+        return response.json();
+    }
+    
+    async attachServerLibrary() {
+        // The proxy's library store writes one book at a time and indexes titles and authors for search
+        try {
+            const books = [];
+            let cursor = null;
+            do {
+                const page = await this.libraryRequest('GET', '', undefined, `&limit=1000${cursor ? `&cursor=${cursor}` : ''}`);
+                books.push(...page.books);
+                cursor = page.next;
+            } while (cursor);
+            
+            // On the first run this seeds the store with the library loaded from Firestore/localStorage;
+            // later it catches the store up with books added or edited while it was unreachable
+            const { merged, newer, backupStale } = this.mergeLibraries(books, this.library);
+            if (newer.length > 0) {
+                await this.libraryRequest('POST', '/import', { books: newer }, '&mode=merge');
+            }
+            this.library = merged;
+            if (backupStale) {
+                // The server had books or edits the Firestore/localStorage copy missed
+                this.scheduleBackupSync();
+            }
+            
+            this.serverLibrary = true;
+            console.log(`Using server library store (${books.length} books from the server, ` +
+                        `${newer.length} newer or only in Firestore/localStorage; ${merged.length} in total)`);
+        } catch (error) {
+            console.log('Server library store unavailable, saving to Firestore/localStorage only:', error.message);
+        }
+    }
+    
+    mergeLibraries(serverBooks, localBooks) {
+        // Books are matched by id. A book in both keeps whichever copy has the later updatedAt
+        // (addedDate for books saved before updatedAt existed); a tie goes to the server.
+        // Deletions leave no trace, so a book deleted from only one of the two comes back.
+        const bookTime = book => Date.parse(book.updatedAt || book.addedDate || '') || 0;
+        const merged = [...serverBooks];
+        const positions = new Map(serverBooks.map((book, index) => [String(book.id), index]));
+        const newer = [];
+        let matched = 0;
+        let backupStale = false;
+        localBooks.forEach(book => {
+            const index = positions.get(String(book.id));
+            if (index === undefined) {
+                positions.set(String(book.id), merged.length);
+                merged.push(book);
+                newer.push(book);
+                return;
+            }
+            matched++;
+            if (bookTime(book) > bookTime(merged[index])) {
+                merged[index] = book;
+                newer.push(book);
+            } else if (bookTime(book) < bookTime(merged[index])) {
+                backupStale = true;
+            }
+        });
+        return { merged, newer, backupStale: backupStale || matched < serverBooks.length };
+    }
+    
+    async persistLibraryChange(method, book, changes = undefined) {
+        // Write just the changed book to the server store; without it, save the whole library as before
+        if (!this.serverLibrary) {
+            await this.saveLibrary();
+            return;
+        }
+        
+        try {
+            if (method === 'POST') {
+                await this.libraryRequest('POST', '', book);
+            } else {
+                await this.libraryRequest(method, `/${encodeURIComponent(book.id)}`, changes);
+            }
+        } catch (error) {
+            console.error('Error saving book to server library store:', error);
+        }
+        this.scheduleBackupSync();
+    }
+    
+    scheduleBackupSync() {
+        // Firestore and localStorage hold the whole library, so batch their writes into one every few seconds
+        clearTimeout(this.backupSyncTimer);
+        this.backupSyncTimer = setTimeout(() => this.saveLibrary(), 5000);
+    }
+    
     cleanupExistingLibraryData() {
         // Remove any accidentally stored photo data from existing books
         let cleaned = false;
@@ -646,11 +754,12 @@ class BookshelfScanner {
         
         console.log('Sending HEIC data to server for conversion...');
         
-        // Send to server for conversion
+        // Send to server for conversion; ask for raw JPEG bytes to skip the base64 JSON wrapper
         const response = await fetch('/api/convert-heic', {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
+                'Accept': 'image/jpeg, application/json',
             },
             body: JSON.stringify({
                 heicDataUrl: heicDataURL
@@ -665,6 +774,17 @@ class BookshelfScanner {
             throw new Error(`Server error: ${response.status} - ${errorText}`);
         }
         
+        if ((response.headers.get('Content-Type') || '').startsWith('image/jpeg')) {
+            const jpegBlob = await response.blob();
+            console.log('✅ Server-side conversion successful');
+            return await new Promise((resolve, reject) => {
+                const reader = new FileReader();
+                reader.onload = (e) => resolve(e.target.result);
+                reader.onerror = () => reject(new Error('Failed to read converted JPEG'));
+                reader.readAsDataURL(jpegBlob);
+            });
+        }
+        
         const result = await response.json();
         console.log('Server conversion result:', result);
         
@@ -1275,10 +1395,24 @@ class BookshelfScanner {
         // Store the original file for later use
         this.originalFile = file;
         
+        // Full HEIC conversion takes a while; show the server's quick preview in the meantime
+        if (file.type === 'image/heic' || file.type === 'image/heif' || 
+            file.name.toLowerCase().endsWith('.heic') || file.name.toLowerCase().endsWith('.heif')) {
+            this.heicPreviewFile = file;
+            this.showHEICPreview(file);
+        }
+        
         try {
             // Convert to JPEG immediately when uploading
             console.log('Converting uploaded file to JPEG...');
-            const jpegDataURL = await this.convertFileToJPEG(file);
+            let jpegDataURL;
+            try {
+                jpegDataURL = await this.convertFileToJPEG(file);
+            } finally {
+                if (this.heicPreviewFile === file) {
+                    this.heicPreviewFile = null;
+                }
+            }
             
             // Store the JPEG version for later use
             this.processedImageDataURL = jpegDataURL;
@@ -1301,6 +1435,10 @@ class BookshelfScanner {
         } catch (error) {
             console.error('Error processing file:', error);
             
+            // Take down the HEIC preview, if one was shown, so another photo can be picked
+            this.uploadArea.style.display = 'block';
+            this.uploadedImageContainer.style.display = 'none';
+            
             // Check if it's a HEIC format message
             if (error.message.includes('HEIC Format Detected') || error.message.includes('HEIC Conversion Failed') || 
                 error.message.includes('HEIC File Not Supported')) {
@@ -1330,6 +1468,35 @@ class BookshelfScanner {
         }
     }
     
+    async showHEICPreview(file) {
+        try {
+            const response = await fetch('/api/heic-preview', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'image/heic',
+                    'Accept': 'image/jpeg'
+                },
+                body: file
+            });
+            if (!response.ok) {
+                throw new Error(`Preview request failed: ${response.status}`);
+            }
+            const previewURL = URL.createObjectURL(await response.blob());
+            
+            // Too late if the full conversion already finished or another photo was picked
+            if (this.heicPreviewFile !== file) {
+                URL.revokeObjectURL(previewURL);
+                return;
+            }
+            this.uploadedImage.addEventListener('load', () => URL.revokeObjectURL(previewURL), { once: true });
+            this.uploadedImage.src = previewURL;
+            this.uploadArea.style.display = 'none';
+            this.uploadedImageContainer.style.display = 'block';
+        } catch (error) {
+            console.log('HEIC preview unavailable:', error.message);
+        }
+    }
+    
     async convertFileToJPEG(file) {
         console.log('Converting file:', file.name, 'Type:', file.type);
         
@@ -1428,7 +1595,19 @@ class BookshelfScanner {
             console.log('Image data URL preview:', imageDataURL.substring(0, 100) + '...');
             
                 // Improved scan: 5x4 = 20 sections with overlap for better accuracy
-                const scanResults = await this.performScanPass(imageDataURL, 5, 4, 'High-Accuracy-Overlap');
+                // Let the server tile and fan out the sections; fall back to browser-side sectioning
+                let scanResults;
+                try {
+                    scanResults = await this.performServerScan(imageDataURL, 5, 4);
+                } catch (serverScanError) {
+                    // Only when the endpoint is missing or unreachable: after a 429 or 502 the
+                    // browser's 20 section requests would just add to the upstream's load
+                    if (!serverScanError.fallback) {
+                        throw serverScanError;
+                    }
+                    console.warn('Server-side shelf scan unavailable, scanning sections in the browser:', serverScanError.message);
+                    scanResults = await this.performScanPass(imageDataURL, 5, 4, 'High-Accuracy-Overlap');
+                }
             
             // Process books with confidence levels
             const processedBooks = this.processBooksWithConfidence(scanResults.books);
@@ -1464,6 +1643,8 @@ class BookshelfScanner {
                 alert('Invalid API key. Please check your OpenAI API key and try again.');
             } else if (error.message.includes('CORS') || error.message.includes('cors')) {
                 alert('CORS error: Direct API calls from browser are blocked. We need a proxy server for this to work.');
+            } else if (error.message.includes('429')) {
+                alert('The AI service is rate limited right now. Please wait a minute and try again.');
             } else {
                 alert(`Error analyzing photo with AI: ${error.message}\n\nCheck the browser console for more details.`);
             }
@@ -1517,6 +1698,64 @@ class BookshelfScanner {
         };
     }
 
+    async performServerScan(imageDataURL, sectionsX, sectionsY) {
+        this.processingText.textContent = `Scanning Books...`;
+        
+        // One upload: the proxy tiles the photo and analyzes all sections concurrently.
+        // Errors carry fallback: true when scanning in the browser instead makes sense
+        const maxAttempts = 3;
+        let response;
+        for (let attempt = 1; ; attempt++) {
+            try {
+                response = await fetch('/api/scan-shelf', {
+                    method: 'POST',
+                    headers: {
+                        'Content-Type': 'application/json',
+                    },
+                    body: JSON.stringify({
+                        imageDataUrl: imageDataURL,
+                        sectionsX: sectionsX,
+                        sectionsY: sectionsY,
+                        overlap: 0.5
+                    })
+                });
+            } catch (networkError) {
+                throw Object.assign(new Error(`Shelf scan unreachable: ${networkError.message}`), { fallback: true });
+            }
+            
+            if (response.status === 404) {
+                // A proxy without /api/scan-shelf
+                throw Object.assign(new Error('Shelf scan endpoint not found'), { fallback: true });
+            }
+            
+            // Rate limited or busy: wait as long as the server asks, then try again
+            if ((response.status === 429 || response.status === 503) && attempt < maxAttempts) {
+                const retryAfter = parseFloat(response.headers.get('Retry-After'));
+                const delay = Math.min(30000, Number.isFinite(retryAfter) ? retryAfter * 1000 : 1000 * 2 ** attempt);
+                this.processingText.textContent = `Server busy, retrying in ${Math.ceil(delay / 1000)}s...`;
+                await new Promise(resolve => setTimeout(resolve, delay));
+                this.processingText.textContent = `Scanning Books...`;
+                continue;
+            }
+            
+            break;
+        }
+        
+        if (!response.ok) {
+            throw new Error(`Shelf scan request failed: ${response.status}`);
+        }
+        
+        const result = await response.json();
+        console.log(`Server scan: ${result.sections.successful}/${result.sections.total} sections successful, ${result.sections.cached} from cache`);
+        
+        return {
+            books: result.books,
+            successful: result.sections.successful,
+            failed: result.sections.failed,
+            total: result.sections.total
+        };
+    }
+
     async createImageSectionsCustom(imageDataURL, sectionsX, sectionsY) {
         return new Promise((resolve, reject) => {
             const img = new Image();
@@ -2245,6 +2484,38 @@ class BookshelfScanner {
         return popup;
     }
 
+    async readChatCompletion(response, onProgress) {
+        // Streamed answers arrive as server-sent events; cached or non-streaming ones as plain JSON
+        if (!(response.headers.get('Content-Type') || '').includes('text/event-stream')) {
+            const data = await response.json();
+            return data.choices[0].message.content;
+        }
+        
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let content = '';
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            const lines = buffer.split('\n');
+            buffer = lines.pop();
+            for (const line of lines) {
+                if (!line.startsWith('data:')) continue;
+                const payload = line.slice(5).trim();
+                if (payload === '[DONE]') continue;
+                const delta = JSON.parse(payload).choices?.[0]?.delta?.content;
+                if (delta) {
+                    content += delta;
+                    onProgress(content);
+                }
+            }
+        }
+        return content;
+    }
+
     async analyzeWithOpenAIWithRetry(imageDataURL, sectionInfo = '', maxRetries = 3) {
         for (let attempt = 1; attempt <= maxRetries; attempt++) {
             try {
@@ -2328,7 +2599,8 @@ Be thorough but accurate. Better to include questionable titles with low confide
                         ]
                     }
                 ],
-                max_tokens: 500
+                max_tokens: 500,
+                stream: true
             })
         });
 
@@ -2336,8 +2608,13 @@ Be thorough but accurate. Better to include questionable titles with low confide
             throw new Error(`API request failed: ${response.status}`);
         }
 
-        const data = await response.json();
-        const content = data.choices[0].message.content.trim();
+        const content = (await this.readChatCompletion(response, (partial) => {
+            // Show titles as the model writes them instead of after the whole answer
+            const titles = partial.match(/"title"\s*:\s*"[^"]+"/g);
+            if (titles) {
+                this.processingText.textContent = `Scanning Books${sectionInfo ? ` - ${sectionInfo}` : ''}: ${titles.length} found so far`;
+            }
+        })).trim();
         
         console.log('AI Response:', content);
         
@@ -2424,27 +2701,18 @@ Be thorough but accurate. Better to include questionable titles with low confide
         this.processingText.textContent = `Looking up ${bookTitles.length} detected books...`;
         
         const foundBooks = [];
+        const titles = bookTitles.slice(0, 150) // Increased to handle more books
+            .map(bookItem => typeof bookItem === 'string' ? bookItem : bookItem.title);
         
-        for (let i = 0; i < Math.min(bookTitles.length, 150); i++) { // Increased to handle more books
-            const bookItem = bookTitles[i];
-            const title = typeof bookItem === 'string' ? bookItem : bookItem.title;
-            this.processingText.textContent = `Looking up book ${i + 1}/${Math.min(bookTitles.length, 150)}: "${title.substring(0, 30)}${title.length > 30 ? '...' : ''}"`;
-            
-            try {
-                const bookData = await this.searchForBookQuick(title);
-                if (bookData) {
-                    foundBooks.push(bookData);
-                    console.log(`✅ Found: ${bookData.title}`);
-                } else {
-                    console.log(`❌ Not found in database: ${title}`);
-                }
-            } catch (error) {
-                console.error(`🔥 Error searching for "${title}":`, error);
+        const results = await this.findBooksByTitle(titles);
+        results.forEach((bookData, i) => {
+            if (bookData) {
+                foundBooks.push(bookData);
+                console.log(`✅ Found: ${bookData.title}`);
+            } else {
+                console.log(`❌ Not found in database: ${titles[i]}`);
             }
-            
-            // Small delay to avoid rate limiting
-            await new Promise(resolve => setTimeout(resolve, 300));
-        }
+        });
         
         this.hideProcessing();
         
@@ -2511,23 +2779,14 @@ Be thorough but accurate. Better to include questionable titles with low confide
         this.showProcessing(`Searching for ${titles.length} books...`);
         
         const foundBooks = [];
+        this.processingText.textContent = `Scanning Books...`;
         
-        for (let i = 0; i < titles.length; i++) {
-            const title = titles[i];
-            this.processingText.textContent = `Scanning Books...`;
-            
-            try {
-                const bookData = await this.searchForBookQuick(title);
-                if (bookData) {
-                    foundBooks.push(bookData);
-                    console.log(`Found: ${bookData.title}`);
-                }
-            } catch (error) {
-                console.error(`Error searching for "${title}":`, error);
+        const results = await this.findBooksByTitle(titles);
+        for (const bookData of results) {
+            if (bookData) {
+                foundBooks.push(bookData);
+                console.log(`Found: ${bookData.title}`);
             }
-            
-            // Small delay to avoid rate limiting
-            await new Promise(resolve => setTimeout(resolve, 500));
         }
         
         this.hideProcessing();
@@ -2643,16 +2902,7 @@ Be thorough but accurate. Better to include questionable titles with low confide
             const data = await response.json();
             
             if (data.items && data.items.length > 0) {
-                const book = data.items[0].volumeInfo;
-                return {
-                    title: book.title || 'Unknown Title',
-                    authors: book.authors || ['Unknown Author'],
-                    isbn: this.extractISBN(book.industryIdentifiers) || 'N/A',
-                    publishedDate: book.publishedDate || 'Unknown',
-                    description: book.description || 'No description available',
-                    thumbnail: book.imageLinks?.thumbnail || book.imageLinks?.smallThumbnail || '',
-                    source: 'Google Books'
-                };
+                return this.volumeToBook(data.items[0].volumeInfo);
             }
             
             return null;
@@ -2661,6 +2911,58 @@ Be thorough but accurate. Better to include questionable titles with low confide
         }
     }
 
+    volumeToBook(book) {
+        return {
+            title: book.title || 'Unknown Title',
+            authors: book.authors || ['Unknown Author'],
+            isbn: this.extractISBN(book.industryIdentifiers) || 'N/A',
+            publishedDate: book.publishedDate || 'Unknown',
+            description: book.description || 'No description available',
+            thumbnail: book.imageLinks?.thumbnail || book.imageLinks?.smallThumbnail || '',
+            source: 'Google Books'
+        };
+    }
+
+    async lookupBooksBatch(titles, maxResults = 3) {
+        // One request for all titles: the proxy dedupes them, answers repeats from its cache
+        // and searches the rest concurrently. Returns the Google Books items per title, in order.
+        const response = await fetch('/api/books/lookup', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({ titles: titles, maxResults: maxResults })
+        });
+        
+        if (!response.ok) {
+            throw new Error(`Book lookup request failed: ${response.status}`);
+        }
+        
+        const result = await response.json();
+        console.log(`Book lookup: ${result.summary.unique} unique titles, ${result.summary.cached} from cache, ${result.summary.fetched} fetched`);
+        return result.results.map(entry => entry.items);
+    }
+
+    async findBooksByTitle(titles) {
+        // Best match per title (null when nothing matched), via the proxy when it is available
+        try {
+            const itemsPerTitle = await this.lookupBooksBatch(titles);
+            return itemsPerTitle.map(items => items.length > 0 ? this.volumeToBook(items[0].volumeInfo) : null);
+        } catch (error) {
+            console.log('Batch book lookup unavailable, searching one title at a time:', error.message);
+        }
+        
+        const books = [];
+        for (let i = 0; i < titles.length; i++) {
+            this.processingText.textContent = `Looking up book ${i + 1}/${titles.length}: "${titles[i].substring(0, 30)}${titles[i].length > 30 ? '...' : ''}"`;
+            books.push(await this.searchForBookQuick(titles[i]));
+            
+            // Small delay to avoid rate limiting
+            await new Promise(resolve => setTimeout(resolve, 300));
+        }
+        return books;
+    }
+
     cleanOCRText(text) {
         let cleaned = text
             .replace(/[^\w\s\-']/g, ' ')
@@ -2702,13 +3004,14 @@ Be thorough but accurate. Better to include questionable titles with low confide
             ...bookData,
             id: Date.now(),
             addedDate: new Date().toISOString(),
+            updatedAt: new Date().toISOString(), // which copy is newer when the server and Firestore disagree
             photoPosition: photoPosition, // Store where this book was found in the photo
             photoFileName: this.currentPhotoData?.fileName, // Just store filename, not full photo
             photoDate: this.currentPhotoData?.uploadDate // Store when photo was taken
         };
         
         this.library.push(bookToAdd);
-        this.saveLibrary();
+        this.persistLibraryChange('POST', bookToAdd);
         this.updateLibraryDisplay();
         
         // Show success message
@@ -2828,11 +3131,17 @@ Be thorough but accurate. Better to include questionable titles with low confide
         const searchLower = searchTerm.toLowerCase().trim();
         
         if (!searchLower) {
-            // If search is empty, show all books
+            // If search is empty, show all books (and drop any server search still in flight)
+            this.librarySearchId = (this.librarySearchId || 0) + 1;
             this.updateLibraryDisplay();
             return;
         }
 
+        if (this.serverLibrary) {
+            this.searchServerLibrary(searchTerm);
+            return;
+        }
+
         // Filter books based on title or author
         const filteredBooks = this.library.filter(book => {
             const titleMatch = book.title.toLowerCase().includes(searchLower);
@@ -2846,6 +3155,23 @@ Be thorough but accurate. Better to include questionable titles with low confide
         this.renderFilteredLibrary(filteredBooks, searchTerm);
     }
 
+    async searchServerLibrary(searchTerm) {
+        // Full-text search on the server; words match as prefixes of title and author words
+        const searchId = (this.librarySearchId || 0) + 1;
+        this.librarySearchId = searchId;
+        try {
+            const result = await this.libraryRequest('GET', '', undefined, `&q=${encodeURIComponent(searchTerm)}&limit=500`);
+            // Ignore answers to searches the user has already typed past
+            if (searchId === this.librarySearchId) {
+                this.renderFilteredLibrary(result.books, searchTerm);
+            }
+        } catch (error) {
+            console.error('Server library search failed, searching locally:', error);
+            this.serverLibrary = false;
+            this.filterLibrary(searchTerm);
+        }
+    }
+
     renderFilteredLibrary(filteredBooks, searchTerm) {
         this.bookCount.textContent = `${filteredBooks.length} of ${this.library.length}`;
         
@@ -3182,7 +3508,7 @@ Be thorough but accurate. Better to include questionable titles with low confide
         this.library.splice(bookIndex, 1);
         
         // Save the updated library
-        this.saveLibrary();
+        this.persistLibraryChange('DELETE', book);
         
         // Update the display
         this.updateLibraryDisplay();
@@ -3219,13 +3545,19 @@ Be thorough but accurate. Better to include questionable titles with low confide
 
     async searchForAlternateVersions(title) {
         try {
-            // Search Google Books API with more results
-            const response = await fetch(`https://www.googleapis.com/books/v1/volumes?q=${encodeURIComponent(title)}&maxResults=10`);
-            const data = await response.json();
+            // Search Google Books with more results, through the proxy's cache when it is available
+            let items;
+            try {
+                [items] = await this.lookupBooksBatch([title], 10);
+            } catch (error) {
+                const response = await fetch(`https://www.googleapis.com/books/v1/volumes?q=${encodeURIComponent(title)}&maxResults=10`);
+                const data = await response.json();
+                items = data.items;
+            }
             
-            if (!data.items) return [];
+            if (!items) return [];
 
-            return data.items.map(item => {
+            return items.map(item => {
                 const volumeInfo = item.volumeInfo;
                 return {
                     id: item.id,
@@ -3352,12 +3684,17 @@ Be thorough but accurate. Better to include questionable titles with low confide
             addedDate: oldBook.addedDate,
             photoPosition: oldBook.photoPosition,
             photoFileName: oldBook.photoFileName,
-            photoDate: oldBook.photoDate
+            photoDate: oldBook.photoDate,
+            updatedAt: new Date().toISOString()
         };
 
-        // Replace the book in the library
+        // Replace the book in the library; fields the new version lacks are removed on the server
         this.library[bookIndex] = updatedBook;
-        this.saveLibrary();
+        const changes = { ...updatedBook };
+        Object.keys(oldBook).forEach(key => {
+            if (!(key in updatedBook)) changes[key] = null;
+        });
+        this.persistLibraryChange('PATCH', oldBook, changes);
         this.updateLibraryDisplay();
         this.closeReplaceModal();
 
@@ -3455,12 +3792,13 @@ Be thorough but accurate. Better to include questionable titles with low confide
             ...bookData,
             id: Date.now().toString(),
             addedDate: new Date().toISOString(),
+            updatedAt: new Date().toISOString(),
             photoURL: photoURL,
             photoFileName: photoFileName
         };
         
         this.library.push(bookWithPhoto);
-        await this.saveLibrary();
+        await this.persistLibraryChange('POST', bookWithPhoto);
         this.updateLibraryDisplay();
         
         return bookWithPhoto;
@@ -3669,6 +4007,10 @@ Be thorough but accurate. Better to include questionable titles with low confide
     clearLibrary() {
         if (confirm('Are you sure you want to clear your entire library? This cannot be undone.')) {
             this.library = [];
+            if (this.serverLibrary) {
+                this.libraryRequest('POST', '/import', { books: [] }, '&mode=replace')
+                    .catch(error => console.error('Error clearing server library store:', error));
+            }
             this.saveLibrary();
             this.updateLibraryDisplay();
             alert('Library cleared successfully!');
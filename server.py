@@ -0,0 +1,271 @@
+"""
+HTTP servers for the proxy
+
+ThreadPoolHTTPServer answers connections on a fixed pool of threads and
+turns connections away with a 503 when they would only queue up.
+PreforkMaster runs several such servers as processes sharing one listening
+socket, replaces workers that die, and restarts them gracefully on SIGHUP.
+"""
+
+import json
+import os
+import queue
+import random
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+import traceback
+
+DEFAULT_WORKER_THREADS = 16
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_RETRY_AFTER = 2  # seconds a rejected client is asked to wait
+DEFAULT_GRACEFUL_TIMEOUT = 30  # seconds a stopping worker may finish requests
+
+
+class ThreadPoolHTTPServer(socketserver.TCPServer):
+    """TCP server that hands connections to a fixed pool of worker threads
+
+    Accepted connections wait in a bounded queue. When the queue is full the
+    connection is answered straight away with 503 and a Retry-After header
+    instead of piling up behind slow upstream calls.
+    """
+
+    allow_reuse_address = True
+    request_queue_size = 128  # listen() backlog
+
+    def __init__(self, server_address, RequestHandlerClass, bind_and_activate=True,
+                 worker_threads=DEFAULT_WORKER_THREADS, queue_size=DEFAULT_QUEUE_SIZE,
+                 retry_after=DEFAULT_RETRY_AFTER):
+        super().__init__(server_address, RequestHandlerClass, bind_and_activate)
+        self.retry_after = retry_after
+        self.pending = queue.Queue(maxsize=queue_size)
+        self.workers = []
+        for i in range(worker_threads):
+            worker = threading.Thread(target=self._worker_loop, name=f"proxy-worker-{i}", daemon=True)
+            worker.start()
+            self.workers.append(worker)
+
+    def process_request(self, request, client_address):
+        try:
+            self.pending.put_nowait((request, client_address))
+        except queue.Full:
+            self.reject_request(request, client_address)
+
+    def _worker_loop(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            request, client_address = item
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def reject_request(self, request, client_address):
+        """Answer with 503 when every worker is busy and the queue is full"""
+        print(f"Request queue full, rejecting connection from {client_address[0]}")
+        body = json.dumps({
+            'success': False,
+            'error': 'Server busy, please retry shortly'
+        }).encode('utf-8')
+        response = (
+            "HTTP/1.0 503 Service Unavailable\r\n"
+            "Content-Type: application/json\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Retry-After: {self.retry_after}\r\n"
+            "Access-Control-Allow-Origin: *\r\n"
+            "Connection: close\r\n"
+            "\r\n"
+        ).encode('latin-1') + body
+        try:
+            request.settimeout(1.0)
+            request.sendall(response)
+        except OSError:
+            pass
+        self.shutdown_request(request)
+
+    def drain(self, timeout):
+        """After serve_forever returns, wait up to timeout seconds for queued and running requests"""
+        deadline = time.monotonic() + timeout
+        for _ in self.workers:
+            try:
+                # Queued connections are ahead of the stop markers, so they are still answered
+                self.pending.put(None, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                break
+        for worker in self.workers:
+            worker.join(max(0.0, deadline - time.monotonic()))
+        return not any(worker.is_alive() for worker in self.workers)
+
+    def server_close(self):
+        for _ in self.workers:
+            try:
+                self.pending.put_nowait(None)
+            except queue.Full:
+                break
+        super().server_close()
+
+
+class PreforkMaster:
+    """Runs the proxy as several worker processes accepting on one shared listening socket
+
+    The master binds the port and loads what the workers can share (modules,
+    the HEIC opener, static files) before forking, so a new worker is ready at
+    once. Each worker runs a ThreadPoolHTTPServer with its own GIL, and the
+    kernel spreads connections over them. A worker that dies is replaced.
+    SIGHUP starts a fresh set of workers and lets the old ones finish their
+    requests; SIGTERM or SIGINT drains every worker and exits.
+
+    server_options are passed on to each worker's ThreadPoolHTTPServer. A
+    new worker calls on_worker_start(processes) before it serves anything,
+    and a stopping one calls on_worker_stop() after its last request.
+    """
+
+    MAX_RESTART_DELAY = 30
+
+    def __init__(self, handler_class, port, processes=2, graceful_timeout=DEFAULT_GRACEFUL_TIMEOUT,
+                 server_options=None, on_worker_start=None, on_worker_stop=None):
+        self.handler_class = handler_class
+        self.port = port
+        self.processes = max(1, processes)
+        self.graceful_timeout = graceful_timeout
+        self.server_options = server_options or {}
+        self.on_worker_start = on_worker_start
+        self.on_worker_stop = on_worker_stop
+        self.listener = None
+        self.workers = {}  # pid -> (slot, started)
+        self.retiring = set()
+        self.crashes = {}  # slot -> consecutive quick exits
+        self.stopping = False
+        self.stop_deadline = None
+        self.reload_requested = False
+
+    def run(self):
+        if not hasattr(os, 'fork'):
+            raise RuntimeError("Prefork mode needs os.fork (Linux or macOS)")
+        self.listener = socket.create_server(('', self.port), backlog=ThreadPoolHTTPServer.request_queue_size)
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        signal.signal(signal.SIGHUP, self._request_reload)
+        print(f"Prefork master {os.getpid()} starting {self.processes} workers")
+        for slot in range(self.processes):
+            self._spawn(slot)
+        
+        try:
+            while self.workers:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+                if pid:
+                    self._worker_exited(pid, status)
+                elif self.reload_requested:
+                    self._replace_workers()
+                elif self.stopping and time.monotonic() > self.stop_deadline:
+                    print(f"Workers still busy after {self.graceful_timeout:g}s, killing them")
+                    self._signal_workers(signal.SIGKILL)
+                    self.stop_deadline = float('inf')
+                else:
+                    time.sleep(0.2)
+        finally:
+            self.listener.close()
+        print("Prefork master stopped")
+
+    def _request_stop(self, signum, frame):
+        if self.stopping:
+            return
+        print(f"Stopping workers gracefully (signal {signum})")
+        self.stopping = True
+        self.stop_deadline = time.monotonic() + self.graceful_timeout
+        self._signal_workers(signal.SIGTERM)
+
+    def _request_reload(self, signum, frame):
+        self.reload_requested = True
+
+    def _signal_workers(self, signum):
+        for pid in list(self.workers):
+            try:
+                os.kill(pid, signum)
+            except ProcessLookupError:
+                pass
+
+    def _replace_workers(self):
+        """Graceful restart: new workers start accepting before the old ones stop"""
+        self.reload_requested = False
+        if self.stopping:
+            return
+        old = [pid for pid in self.workers if pid not in self.retiring]
+        print(f"Graceful restart: replacing {len(old)} workers")
+        for pid in old:
+            self.retiring.add(pid)
+            self._spawn(self.workers[pid][0])
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def _worker_exited(self, pid, status):
+        slot, started = self.workers.pop(pid)
+        if pid in self.retiring:
+            self.retiring.discard(pid)
+            return
+        if self.stopping:
+            return
+        
+        print(f"Worker {pid} exited unexpectedly ({os.waitstatus_to_exitcode(status)}), starting a replacement")
+        # Back off if a worker keeps dying straight after it starts
+        if time.monotonic() - started < 5:
+            self.crashes[slot] = self.crashes.get(slot, 0) + 1
+            time.sleep(min(self.MAX_RESTART_DELAY, 0.5 * 2 ** self.crashes[slot]))
+        else:
+            self.crashes[slot] = 0
+        self._spawn(slot)
+
+    def _spawn(self, slot):
+        # Unflushed output would otherwise be written again by the child
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 0
+            try:
+                self._run_worker(slot)
+            except BaseException:
+                traceback.print_exc()
+                exit_code = 1
+            finally:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os._exit(exit_code)
+        self.workers[pid] = (slot, time.monotonic())
+
+    def _run_worker(self, slot):
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        # Forked workers would otherwise all draw the same retry jitter
+        random.seed()
+        if self.on_worker_start is not None:
+            self.on_worker_start(self.processes)
+        
+        httpd = ThreadPoolHTTPServer(('', self.port), self.handler_class, bind_and_activate=False,
+                                     **self.server_options)
+        httpd.socket.close()
+        httpd.socket = self.listener
+        
+        def stop(signum, frame):
+            # shutdown() waits for serve_forever, which is running on this thread
+            threading.Thread(target=httpd.shutdown, daemon=True).start()
+        signal.signal(signal.SIGTERM, stop)
+        signal.signal(signal.SIGINT, stop)
+        
+        print(f"Worker {os.getpid()} (slot {slot}) ready")
+        try:
+            httpd.serve_forever()
+            if not httpd.drain(self.graceful_timeout):
+                print(f"Worker {os.getpid()} stopping with requests still running")
+        finally:
+            httpd.server_close()
+            if self.on_worker_stop is not None:
+                self.on_worker_stop()
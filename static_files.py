@@ -0,0 +1,116 @@
+"""
+Static files served from memory
+
+The app's HTML, CSS and JavaScript are read once, compressed with gzip (and
+brotli when it is installed) ahead of time, and served with validators so
+a browser that has them already gets a 304. Databases and dotfiles under
+the served directory are never handed out.
+"""
+
+import gzip
+import mimetypes
+import os
+import re
+import threading
+from email.utils import formatdate
+
+# Brotli is optional; without it static files are only precompressed with gzip
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DEFAULT_MAX_CACHED_FILE = 1024 * 1024  # larger files are sent with sendfile
+STATIC_MIN_COMPRESS_SIZE = 512
+STATIC_COMPRESSIBLE = ('.html', '.css', '.js', '.json', '.svg', '.txt', '.md', '.xml')
+STATIC_SKIP_DIRS = {'.git', '__pycache__', 'node_modules', '.venv', 'venv'}
+# Files with a content hash in the name (e.g. app.3f9a2c1d.js) never change, so browsers may keep them
+HASHED_ASSET_PATTERN = re.compile(r'\.[0-9a-f]{8,}\.[a-z0-9]+$', re.IGNORECASE)
+# SQLite databases and their -wal/-shm/-journal sidecars are never served, wherever they are configured
+PRIVATE_STATIC_PATTERN = re.compile(r'\.(sqlite3?|db)(-wal|-shm|-journal)?$', re.IGNORECASE)
+
+
+class StaticFile:
+    """A static file as it was on disk, plus its precompressed variants"""
+
+    def __init__(self, path, st):
+        self.path = path
+        self.mtime_ns = st.st_mtime_ns
+        self.size = st.st_size
+        self.etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+        self.last_modified = formatdate(st.st_mtime, usegmt=True)
+        self.content_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        if self.content_type.startswith('text/') or self.content_type in ('application/javascript', 'application/json'):
+            self.content_type += '; charset=utf-8'
+        if HASHED_ASSET_PATTERN.search(os.path.basename(path)):
+            self.cache_control = 'public, max-age=31536000, immutable'
+        else:
+            # Always revalidate; the ETag turns that into a cheap 304
+            self.cache_control = 'no-cache'
+        self.data = None
+        self.encodings = {}  # 'br' / 'gzip' -> compressed bytes
+
+    def load(self, max_cached_file=DEFAULT_MAX_CACHED_FILE):
+        """Read files up to max_cached_file bytes into memory and compress the text ones"""
+        if self.size > max_cached_file:
+            return
+        with open(self.path, 'rb') as f:
+            self.data = f.read()
+        if self.size >= STATIC_MIN_COMPRESS_SIZE and self.path.lower().endswith(STATIC_COMPRESSIBLE):
+            self.encodings['gzip'] = gzip.compress(self.data, compresslevel=9, mtime=0)
+            if brotli is not None:
+                self.encodings['br'] = brotli.compress(self.data)
+            # Only keep variants that are actually smaller
+            self.encodings = {name: body for name, body in self.encodings.items() if len(body) < self.size}
+
+    def etag_for(self, encoding):
+        """Strong ETags must differ between content codings of the same file"""
+        return f'{self.etag[:-1]}-{encoding}"' if encoding else self.etag
+
+    def all_etags(self):
+        return {self.etag_for(encoding) for encoding in (None, *self.encodings)}
+
+
+class StaticFileCache:
+    """In-memory cache of static files, refreshed whenever a file's mtime or size changes"""
+
+    def __init__(self, max_cached_file=DEFAULT_MAX_CACHED_FILE):
+        self.max_cached_file = max_cached_file
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def get(self, path):
+        """Return the StaticFile for path, reloading it if it changed on disk"""
+        st = os.stat(path)
+        with self.lock:
+            entry = self.files.get(path)
+        if entry is not None and entry.mtime_ns == st.st_mtime_ns and entry.size == st.st_size:
+            return entry
+        
+        entry = StaticFile(path, st)
+        entry.load(self.max_cached_file)
+        with self.lock:
+            self.files[path] = entry
+        return entry
+
+    def preload(self, directory):
+        """Read and precompress the servable text files under directory"""
+        count = 0
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = [d for d in dirs if d not in STATIC_SKIP_DIRS and not d.startswith('.')]
+            for filename in files:
+                if filename.lower().endswith(STATIC_COMPRESSIBLE):
+                    try:
+                        self.get(os.path.join(root, filename))
+                        count += 1
+                    except OSError:
+                        continue
+        print(f"Precompressed {count} static files ({'brotli + gzip' if brotli else 'gzip'})")
+
+
+def is_private_static_path(path, root):
+    """True for files serve_static must refuse even though they sit under the static root: databases and dotfiles"""
+    if PRIVATE_STATIC_PATTERN.search(os.path.basename(path)):
+        return True
+    relative = os.path.relpath(path, root)
+    return any(part.startswith('.') and part not in ('.', '..') for part in relative.split(os.sep))
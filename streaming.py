@@ -0,0 +1,165 @@
+"""
+Server-sent event streams of chat completions
+
+ChatStreamAssembler rebuilds the complete response from a stream so it can
+be cached, completion_as_events() replays a cached response as a stream,
+and StreamRelay lets identical streaming requests follow the one upstream
+stream that is already open.
+"""
+
+import http.client
+import json
+import threading
+
+
+class ChatStreamAssembler:
+    """Rebuilds a complete chat.completion response from the server-sent events of a stream"""
+
+    def __init__(self):
+        self.pending = b''
+        self.meta = {}
+        self.choices = {}  # index -> {'content': [...], 'finish_reason': ...}
+        self.usage = None
+        self.done = False
+
+    def feed(self, data):
+        self.pending += data
+        *lines, self.pending = self.pending.split(b'\n')
+        for line in lines:
+            line = line.strip()
+            if not line.startswith(b'data:'):
+                continue
+            payload = line[5:].strip()
+            if payload == b'[DONE]':
+                self.done = True
+                continue
+            try:
+                event = json.loads(payload)
+            except ValueError:
+                continue
+            for key in ('id', 'created', 'model', 'system_fingerprint'):
+                if key in event:
+                    self.meta[key] = event[key]
+            if event.get('usage'):
+                self.usage = event['usage']
+            for choice in event.get('choices') or []:
+                state = self.choices.setdefault(choice.get('index', 0), {'content': [], 'finish_reason': None})
+                content = (choice.get('delta') or {}).get('content')
+                if content:
+                    state['content'].append(content)
+                if choice.get('finish_reason'):
+                    state['finish_reason'] = choice['finish_reason']
+
+    def completion(self):
+        """The equivalent non-streaming response body, as bytes"""
+        response = dict(self.meta, object='chat.completion')
+        response['choices'] = [
+            {
+                'index': index,
+                'message': {'role': 'assistant', 'content': ''.join(state['content'])},
+                'finish_reason': state['finish_reason']
+            }
+            for index, state in sorted(self.choices.items())
+        ]
+        if self.usage:
+            response['usage'] = self.usage
+        return json.dumps(response).encode('utf-8')
+
+
+class StreamRelay:
+    """Hands one upstream stream to the requests that asked for the same thing
+
+    The request that opened the stream calls start() once the upstream
+    answered, publish() for every chunk and finish() at the end. Followers
+    wait_start() and then iterate chunks(), which replays what they missed
+    before following live. Followers attach() before they get the relay; once
+    the opener has abandon()ed it, attach() refuses them.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.status = None
+        self.headers = None
+        self.error_data = b''
+        self.error = None
+        self.buffer = []
+        self.finished = False
+        self.complete = False  # the upstream stream ended normally
+        self.followers = 0
+        self.abandoned = False  # the opener stopped reading the upstream stream
+
+    def start(self, status, headers=None, error_data=b''):
+        with self.condition:
+            self.status, self.headers, self.error_data = status, headers, error_data
+            self.condition.notify_all()
+
+    def publish(self, data):
+        with self.condition:
+            self.buffer.append(data)
+            self.condition.notify_all()
+
+    def finish(self, error=None, complete=False):
+        with self.condition:
+            if self.finished:
+                return
+            self.finished = True
+            self.complete = complete
+            self.error = error
+            self.condition.notify_all()
+
+    def wait_start(self):
+        """(status, headers, error_data) of the upstream response; re-raises what stopped it from starting"""
+        with self.condition:
+            self.condition.wait_for(lambda: self.status is not None or self.finished)
+            if self.status is None:
+                raise self.error or http.client.HTTPException("Upstream stream ended before it started")
+            return self.status, self.headers, self.error_data
+
+    def chunks(self):
+        position = 0
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: position < len(self.buffer) or self.finished)
+                new = self.buffer[position:]
+                if not new and self.finished:
+                    return
+            position += len(new)
+            yield from new
+
+    def attach(self):
+        """Count one more follower; False if the stream was already abandoned"""
+        with self.condition:
+            if self.abandoned:
+                return False
+            self.followers += 1
+            return True
+
+    def detach(self):
+        with self.condition:
+            self.followers -= 1
+
+    def abandon(self):
+        """Give up the stream if nobody follows it; False if someone does"""
+        with self.condition:
+            if self.followers:
+                return False
+            self.abandoned = True
+            return True
+
+
+def completion_as_events(response_data):
+    """Replay a complete chat.completion response as server-sent events"""
+    response = json.loads(response_data)
+    events = []
+    for choice in response.get('choices', []):
+        event = {key: response[key] for key in ('id', 'created', 'model') if key in response}
+        events.append({
+            **event,
+            'object': 'chat.completion.chunk',
+            'choices': [{
+                'index': choice.get('index', 0),
+                'delta': {'role': 'assistant', 'content': (choice.get('message') or {}).get('content') or ''},
+                'finish_reason': choice.get('finish_reason')
+            }]
+        })
+    return b''.join(b'data: ' + json.dumps(event).encode('utf-8') + b'\n\n' for event in events) + b'data: [DONE]\n\n'
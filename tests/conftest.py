@@ -0,0 +1,56 @@
+import importlib.util
+import io
+import os
+import sys
+import threading
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture(scope='session')
+def proxy():
+    """proxy-server.py loaded as a module (its file name is not importable)"""
+    spec = importlib.util.spec_from_file_location('proxy_server', os.path.join(ROOT, 'proxy-server.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+@pytest.fixture
+def proxy_port(proxy):
+    """Port of a ProxyHandler server running on a background thread"""
+    server = proxy.ThreadPoolHTTPServer(('127.0.0.1', 0), proxy.ProxyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(scope='session')
+def heic_bytes():
+    """A small HEIC photo"""
+    pillow_heif = pytest.importorskip('pillow_heif')
+    from PIL import Image
+    buffer = io.BytesIO()
+    pillow_heif.from_pillow(Image.new('RGB', (64, 48), (200, 120, 40))).save(buffer, quality=90)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def heic_pool(proxy, monkeypatch):
+    """Converts on the request thread with an empty conversion cache; .calls lists each conversion's quality"""
+    from cache import ContentCache
+    from conversion_pool import ConversionPool
+    pool = ConversionPool(workers=0, backends=('pillow',))
+    pool.calls = []
+    convert = pool.convert
+    def counted(heic_data, quality):
+        pool.calls.append(quality)
+        return convert(heic_data, quality)
+    pool.convert = counted
+    monkeypatch.setattr(proxy, 'HEIC_POOL', pool)
+    monkeypatch.setattr(proxy, 'HEIC_CACHE', ContentCache('HEIC', max_entries=16, max_bytes=16 * 1024 * 1024, ttl=60))
+    return pool
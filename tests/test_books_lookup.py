@@ -0,0 +1,32 @@
+import http.client
+import json
+
+import pytest
+
+
+def post_lookup(port, body):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.request('POST', '/api/books/lookup', json.dumps(body), {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+
+@pytest.mark.parametrize('max_results', ['abc', None, 0, 41, 2.5, [3]])
+def test_bad_max_results_is_rejected(proxy_port, max_results):
+    status, body = post_lookup(proxy_port, {'titles': ['Dune'], 'maxResults': max_results})
+    assert status == 400
+    assert body['success'] is False
+    assert 'maxResults' in body['error']
+
+
+def test_missing_titles_is_rejected(proxy_port):
+    status, body = post_lookup(proxy_port, {'maxResults': 3})
+    assert status == 400
+    assert body['error'] == 'Missing titles'
+
+
+def test_non_object_body_is_rejected(proxy_port):
+    status, body = post_lookup(proxy_port, ['Dune'])
+    assert status == 400
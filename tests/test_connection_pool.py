@@ -0,0 +1,108 @@
+import http.client
+import http.server
+import threading
+import time
+
+import pytest
+
+from connection_pool import ConnectionPool
+
+
+class KeepAliveHandler(http.server.BaseHTTPRequestHandler):
+    """Answers with the client's port, and closes a keep-alive connection after 0.2s idle"""
+    protocol_version = 'HTTP/1.1'
+    timeout = 0.2
+
+    def do_GET(self):
+        if self.path == '/v1/drop':
+            # Hang up without answering, as a crashed upstream would
+            self.close_connection = True
+            return
+        self.server.ports.append(self.client_address[1])
+        body = str(self.client_address[1]).encode()
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def upstream():
+    server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), KeepAliveHandler)
+    server.daemon_threads = True
+    server.ports = []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_pool(server, **options):
+    return ConnectionPool(f'http://127.0.0.1:{server.server_port}/v1', **options)
+
+
+def test_connection_is_reused(upstream):
+    pool = make_pool(upstream)
+    for _ in range(3):
+        status, _, _ = pool.request('GET', '/books')
+        assert status == 200
+    assert len(set(upstream.ports)) == 1
+    assert len(pool.idle) == 1
+    pool.close()
+
+
+def test_stale_connection_is_retried_on_a_fresh_one(upstream):
+    pool = make_pool(upstream)
+    _, _, first = pool.request('GET', '/books')
+    time.sleep(0.5)  # the upstream closes the idle connection meanwhile
+    status, _, second = pool.request('GET', '/books')
+    assert status == 200
+    assert second != first
+    assert len(upstream.ports) == 2
+    pool.close()
+
+
+def test_fresh_connection_is_not_retried(upstream):
+    pool = make_pool(upstream)
+    with pytest.raises(http.client.RemoteDisconnected):
+        pool.request('GET', '/drop')
+    assert not pool.idle
+
+
+def test_connections_idle_too_long_are_not_reused(upstream):
+    pool = make_pool(upstream, idle_timeout=0.05)
+    pool.request('GET', '/books')
+    time.sleep(0.1)
+    pool.request('GET', '/books')
+    assert len(set(upstream.ports)) == 2
+    pool.close()
+
+
+def test_idle_connections_are_capped_at_pool_size(upstream):
+    pool = make_pool(upstream, pool_size=2)
+    opened = [pool.open('GET', '/books') for _ in range(3)]
+    assert len(set(upstream.ports)) == 3
+    for connection, response in opened:
+        response.read()
+        pool.finish(connection, response)
+    assert len(pool.idle) == 2
+    # The two kept connections are the ones handed out next
+    pool.request('GET', '/books')
+    pool.request('GET', '/books')
+    assert len(set(upstream.ports)) == 3
+    pool.close()
+
+
+def test_unread_response_is_not_pooled(upstream):
+    pool = make_pool(upstream)
+    connection, response = pool.open('GET', '/books')
+    pool.finish(connection, response)
+    assert not pool.idle
+
+
+def test_only_http_urls_are_accepted():
+    with pytest.raises(ValueError):
+        ConnectionPool('ftp://example.com/v1')
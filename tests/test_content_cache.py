@@ -0,0 +1,79 @@
+import os
+import time
+
+from cache import ContentCache
+
+
+def make_cache(tmp_path=None, **overrides):
+    options = dict(max_entries=3, max_bytes=1024, ttl=60, disk_dir=str(tmp_path) if tmp_path else None,
+                   disk_max_bytes=1024)
+    options.update(overrides)
+    return ContentCache('test', **options)
+
+
+def test_get_returns_what_was_put():
+    cache = make_cache()
+    assert cache.get('aa01') is None
+    cache.put('aa01', b'hello')
+    assert cache.get('aa01') == b'hello'
+    assert cache.stats()['hits'] == 1
+    assert cache.stats()['misses'] == 1
+
+
+def test_memory_tier_evicts_least_recently_used_entry():
+    cache = make_cache()
+    for key in ('aa01', 'aa02', 'aa03'):
+        cache.put(key, b'x')
+    cache.get('aa01')
+    cache.put('aa04', b'x')
+    assert cache.get('aa02') is None
+    assert cache.get('aa01') == b'x'
+    assert cache.stats()['evictions'] == 1
+
+
+def test_memory_tier_is_bounded_by_bytes():
+    cache = make_cache(max_bytes=10)
+    cache.put('aa01', b'123456')
+    cache.put('aa02', b'123456')
+    assert cache.get('aa01') is None
+    assert cache.stats()['memoryBytes'] == 6
+    # An entry bigger than the whole tier is not kept at all
+    cache.put('aa03', b'x' * 11)
+    assert cache.get('aa03') is None
+
+
+def test_expired_entries_are_misses(monkeypatch):
+    cache = make_cache(ttl=10)
+    cache.put('aa01', b'old')
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11)
+    assert cache.get('aa01') is None
+    assert cache.stats()['entries'] == 0
+
+
+def test_disk_tier_survives_a_new_instance(tmp_path):
+    make_cache(tmp_path).put('ab01', b'persisted')
+    reopened = make_cache(tmp_path)
+    assert reopened.stats()['diskBytes'] == len(b'persisted')
+    assert reopened.get('ab01') == b'persisted'
+    assert reopened.stats()['diskHits'] == 1
+    assert os.path.exists(tmp_path / 'ab' / 'ab01')
+
+
+def test_disk_tier_is_trimmed_least_recently_read_first(tmp_path):
+    cache = make_cache(tmp_path, max_entries=0, disk_max_bytes=250)
+    cache.put('aa01', b'1' * 100)
+    cache.put('aa02', b'2' * 100)
+    # Make aa02 the least recently read
+    os.utime(tmp_path / 'aa' / 'aa02', (1, os.stat(tmp_path / 'aa' / 'aa02').st_mtime))
+    cache.put('aa03', b'3' * 100)
+    assert cache.get('aa02') is None
+    assert cache.get('aa01') == b'1' * 100
+    assert cache.stats()['diskBytes'] <= 250
+
+
+def test_disabled_memory_tier_still_uses_disk(tmp_path):
+    cache = make_cache(tmp_path, max_entries=0)
+    cache.put('aa01', b'data')
+    assert cache.stats()['entries'] == 0
+    assert cache.get('aa01') == b'data'
@@ -0,0 +1,123 @@
+import base64
+import hashlib
+import json
+import random
+import time
+
+import pytest
+
+from firebase_auth import AuthenticationError, FirebaseTokenVerifier
+
+PROJECT = 'test-project'
+
+
+def is_probable_prime(n, rng, rounds=20):
+    if n < 2:
+        return False
+    for p in (2, 3, 5, 7, 11, 13, 17, 19, 23, 29):
+        if n % p == 0:
+            return n == p
+    d, r = n - 1, 0
+    while d % 2 == 0:
+        d //= 2
+        r += 1
+    for _ in range(rounds):
+        x = pow(rng.randrange(2, n - 1), d, n)
+        if x in (1, n - 1):
+            continue
+        for _ in range(r - 1):
+            x = pow(x, 2, n)
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def generate_rsa_key(rng, bits=1024, e=65537):
+    def prime():
+        while True:
+            candidate = rng.getrandbits(bits // 2) | (1 << (bits // 2 - 1)) | 1
+            if (candidate - 1) % e and is_probable_prime(candidate, rng):
+                return candidate
+    p, q = prime(), prime()
+    while q == p:
+        q = prime()
+    return p * q, e, pow(e, -1, (p - 1) * (q - 1))
+
+
+def b64(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def sign_token(key, kid, claims, alg='RS256'):
+    n, _, d = key
+    size = (n.bit_length() + 7) // 8
+    signing_input = f"{b64(json.dumps({'alg': alg, 'kid': kid}).encode())}.{b64(json.dumps(claims).encode())}"
+    digest = bytes.fromhex('3031300d060960864801650304020105000420') + hashlib.sha256(signing_input.encode()).digest()
+    padded = b'\x00\x01' + b'\xff' * (size - len(digest) - 3) + b'\x00' + digest
+    signature = pow(int.from_bytes(padded, 'big'), d, n).to_bytes(size, 'big')
+    return f"{signing_input}.{b64(signature)}"
+
+
+def valid_claims(**overrides):
+    now = int(time.time())
+    claims = {'aud': PROJECT, 'iss': f'https://securetoken.google.com/{PROJECT}', 'sub': 'uid-123',
+              'iat': now - 10, 'auth_time': now - 10, 'exp': now + 3600}
+    claims.update(overrides)
+    return claims
+
+
+@pytest.fixture(scope='module')
+def key():
+    return generate_rsa_key(random.Random(1234))
+
+
+@pytest.fixture
+def verifier(key):
+    verifier = FirebaseTokenVerifier(PROJECT, keys_url='http://127.0.0.1:9/unused')
+    n, e, _ = key
+    verifier.set_keys([{'kty': 'RSA', 'kid': 'k1', 'n': b64(n.to_bytes((n.bit_length() + 7) // 8, 'big')),
+                        'e': b64(e.to_bytes(3, 'big'))}], time.time() + 3600)
+    verifier.keys_fetched_at = time.time()
+    return verifier
+
+
+def test_accepts_valid_token(verifier, key):
+    assert verifier.verify(sign_token(key, 'k1', valid_claims()))['sub'] == 'uid-123'
+
+
+@pytest.mark.parametrize('overrides', [
+    {'aud': 'other-project'},
+    {'iss': 'https://securetoken.google.com/other-project'},
+    {'exp': int(time.time()) - 3600},
+    {'iat': int(time.time()) + 3600},
+    {'sub': ''},
+])
+def test_rejects_bad_claims(verifier, key, overrides):
+    with pytest.raises(AuthenticationError):
+        verifier.verify(sign_token(key, 'k1', valid_claims(**overrides)))
+
+
+def test_rejects_tampered_payload(verifier, key):
+    header, _, signature = sign_token(key, 'k1', valid_claims()).split('.')
+    forged = b64(json.dumps(valid_claims(sub='someone-else')).encode())
+    with pytest.raises(AuthenticationError):
+        verifier.verify(f"{header}.{forged}.{signature}")
+
+
+def test_rejects_other_key_and_algorithm(verifier, key):
+    other = generate_rsa_key(random.Random(99))
+    with pytest.raises(AuthenticationError):
+        verifier.verify(sign_token(other, 'k1', valid_claims()))
+    with pytest.raises(AuthenticationError):
+        verifier.verify(sign_token(key, 'unknown-kid', valid_claims()))
+    with pytest.raises(AuthenticationError):
+        verifier.verify(sign_token(key, 'k1', valid_claims(), alg='none'))
+
+
+@pytest.mark.parametrize('token', ['', 'abc', 'a.b.c', 'e30.e30.'])
+def test_rejects_malformed_tokens(verifier, token):
+    with pytest.raises(AuthenticationError):
+        verifier.verify(token)
+
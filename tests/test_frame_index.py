@@ -0,0 +1,97 @@
+import io
+
+from PIL import Image, ImageDraw
+
+import frame_index
+from frame_index import FrameIndex, frame_hash
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def shelf_jpeg(offset=0, noise=0):
+    """A photo-like gradient with a few dark spines; noise nudges pixel values the way the sensor does"""
+    image = Image.linear_gradient('L').resize((320, 240)).convert('RGB')
+    draw = ImageDraw.Draw(image)
+    for x in range(20, 300, 40):
+        draw.rectangle((x + offset, 30, x + offset + 14, 210), fill=(40, 30, 20))
+    if noise:
+        image = Image.eval(image, lambda value: min(255, value + noise))
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=80)
+    return buffer.getvalue()
+
+
+def test_similar_frames_hash_close_and_different_views_far():
+    base = frame_hash(shelf_jpeg())
+    assert 0 <= base < 1 << 64
+    assert bin(base ^ frame_hash(shelf_jpeg(noise=3))).count('1') <= 6
+    # Half a spine further along the shelf
+    assert bin(base ^ frame_hash(shelf_jpeg(offset=20))).count('1') > 6
+
+
+def test_undecodable_frame_has_no_hash():
+    assert frame_hash(b'not an image') is None
+
+
+def test_match_within_the_hamming_distance():
+    index = FrameIndex(max_distance=2)
+    index.add('ctx', (0b1010_0000,), b'answer')
+    assert index.find('ctx', (0b1010_0011,)) == b'answer'  # two bits differ
+    assert index.find('other ctx', (0b1010_0000,)) is None
+    assert index.stats()['hits'] == 1
+
+
+def test_miss_above_the_threshold():
+    index = FrameIndex(max_distance=2)
+    index.add('ctx', (0b1010_0000,), b'answer')
+    assert index.find('ctx', (0b1010_0111,)) is None  # three bits differ
+    assert index.stats()['misses'] == 1
+
+
+def test_every_image_of_a_request_must_match():
+    index = FrameIndex(max_distance=1)
+    index.add('ctx', (0, 0), b'answer')
+    assert index.find('ctx', (1, 1)) == b'answer'
+    assert index.find('ctx', (1, 3)) is None
+    assert index.find('ctx', (0,)) is None
+
+
+def test_closest_frame_wins():
+    index = FrameIndex(max_distance=4)
+    index.add('ctx', (0b1111,), b'far')
+    index.add('ctx', (0b0001,), b'near')
+    assert index.find('ctx', (0b0000,)) == b'near'
+
+
+def test_entries_expire(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(frame_index, 'time', clock)
+    index = FrameIndex(ttl=30)
+    index.add('ctx', (0,), b'answer')
+    clock.now += 29
+    assert index.find('ctx', (0,)) == b'answer'
+    clock.now += 2
+    assert index.find('ctx', (0,)) is None
+    assert index.stats()['entries'] == 0
+
+
+def test_oldest_entries_are_evicted_beyond_capacity():
+    index = FrameIndex(max_entries=2, max_distance=0)
+    for value in (1, 2, 3):
+        index.add('ctx', (value,), f'answer {value}'.encode())
+    assert index.stats()['entries'] == 2
+    assert index.find('ctx', (1,)) is None
+    assert index.find('ctx', (3,)) == b'answer 3'
+
+
+def test_zero_capacity_disables_the_index():
+    index = FrameIndex(max_entries=0)
+    index.add('ctx', (0,), b'answer')
+    assert index.find('ctx', (0,)) is None
+    assert index.stats()['entries'] == 0
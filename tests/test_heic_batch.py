@@ -0,0 +1,173 @@
+import base64
+import io
+import json
+import socket
+import zipfile
+
+import pytest
+
+from cache import ContentCache
+from conversion_pool import ConversionPool
+from heic_batch import ChunkedWriter, HeicBatch, batch_output_name, zip_batch_items
+from multipart import RequestBodyError, SpooledUpload
+
+BOUNDARY = 'testboundary123'
+
+
+def upload(data, name='photo.heic'):
+    spooled = SpooledUpload(filename=name)
+    spooled.write(data)
+    spooled.finish()
+    return spooled
+
+
+def run_batch(items, cache=None):
+    batch = HeicBatch(items, ConversionPool(workers=0, backends=('pillow',)),
+                      cache or ContentCache('HEIC', max_entries=16, max_bytes=16 * 1024 * 1024, ttl=60))
+    return sorted(batch.results(), key=lambda result: result['index'])
+
+
+def zip_of(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+
+def post_raw(port, path, body, content_type):
+    """Send a request and return (status line, headers, raw body) without decoding the chunks"""
+    with socket.create_connection(('127.0.0.1', port), timeout=30) as connection:
+        connection.sendall(f'POST {path} HTTP/1.1\r\nHost: localhost\r\nContent-Type: {content_type}\r\n'
+                           f'Content-Length: {len(body)}\r\n\r\n'.encode() + body)
+        response = b''
+        while chunk := connection.recv(65536):
+            response += chunk
+    head, _, raw = response.partition(b'\r\n\r\n')
+    status, *lines = head.decode().split('\r\n')
+    return status, dict(line.split(': ', 1) for line in lines), raw
+
+
+def dechunk(raw):
+    """The body of a chunked response; fails unless it ends with the final empty chunk"""
+    body = b''
+    while True:
+        size_line, _, raw = raw.partition(b'\r\n')
+        size = int(size_line, 16)
+        if size == 0:
+            assert raw == b'\r\n'
+            return body
+        body += raw[:size]
+        assert raw[size:size + 2] == b'\r\n'
+        raw = raw[size + 2:]
+
+
+def multipart_files(files):
+    body = b''
+    for name, data in files:
+        body += (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="heicFile"; filename="{name}"\r\n'
+                 f'Content-Type: image/heic\r\n\r\n').encode() + data + b'\r\n'
+    return body + f'--{BOUNDARY}--\r\n'.encode()
+
+
+def test_batch_converts_each_file_and_reuses_the_cache(heic_bytes):
+    cache = ContentCache('HEIC', max_entries=16, max_bytes=16 * 1024 * 1024, ttl=60)
+    results = run_batch([('a.heic', lambda: upload(heic_bytes)), ('b.heic', lambda: upload(heic_bytes))], cache)
+    assert [result['success'] for result in results] == [True, True]
+    assert results[0]['jpeg'].startswith(b'\xff\xd8')
+    assert results[0]['backend'] == 'pillow'
+
+    again = run_batch([('c.heic', lambda: upload(heic_bytes))], cache)
+    assert again[0]['cache'] == 'HIT' and again[0]['backend'] == 'cache'
+
+
+def test_failed_files_get_their_own_error_entries(heic_bytes):
+    def missing():
+        raise OSError('member vanished')
+
+    results = run_batch([
+        ('good.heic', lambda: upload(heic_bytes)),
+        ('junk.heic', lambda: upload(b'not a heic file')),
+        ('empty.heic', lambda: upload(b'')),
+        ('gone.heic', missing),
+    ])
+    assert results[0]['success'] is True
+    assert results[1] == {'index': 1, 'name': 'junk.heic', 'success': False,
+                          'error': 'Server-side HEIC conversion failed'}
+    assert results[2]['error'] == 'Empty file'
+    assert results[3]['error'] == 'member vanished'
+
+
+def test_zip_items_skip_other_files_and_resource_forks(heic_bytes):
+    archive = zipfile.ZipFile(io.BytesIO(zip_of([
+        ('shelf/one.HEIC', heic_bytes), ('notes.txt', b'hi'), ('__MACOSX/shelf/._one.HEIC', b'fork'),
+        ('shelf/._two.heic', b'fork'), ('two.heif', heic_bytes),
+    ])))
+    items = zip_batch_items(archive)
+    assert [name for name, _ in items] == ['shelf/one.HEIC', 'two.heif']
+    with items[0][1]() as member:
+        assert member.filename == 'one.HEIC' and member.read() == heic_bytes
+
+
+def test_zip_items_are_checked_against_the_limits(heic_bytes):
+    archive = zipfile.ZipFile(io.BytesIO(zip_of([('a.heic', heic_bytes), ('b.heic', heic_bytes)])))
+    with pytest.raises(RequestBodyError) as error:
+        zip_batch_items(archive, max_files=1)
+    assert error.value.status == 400
+    with pytest.raises(RequestBodyError) as error:
+        zip_batch_items(archive, max_bytes=len(heic_bytes))
+    assert error.value.status == 413
+
+
+def test_output_names_are_unique():
+    used = set()
+    assert [batch_output_name(name, used) for name in ('IMG_1.heic', 'x/img_1.HEIF', 'IMG_1.heic', 'a\\b.heic')] \
+        == ['IMG_1.jpg', 'img_1-2.jpg', 'IMG_1-3.jpg', 'b.jpg']
+
+
+def test_chunked_writer_frames_each_write():
+    raw = io.BytesIO()
+    writer = ChunkedWriter(raw)
+    writer.write(b'hello')
+    writer.write(b'')  # an empty write must not end the body early
+    writer.write(b'x' * 20)
+    writer.close()
+    assert raw.getvalue() == b'5\r\nhello\r\n14\r\n' + b'x' * 20 + b'\r\n0\r\n\r\n'
+    assert dechunk(raw.getvalue()) == b'hello' + b'x' * 20
+
+
+def test_endpoint_streams_ndjson(proxy_port, heic_pool, heic_bytes):
+    status, headers, raw = post_raw(proxy_port, '/api/convert-heic-batch',
+                                    multipart_files([('a.heic', heic_bytes), ('bad.heic', b'junk')]),
+                                    f'multipart/form-data; boundary={BOUNDARY}')
+    assert status == 'HTTP/1.1 200 OK'
+    assert headers['Content-Type'] == 'application/x-ndjson'
+    assert headers['Transfer-Encoding'] == 'chunked'
+    lines = [json.loads(line) for line in dechunk(raw).splitlines()]
+    records, summary = sorted(lines[:-1], key=lambda record: record['index']), lines[-1]
+    assert records[0]['success'] is True
+    assert base64.b64decode(records[0]['jpegDataUrl'].split(',', 1)[1]).startswith(b'\xff\xd8')
+    assert records[1]['success'] is False and records[1]['name'] == 'bad.heic'
+    assert summary['done'] is True
+    assert (summary['files'], summary['converted'], summary['failed']) == (2, 1, 1)
+
+
+def test_endpoint_streams_a_zip_from_a_zip(proxy_port, heic_pool, heic_bytes):
+    body = zip_of([('IMG_1.heic', heic_bytes), ('more/IMG_1.heic', heic_bytes), ('bad.heic', b'junk')])
+    status, headers, raw = post_raw(proxy_port, '/api/convert-heic-batch?format=zip', body, 'application/zip')
+    assert status == 'HTTP/1.1 200 OK'
+    assert headers['Content-Type'] == 'application/zip'
+    with zipfile.ZipFile(io.BytesIO(dechunk(raw))) as archive:
+        assert sorted(archive.namelist()) == ['IMG_1-2.jpg', 'IMG_1.jpg', 'manifest.json']
+        manifest = json.loads(archive.read('manifest.json'))
+        assert archive.read('IMG_1.jpg').startswith(b'\xff\xd8')
+    assert (manifest['converted'], manifest['failed']) == (2, 1)
+    assert [entry['index'] for entry in manifest['files']] == [0, 1, 2]
+    assert manifest['files'][2] == {'index': 2, 'name': 'bad.heic', 'success': False,
+                                    'error': 'Server-side HEIC conversion failed'}
+
+
+def test_endpoint_rejects_other_content_types(proxy_port):
+    status, _, raw = post_raw(proxy_port, '/api/convert-heic-batch', b'{}', 'application/json')
+    assert status.split()[1] == '415'
+    assert json.loads(raw)['success'] is False
@@ -0,0 +1,77 @@
+import base64
+import http.client
+import json
+
+from conversion_pool import heic_cache_key
+from multipart import SpooledUpload
+
+BOUNDARY = 'testboundary123'
+
+
+def post(port, path, body, headers):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    connection.request('POST', path, body, headers)
+    response = connection.getresponse()
+    result = response.status, dict(response.getheaders()), response.read()
+    connection.close()
+    return result
+
+
+def convert_json(port, heic_bytes, **headers):
+    body = json.dumps({'heicDataUrl': 'data:image/heic;base64,' + base64.b64encode(heic_bytes).decode()})
+    return post(port, '/api/convert-heic', body, {'Content-Type': 'application/json', **headers})
+
+
+def convert_direct(port, heic_bytes, **headers):
+    body = (f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="heicFile"; filename="photo.heic"\r\n'
+            f'Content-Type: image/heic\r\n\r\n').encode() + heic_bytes + f'\r\n--{BOUNDARY}--\r\n'.encode()
+    return post(port, '/api/convert-heic-direct', body,
+                {'Content-Type': f'multipart/form-data; boundary={BOUNDARY}', **headers})
+
+
+def test_cache_key_follows_the_quality(heic_bytes):
+    assert heic_cache_key(heic_bytes, 85) != heic_cache_key(heic_bytes, 95)
+    assert heic_cache_key(heic_bytes, 85, 256) != heic_cache_key(heic_bytes, 85)
+
+
+def test_cache_key_of_a_spooled_upload_matches_the_bytes(heic_bytes):
+    with SpooledUpload(threshold=16) as upload:
+        upload.write(heic_bytes)
+        upload.finish()
+        assert heic_cache_key(upload, 95) == heic_cache_key(heic_bytes, 95)
+
+
+def test_repeat_conversion_is_a_cache_hit(proxy_port, heic_pool, heic_bytes):
+    status, headers, first = convert_json(proxy_port, heic_bytes)
+    assert status == 200 and headers['X-Cache'] == 'MISS'
+    assert json.loads(first)['jpegDataUrl'].startswith('data:image/jpeg;base64,')
+
+    status, headers, second = convert_json(proxy_port, heic_bytes)
+    assert status == 200 and headers['X-Cache'] == 'HIT'
+    assert second == first
+    assert heic_pool.calls == [85]
+
+
+def test_matching_if_none_match_gets_304(proxy_port, heic_pool, heic_bytes):
+    _, headers, _ = convert_json(proxy_port, heic_bytes)
+    etag = headers['ETag']
+
+    status, headers, body = convert_json(proxy_port, heic_bytes, **{'If-None-Match': etag})
+    assert status == 304 and body == b''
+    assert headers['ETag'] == etag
+    # The raw JPEG is another representation, so the JSON ETag does not match it
+    status, headers, body = convert_json(proxy_port, heic_bytes, **{'If-None-Match': etag, 'Accept': 'image/jpeg'})
+    assert status == 200 and headers['Content-Type'] == 'image/jpeg'
+    assert headers['ETag'] != etag
+    assert heic_pool.calls == [85]
+
+
+def test_cached_conversion_follows_the_quality(proxy_port, heic_pool, heic_bytes):
+    _, json_headers, _ = convert_json(proxy_port, heic_bytes)
+    # /api/convert-heic-direct encodes at quality 95, so the quality-85 result is not reused
+    status, headers, body = convert_direct(proxy_port, heic_bytes)
+    assert status == 200 and headers['X-Cache'] == 'MISS'
+    assert headers['ETag'] != json_headers['ETag']
+    status, headers, _ = convert_direct(proxy_port, heic_bytes)
+    assert headers['X-Cache'] == 'HIT'
+    assert heic_pool.calls == [85, 95]
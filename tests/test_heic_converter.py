@@ -0,0 +1,155 @@
+import json
+import os
+import threading
+
+import pytest
+
+tk = pytest.importorskip('tkinter')
+
+import heic_converter
+from heic_converter import MANIFEST_NAME, ConversionManifest, HEICConverter
+
+
+@pytest.fixture
+def converted(tmp_path):
+    """A source file with its JPEG next to it, recorded in a fresh manifest"""
+    source = tmp_path / 'IMG_1.heic'
+    source.write_bytes(b'heic bytes' * 100)
+    output = tmp_path / 'IMG_1.jpg'
+    output.write_bytes(b'jpeg')
+    manifest = ConversionManifest(tmp_path)
+    manifest.record(source, output)
+    return manifest, source, output
+
+
+def test_unchanged_file_is_up_to_date(converted):
+    manifest, source, output = converted
+    assert manifest.is_up_to_date(source, output)
+
+
+def test_size_change_means_out_of_date(converted):
+    manifest, source, output = converted
+    source.write_bytes(b'heic bytes' * 101)
+    assert not manifest.is_up_to_date(source, output)
+
+
+def test_touched_file_is_checked_by_content(converted):
+    manifest, source, output = converted
+    mtime = os.stat(source).st_mtime
+    os.utime(source, (mtime + 10, mtime + 10))
+    assert manifest.is_up_to_date(source, output)
+    # The new mtime is remembered, so the next check skips the hash
+    assert manifest.entries['IMG_1.heic']['mtime'] == mtime + 10
+    assert manifest.dirty
+
+    source.write_bytes(b'HEIC BYTES' * 100)  # same size, different content
+    os.utime(source, (mtime + 20, mtime + 20))
+    assert not manifest.is_up_to_date(source, output)
+
+
+def test_missing_output_means_out_of_date(converted):
+    manifest, source, output = converted
+    output.unlink()
+    assert not manifest.is_up_to_date(source, output)
+
+
+def test_saved_manifest_is_read_back(converted, tmp_path):
+    manifest, source, output = converted
+    manifest.save()
+    assert not (tmp_path / (MANIFEST_NAME + '.tmp')).exists()
+    data = json.loads((tmp_path / MANIFEST_NAME).read_text())
+    assert data['version'] == 1 and data['files']['IMG_1.heic']['output'] == 'IMG_1.jpg'
+    assert ConversionManifest(tmp_path).is_up_to_date(source, output)
+
+
+def test_failed_save_leaves_the_old_manifest(converted, tmp_path, monkeypatch):
+    manifest, source, output = converted
+    manifest.save()
+    before = (tmp_path / MANIFEST_NAME).read_bytes()
+    other = tmp_path / 'IMG_2.heic'
+    other.write_bytes(b'other')
+    manifest.record(other, tmp_path / 'IMG_2.jpg')
+
+    def crash(src, dst):
+        raise OSError('disk full')
+    monkeypatch.setattr(heic_converter.os, 'replace', crash)
+    manifest.save()
+    # The new contents only ever land in the temp file
+    assert (tmp_path / MANIFEST_NAME).read_bytes() == before
+    assert manifest.dirty
+
+    monkeypatch.undo()
+    manifest.save()
+    assert 'IMG_2.heic' in json.loads((tmp_path / MANIFEST_NAME).read_text())['files']
+
+
+def test_corrupt_manifest_starts_empty(tmp_path):
+    (tmp_path / MANIFEST_NAME).write_text('{"files": ')
+    assert ConversionManifest(tmp_path).entries == {}
+
+
+class Widget:
+    """Stands in for the Tk widgets the batch thread updates"""
+
+    def __init__(self):
+        self.text = ''
+
+    def config(self, **options):
+        self.options = options
+
+    def insert(self, index, text):
+        self.text += text
+
+    def delete(self, *args):
+        self.text = ''
+
+
+class Root:
+    def after(self, delay, callback):
+        callback()
+
+
+@pytest.fixture
+def app():
+    app = HEICConverter.__new__(HEICConverter)
+    app.root = Root()
+    app.batch_running = True
+    app.batch_cancelled = False
+    app.batch_futures = []
+    app.batch_lock = threading.Lock()
+    for name in ('progress', 'status_label', 'results_text', 'single_btn', 'folder_btn', 'cancel_btn'):
+        setattr(app, name, Widget())
+    return app
+
+
+def test_cancel_drops_queued_files(app, tmp_path):
+    started = threading.Event()
+    release = threading.Event()
+    converted = []
+    def convert(path):
+        started.set()
+        release.wait(5)
+        converted.append(path)
+        return str(heic_converter.jpeg_output_path(path))
+    app.convert_heic_to_jpeg = convert
+
+    paths = [str(tmp_path / f'IMG_{i}.heic') for i in range(5)]
+    thread = threading.Thread(target=app._convert_files_thread, args=(paths, 1))
+    thread.start()
+    started.wait(5)
+    app.cancel_conversion()
+    release.set()
+    thread.join(5)
+
+    # The file already converting finishes; the four queued behind it never start
+    assert converted == paths[:1]
+    assert 'cancelled' in app.results_text.text
+    assert 'Successful: 1' in app.results_text.text and 'Skipped: 4' in app.results_text.text
+    assert app.batch_futures == [] and not app.batch_running
+
+
+def test_cancel_before_submission_skips_everything(app, tmp_path):
+    app.convert_heic_to_jpeg = lambda path: pytest.fail('nothing should be converted')
+    app.batch_cancelled = True
+    app._convert_files_thread([str(tmp_path / 'IMG_1.heic'), str(tmp_path / 'IMG_2.heic')], 2)
+    assert 'Skipped: 2' in app.results_text.text
@@ -0,0 +1,134 @@
+import pytest
+
+import heic_decode
+from heic_decode import BackendSelector, DecodeError, file_signature
+
+
+def ftyp(major, *compatible, size=None):
+    box = b'ftyp' + major + b'\x00\x00\x00\x00' + b''.join(compatible)
+    return (size or len(box) + 4).to_bytes(4, 'big') + box + b'\x00' * 32
+
+
+@pytest.fixture
+def selector(monkeypatch):
+    for name in heic_decode.BACKENDS:
+        monkeypatch.setattr(heic_decode.BACKENDS[name], 'available', lambda: True)
+    return BackendSelector(('pillow', 'heif-convert', 'imagemagick'), explore_every=1000)
+
+
+def test_file_signature_lists_the_brands():
+    assert file_signature(ftyp(b'heic', b'mif1', b'heic', b'miaf')) == 'heic/heic,miaf,mif1'
+    assert file_signature(ftyp(b'mif1', b'heic')) == 'mif1/heic'
+
+
+def test_file_signature_of_other_files():
+    assert file_signature(b'\xff\xd8\xff\xe0 a JPEG') == 'unknown'
+    assert file_signature(b'') == 'unknown'
+
+
+def test_file_signature_stays_inside_the_box():
+    # A box size smaller than what was read keeps the bytes after it out of the brands
+    data = ftyp(b'heic', b'mif1', size=20) + b'junk'
+    assert file_signature(data) == 'heic/mif1'
+
+
+def test_file_signature_reads_paths(tmp_path):
+    path = tmp_path / 'photo.heic'
+    path.write_bytes(ftyp(b'heix', b'mif1'))
+    assert file_signature(str(path)) == 'heix/mif1'
+
+
+def test_unknown_backend_names_are_rejected():
+    with pytest.raises(ValueError):
+        BackendSelector(('pillow', 'gimp'))
+
+
+def test_unavailable_backends_are_left_out(monkeypatch):
+    monkeypatch.setattr(heic_decode.BACKENDS['imagemagick'], 'available', lambda: False)
+    monkeypatch.setattr(heic_decode.BACKENDS['pillow'], 'available', lambda: True)
+    monkeypatch.setattr(heic_decode.BACKENDS['heif-convert'], 'available', lambda: True)
+    assert BackendSelector().names == ['pillow', 'heif-convert']
+
+
+def test_backend_that_failed_where_another_worked_goes_last(selector):
+    selector.record('heic/mif1', 1024 * 1024, [('pillow', 0.1, 'unsupported'), ('heif-convert', 0.2, None)], True)
+    order = selector.order('heic/mif1')
+    assert order[-1] == 'pillow'
+    # Other kinds of file are not affected
+    assert selector.order('avif/mif1')[0] == 'pillow'
+
+
+def test_file_is_blamed_when_every_backend_fails(selector):
+    attempts = [(name, 0.1, 'broken file') for name in selector.names]
+    selector.record('heic/mif1', 1024, attempts, False)
+    assert selector.stats()['signatures'] == {}
+
+
+def test_faster_backends_go_first(selector):
+    selector.record('heic/mif1', 1024 * 1024, [('pillow', 2.0, None)], True)
+    selector.record('heic/mif1', 1024 * 1024, [('heif-convert', 0.5, None)], True)
+    selector.record('heic/mif1', 1024 * 1024, [('imagemagick', 1.0, None)], True)
+    assert selector.order('heic/mif1') == ['heif-convert', 'imagemagick', 'pillow']
+    stats = selector.stats()['signatures']['heic/mif1']
+    assert stats['heif-convert'] == {'secondsPerMB': 0.5}
+
+
+def test_success_clears_earlier_failures(selector):
+    selector.record('heic/mif1', 1024, [('pillow', 0.1, 'error'), ('heif-convert', 0.1, None)], True)
+    selector.record('heic/mif1', 1024, [('pillow', 0.1, None)], True)
+    assert 'failures' not in selector.stats()['signatures']['heic/mif1']['pillow']
+
+
+def test_untimed_backends_are_explored_now_and_then(monkeypatch):
+    for name in heic_decode.BACKENDS:
+        monkeypatch.setattr(heic_decode.BACKENDS[name], 'available', lambda: True)
+    selector = BackendSelector(('pillow', 'heif-convert'), explore_every=3)
+    selector.record('heic/mif1', 1024 * 1024, [('pillow', 0.1, None)], True)
+    firsts = [selector.order('heic/mif1')[0] for _ in range(6)]
+    assert firsts.count('heif-convert') == 2
+
+
+def test_convert_with_reports_every_attempt(monkeypatch):
+    def fail(source, quality, timeout):
+        raise RuntimeError('cannot decode')
+    monkeypatch.setattr(heic_decode.BACKENDS['pillow'], 'convert', fail)
+    monkeypatch.setattr(heic_decode.BACKENDS['heif-convert'], 'convert', lambda source, quality, timeout: b'jpeg')
+    conversion = heic_decode.convert_with(['pillow', 'heif-convert'], b'data', 90)
+    assert conversion.jpeg == b'jpeg' and conversion.backend == 'heif-convert'
+    assert [(name, error) for name, _, error in conversion.attempts] == [('pillow', 'cannot decode'),
+                                                                         ('heif-convert', None)]
+    with pytest.raises(DecodeError) as error:
+        heic_decode.convert_with(['pillow'], b'data', 90)
+    assert error.value.attempts[0][2] == 'cannot decode'
+
+
+def test_backends_must_implement_available_and_convert():
+    with pytest.raises(TypeError):
+        heic_decode.Backend()
+
+    class Partial(heic_decode.Backend):
+        def available(self):
+            return True
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_command_backends_must_build_a_command():
+    class NoCommand(heic_decode.CommandBackend):
+        executables = ('cp',)
+
+    with pytest.raises(TypeError):
+        NoCommand()
+
+    class Copy(heic_decode.CommandBackend):
+        name = label = 'copy'
+        executables = ('cp',)
+
+        def command(self, input_path, output_path, quality):
+            return [self.executable(), input_path, output_path]
+
+    backend = Copy()
+    assert backend.available()
+    # Bytes are written to the private temp directory and the output read back from it
+    assert backend.convert(b'not really a jpeg', 90) == b'not really a jpeg'
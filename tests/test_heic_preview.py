@@ -0,0 +1,59 @@
+import http.client
+import io
+import json
+
+import pytest
+from PIL import Image
+
+from conversion_pool import PreviewDecodeError, heic_preview_jpeg
+
+# An ftyp box that claims HEIC, followed by nothing libheif can use
+BROKEN_HEIC = b'\x00\x00\x00\x18ftypheic\x00\x00\x00\x00mif1heic' + b'\x00' * 64
+
+
+def post_preview(port, body, query='?maxSize=32', **headers):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+    connection.request('POST', '/api/heic-preview' + query, body,
+                       {'Content-Type': 'application/octet-stream', **headers})
+    response = connection.getresponse()
+    result = response.status, dict(response.getheaders()), response.read()
+    connection.close()
+    return result
+
+
+def jpeg_bytes():
+    buffer = io.BytesIO()
+    Image.new('RGB', (16, 16), 'red').save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def test_preview_is_scaled_down(proxy_port, heic_pool, heic_bytes):
+    status, headers, body = post_preview(proxy_port, heic_bytes, Accept='image/jpeg')
+    assert status == 200 and headers['Content-Type'] == 'image/jpeg'
+    assert max(Image.open(io.BytesIO(body)).size) == 32
+
+
+def test_file_that_is_not_heic_gets_415(proxy_port, heic_pool):
+    for body in (jpeg_bytes(), b'plain text, not an image'):
+        status, _, response = post_preview(proxy_port, body)
+        assert status == 415
+        assert json.loads(response) == {'success': False, 'error': 'Not a HEIC/HEIF file'}
+
+
+def test_undecodable_heic_gets_422(proxy_port, heic_pool):
+    status, _, response = post_preview(proxy_port, BROKEN_HEIC)
+    assert status == 422
+    assert json.loads(response)['success'] is False
+
+
+def test_bad_max_size_gets_400(proxy_port, heic_pool, heic_bytes):
+    for query in ('?maxSize=abc', '?maxSize=4'):
+        status, _, _ = post_preview(proxy_port, heic_bytes, query)
+        assert status == 400
+
+
+def test_decode_errors_are_preview_decode_errors():
+    with pytest.raises(PreviewDecodeError):
+        heic_preview_jpeg(BROKEN_HEIC, 32)
+    with pytest.raises(PreviewDecodeError):
+        heic_preview_jpeg(jpeg_bytes(), 32)
@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+from library_store import LibraryConflictError, LibraryStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return LibraryStore(str(tmp_path / 'data' / 'library.sqlite3'))
+
+
+def test_append_assigns_ids_and_rejects_duplicates(store):
+    book = store.append('alice', {'title': 'Dune', 'authors': ['Frank Herbert']})
+    assert book['id']
+    assert store.get('alice', book['id']) == book
+    with pytest.raises(LibraryConflictError):
+        store.append('alice', {'id': book['id'], 'title': 'Other'})
+
+
+def test_users_are_kept_apart(store):
+    store.append('alice', {'id': '1', 'title': 'Dune'})
+    store.append('bob', {'id': '1', 'title': 'Emma'})
+    assert store.get('alice', '1')['title'] == 'Dune'
+    assert store.get('bob', '1')['title'] == 'Emma'
+    assert store.search('bob', 'dune', 10) == ([], None)
+    assert not store.delete('bob', '2')
+    assert store.delete('bob', '1')
+    assert store.get('alice', '1') is not None
+
+
+def test_list_pages_in_insertion_order(store):
+    for i in range(5):
+        store.append('alice', {'id': str(i), 'title': f'Book {i}'})
+    books, cursor, total = store.list('alice', 2)
+    assert [book['id'] for book in books] == ['0', '1'] and total == 5
+    books, cursor, _ = store.list('alice', 2, cursor)
+    assert [book['id'] for book in books] == ['2', '3']
+    books, cursor, _ = store.list('alice', 2, cursor)
+    assert [book['id'] for book in books] == ['4'] and cursor is None
+
+
+def test_search_matches_word_prefixes_in_titles_and_authors(store):
+    store.import_books('alice', [
+        {'id': '1', 'title': 'Dune Messiah', 'authors': ['Frank Herbert']},
+        {'id': '2', 'title': 'Middlemarch', 'authors': ['George Eliot']},
+        {'id': '3', 'title': 'Children of Dune', 'authors': ['Frank Herbert']},
+    ])
+    books, _ = store.search('alice', 'herb dun', 10)
+    assert sorted(book['id'] for book in books) == ['1', '3']
+    books, _ = store.search('alice', 'eliot', 10)
+    assert [book['id'] for book in books] == ['2']
+    assert store.search('alice', '!!', 10) == ([], None)
+
+
+def test_patch_merges_and_removes_fields_and_updates_the_index(store):
+    store.append('alice', {'id': '1', 'title': 'Dune', 'notes': 'signed'})
+    book = store.patch('alice', '1', {'title': 'Dune (1965)', 'notes': None, 'id': 'ignored'})
+    assert book == {'id': '1', 'title': 'Dune (1965)'}
+    assert store.search('alice', '1965', 10)[0] == [book]
+    assert store.patch('alice', 'missing', {'title': 'x'}) is None
+
+
+def test_import_replace_drops_other_books(store):
+    store.import_books('alice', [{'id': '1', 'title': 'Old'}, {'id': '2', 'title': 'Kept'}])
+    assert store.import_books('alice', [{'id': '2', 'title': 'Kept again'}], replace=True) == 1
+    books, _, total = store.list('alice', 10)
+    assert total == 1 and books[0]['title'] == 'Kept again'
+
+
+def test_failed_import_leaves_the_library_unchanged(store):
+    store.append('alice', {'id': '1', 'title': 'Dune'})
+    with pytest.raises(ValueError):
+        store.import_books('alice', [{'id': '2', 'title': 'Emma'}, 'not a book'], replace=True)
+    assert [book['id'] for book in store.list('alice', 10)[0]] == ['1']
+
+
+def test_export_streams_every_book(store, monkeypatch):
+    monkeypatch.setattr(LibraryStore, 'EXPORT_BATCH', 2)
+    store.import_books('alice', [{'id': str(i), 'title': f'Book {i}'} for i in range(5)])
+    assert [json.loads(data)['id'] for data in store.export('alice')] == ['0', '1', '2', '3', '4']
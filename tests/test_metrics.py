@@ -0,0 +1,58 @@
+import io
+
+from metrics import CountingWriter, Metrics
+
+
+def test_help_and_type_come_before_the_samples():
+    metrics = Metrics()
+    metrics.describe('proxy_requests_total', 'counter', 'Requests handled')
+    metrics.describe('proxy_in_flight', 'gauge', 'Requests being handled')
+    metrics.inc('proxy_requests_total', (('route', '/api/openai'), ('status', '200')))
+    metrics.inc('proxy_requests_total', (('route', '/api/openai'), ('status', '200')), 2)
+    metrics.set('proxy_in_flight', (), 3)
+    assert metrics.render() == (
+        '# HELP proxy_requests_total Requests handled\n'
+        '# TYPE proxy_requests_total counter\n'
+        'proxy_requests_total{route="/api/openai",status="200"} 3\n'
+        '# HELP proxy_in_flight Requests being handled\n'
+        '# TYPE proxy_in_flight gauge\n'
+        'proxy_in_flight 3\n'
+    )
+
+
+def test_family_without_samples_still_has_help_and_type():
+    metrics = Metrics()
+    metrics.describe('proxy_errors_total', 'counter', 'Errors')
+    assert metrics.render() == '# HELP proxy_errors_total Errors\n# TYPE proxy_errors_total counter\n'
+
+
+def test_histogram_buckets_are_cumulative():
+    metrics = Metrics()
+    metrics.describe('proxy_seconds', 'histogram', 'Latency', buckets=(0.1, 1, 10))
+    for value in (0.05, 0.1, 0.5, 20):
+        metrics.observe('proxy_seconds', (('route', '/'),), value)
+    lines = metrics.render().splitlines()
+    assert lines[2:] == [
+        'proxy_seconds_bucket{route="/",le="0.1"} 2',  # a value on a bound falls in that bucket
+        'proxy_seconds_bucket{route="/",le="1"} 3',
+        'proxy_seconds_bucket{route="/",le="10"} 3',
+        'proxy_seconds_bucket{route="/",le="+Inf"} 4',
+        'proxy_seconds_sum{route="/"} 20.65',
+        'proxy_seconds_count{route="/"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    metrics = Metrics()
+    metrics.describe('proxy_files_total', 'counter', 'Files')
+    metrics.inc('proxy_files_total', (('name', 'C:\\shelf "one"\nIMG.heic'),))
+    assert metrics.render().splitlines()[-1] == 'proxy_files_total{name="C:\\\\shelf \\"one\\"\\nIMG.heic"} 1'
+
+
+def test_counting_writer_counts_bytes():
+    raw = io.BytesIO()
+    writer = CountingWriter(raw)
+    writer.write(b'hello')
+    writer.write(b' world')
+    writer.flush()
+    assert writer.bytes_written == 11 and raw.getvalue() == b'hello world'
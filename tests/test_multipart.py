@@ -0,0 +1,114 @@
+import io
+import os
+
+import pytest
+
+from multipart import BoundedReader, RequestBodyError, SpooledUpload, parse_multipart
+
+BOUNDARY = 'testboundary123'
+CONTENT_TYPE = f'multipart/form-data; boundary={BOUNDARY}'
+
+
+def body(*parts, preamble=b''):
+    out = preamble
+    for headers, data in parts:
+        out += f'--{BOUNDARY}\r\n{headers}\r\n\r\n'.encode() + data + b'\r\n'
+    return out + f'--{BOUNDARY}--\r\n'.encode()
+
+
+def field(name, value):
+    return f'Content-Disposition: form-data; name="{name}"', value
+
+
+def file_part(name, filename, data, content_type='image/heic'):
+    return f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\nContent-Type: {content_type}', data
+
+
+class TrickleStream:
+    """Hands out a body a few bytes at a time, so boundaries land across reads"""
+
+    def __init__(self, data, step):
+        self.data = data
+        self.step = step
+
+    def read(self, size=-1):
+        chunk, self.data = self.data[:self.step], self.data[self.step:]
+        return chunk
+
+
+def test_fields_and_files():
+    data = body(field('prompt', b'List the books'), file_part('image', 'shelf.heic', b'\x00\x01binary\r\n--not'))
+    with parse_multipart(io.BytesIO(data), CONTENT_TYPE) as form:
+        assert form.getfirst('prompt') == 'List the books'
+        image = form.get('image')
+        assert image.filename == 'shelf.heic'
+        assert image.content_type == 'image/heic'
+        assert image.read() == b'\x00\x01binary\r\n--not'
+        assert form.getfirst('missing', 'default') == 'default'
+        assert 'image' in form and 'other' not in form
+
+
+@pytest.mark.parametrize('step', [1, 7, len(BOUNDARY) + 3])
+def test_boundaries_split_across_reads(step):
+    payload = bytes(range(256)) * 40
+    data = body(file_part('a', 'a.bin', payload), field('b', b'second'), preamble=b'ignored preamble\r\n')
+    with parse_multipart(TrickleStream(data, step), CONTENT_TYPE) as form:
+        assert form.get('a').read() == payload
+        assert form.getfirst('b') == 'second'
+
+
+def test_large_parts_are_spooled_to_disk_and_removed_on_close():
+    data = body(file_part('image', 'big.heic', b'x' * 5000), file_part('small', 's.heic', b'tiny'))
+    form = parse_multipart(io.BytesIO(data), CONTENT_TYPE, spool_threshold=1000)
+    big, small = form.get('image'), form.get('small')
+    assert big.path is not None and big.path.endswith('.heic') and os.path.getsize(big.path) == 5000
+    assert big.source() == big.path
+    assert small.path is None and small.source() == b'tiny'
+    form.close()
+    assert not os.path.exists(big.path or '') and big.path is None
+
+
+def test_file_over_the_limit_is_413():
+    data = body(file_part('image', 'big.heic', b'x' * 2000))
+    with pytest.raises(RequestBodyError) as error:
+        parse_multipart(io.BytesIO(data), CONTENT_TYPE, max_part_size=1000)
+    assert error.value.status == 413
+
+
+def test_too_many_parts():
+    data = body(*[field(f'f{i}', b'v') for i in range(4)])
+    with pytest.raises(RequestBodyError) as error:
+        parse_multipart(io.BytesIO(data), CONTENT_TYPE, max_parts=3)
+    assert error.value.status == 400
+
+
+@pytest.mark.parametrize('content_type', ['multipart/form-data', 'application/json; boundary=x', ''])
+def test_content_type_needs_a_boundary(content_type):
+    with pytest.raises(RequestBodyError):
+        parse_multipart(io.BytesIO(body(field('a', b'1'))), content_type)
+
+
+def test_truncated_body_is_an_error_and_cleans_up(monkeypatch):
+    created = []
+    original_write = SpooledUpload.write
+    def write(self, data):
+        original_write(self, data)
+        if self.path and self.path not in created:
+            created.append(self.path)
+    monkeypatch.setattr(SpooledUpload, 'write', write)
+
+    data = body(file_part('image', 'big.heic', b'x' * 5000))[:-40]
+    with pytest.raises(RequestBodyError):
+        parse_multipart(io.BytesIO(data), CONTENT_TYPE, spool_threshold=100)
+    assert created and not any(os.path.exists(path) for path in created)
+
+
+def test_bounded_reader_stops_at_the_length_and_detects_early_end():
+    reader = BoundedReader(io.BytesIO(b'abcdefNEXT-REQUEST'), 6)
+    assert reader.read() == b'abcdef'
+    assert reader.read() == b''
+    short = BoundedReader(io.BytesIO(b'abc'), 10)
+    assert short.read(3) == b'abc'
+    with pytest.raises(RequestBodyError) as error:
+        short.read()
+    assert error.value.status == 400
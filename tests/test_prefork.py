@@ -0,0 +1,91 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from conftest import ROOT
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork') or not os.path.isdir('/proc'),
+                                reason="prefork mode and the process checks need Linux")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def session_processes(sid):
+    """pid -> parent pid of every live process in a session"""
+    processes = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+        except OSError:
+            continue
+        # fields[0] is the state, then ppid, pgrp, session
+        if fields[0] != 'Z' and int(fields[3]) == sid:
+            processes[int(entry)] = int(fields[1])
+    return processes
+
+
+def orphans(master):
+    """Processes of the server's session that are no longer descendants of the master"""
+    processes = session_processes(master)
+    def descends(pid):
+        while pid in processes and pid != master:
+            pid = processes[pid]
+        return pid == master
+    return sorted(pid for pid in processes if not descends(pid))
+
+
+def wait_until(predicate, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.2)
+    return predicate()
+
+
+def test_reload_and_stop_leave_no_processes_behind(tmp_path):
+    port = free_port()
+    env = dict(os.environ, PROXY_SERVER_MODE='prefork', PROXY_PORT=str(port), PROXY_PROCESSES='2',
+               HEIC_WORKERS='2', PROXY_GRACEFUL_TIMEOUT='5', PROXY_DATA_DIR=str(tmp_path))
+    log = open(tmp_path / 'server.log', 'w')
+    master = subprocess.Popen([sys.executable, os.path.join(ROOT, 'proxy-server.py')], cwd=ROOT, env=env,
+                              stdout=log, stderr=subprocess.STDOUT, start_new_session=True)
+    try:
+        def serving():
+            try:
+                return urllib.request.urlopen(f'http://127.0.0.1:{port}/api/stats', timeout=2).status == 200
+            except OSError:
+                return False
+        assert wait_until(serving), (tmp_path / 'server.log').read_text()
+        # Each worker runs a HEIC pool, so it has children of its own
+        assert wait_until(lambda: len(session_processes(master.pid)) > 3)
+
+        master.send_signal(signal.SIGHUP)
+        assert wait_until(lambda: (tmp_path / 'server.log').read_text().count('ready') >= 4)
+        time.sleep(2)
+        assert serving()
+        assert orphans(master.pid) == []
+
+        master.send_signal(signal.SIGTERM)
+        master.wait(timeout=30)
+        assert wait_until(lambda: session_processes(master.pid) == {}, timeout=10), session_processes(master.pid)
+    finally:
+        if master.poll() is None:
+            master.kill()
+            master.wait()
+        for pid in session_processes(master.pid):
+            os.kill(pid, signal.SIGKILL)
+        log.close()
@@ -0,0 +1,96 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import RequestExpiredError, TokenBucket, UpstreamBusyError, UpstreamScheduler
+
+
+def test_token_bucket_waits_for_refill():
+    bucket = TokenBucket(60)  # one a second
+    now = time.monotonic()
+    assert bucket.wait_time(60, now) == 0
+    bucket.take(60, now)
+    assert bucket.wait_time(1, now) == pytest.approx(1.0)
+    assert bucket.wait_time(1, now + 1) == pytest.approx(0.0)
+    # More than the capacity waits for a full bucket rather than forever
+    assert bucket.wait_time(1000, now) == pytest.approx(60.0)
+
+
+def test_token_bucket_trusts_the_upstreams_remaining_count():
+    bucket = TokenBucket(600)
+    now = time.monotonic()
+    bucket.limit_to(5, now)
+    assert bucket.level == 5
+    assert bucket.wait_time(10, now) > 0
+
+
+def test_disabled_bucket_never_waits():
+    bucket = TokenBucket(0)
+    bucket.take(100, time.monotonic())
+    assert bucket.wait_time(100, time.monotonic()) == 0
+
+
+def test_concurrency_cap_times_out():
+    scheduler = UpstreamScheduler(1)
+    scheduler.acquire(UpstreamScheduler.INTERACTIVE, 10)
+    with pytest.raises(UpstreamBusyError):
+        scheduler.acquire(UpstreamScheduler.INTERACTIVE, 10, timeout=0.1)
+    scheduler.release(10)
+    scheduler.acquire(UpstreamScheduler.INTERACTIVE, 10, timeout=0.1)
+    assert scheduler.stats()['admitted'] == 2
+
+
+def test_interactive_calls_go_before_queued_live_frames():
+    scheduler = UpstreamScheduler(1)
+    scheduler.acquire(UpstreamScheduler.INTERACTIVE, 1)
+    order = []
+    def wait_turn(priority, name):
+        scheduler.acquire(priority, 1, timeout=5)
+        order.append(name)
+        scheduler.release(1)
+
+    live = threading.Thread(target=wait_turn, args=(UpstreamScheduler.LIVE, 'live'))
+    live.start()
+    time.sleep(0.05)
+    interactive = threading.Thread(target=wait_turn, args=(UpstreamScheduler.INTERACTIVE, 'interactive'))
+    interactive.start()
+    time.sleep(0.05)
+    assert scheduler.stats()['waiting'] == {'interactive': 1, 'live': 1}
+    scheduler.release(1)
+    live.join()
+    interactive.join()
+    assert order == ['interactive', 'live']
+
+
+def test_expired_live_frames_are_dropped():
+    dropped = []
+    scheduler = UpstreamScheduler(1, on_drop=dropped.append)
+    scheduler.acquire(UpstreamScheduler.INTERACTIVE, 1)
+    with pytest.raises(RequestExpiredError):
+        scheduler.acquire(UpstreamScheduler.LIVE, 1, deadline=time.monotonic() + 0.1)
+    assert dropped == ['live']
+    assert scheduler.stats()['droppedStale'] == 1
+    assert scheduler.stats()['waiting'] == {'interactive': 0, 'live': 0}
+
+
+def test_cool_down_holds_calls_back():
+    scheduler = UpstreamScheduler(4)
+    scheduler.cool_down(0.3)
+    started = time.monotonic()
+    scheduler.acquire(UpstreamScheduler.INTERACTIVE, 1, timeout=2)
+    assert time.monotonic() - started >= 0.25
+    assert scheduler.stats()['rateLimitCooldowns'] == 1
+
+
+def test_release_corrects_the_token_estimate():
+    scheduler = UpstreamScheduler(4, tpm=6000)
+    scheduler.acquire(UpstreamScheduler.INTERACTIVE, 1000)
+    scheduler.release(1000, used_tokens=3000)
+    assert scheduler.tokens.level == pytest.approx(3000, abs=5)
+
+
+def test_share_scales_the_budgets():
+    scheduler = UpstreamScheduler(4, rpm=600, tpm=6000, share=0.5)
+    assert scheduler.requests.capacity == 300
+    assert scheduler.tokens.capacity == 3000
@@ -0,0 +1,64 @@
+import base64
+import http.client
+import io
+import json
+
+import pytest
+from PIL import Image
+
+
+def image_data_url():
+    buffer = io.BytesIO()
+    Image.new('RGB', (40, 30), 'white').save(buffer, 'JPEG')
+    return 'data:image/jpeg;base64,' + base64.b64encode(buffer.getvalue()).decode()
+
+
+def post_scan(port, body):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.request('POST', '/api/scan-shelf', json.dumps(body), {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read())
+    connection.close()
+    return result
+
+
+@pytest.mark.parametrize('field, value', [
+    ('sectionsX', 'abc'),
+    ('sectionsX', 0),
+    ('sectionsX', 2.5),
+    ('sectionsY', None),
+    ('sectionsY', 10_000),
+    ('overlap', 'x'),
+    ('overlap', 0.9),
+    ('overlap', -0.1),
+    ('max_tokens', 'abc'),
+    ('max_tokens', 0),
+    ('max_tokens', True),
+])
+def test_bad_parameters_are_rejected(proxy, proxy_port, monkeypatch, field, value):
+    monkeypatch.setattr(proxy, 'OPENAI_API_KEY', 'test-key')
+    status, body = post_scan(proxy_port, {'imageDataUrl': image_data_url(), field: value})
+    assert status == 400
+    assert body['success'] is False
+    assert field in body['error']
+
+
+def test_grid_larger_than_the_cap_is_rejected(proxy, proxy_port, monkeypatch):
+    monkeypatch.setattr(proxy, 'OPENAI_API_KEY', 'test-key')
+    side = proxy.SCAN_MAX_SECTIONS // 2 + 1
+    status, body = post_scan(proxy_port, {'imageDataUrl': image_data_url(), 'sectionsX': side, 'sectionsY': 2})
+    assert status == 400
+    assert 'sections' in body['error']
+
+
+def test_undecodable_image_is_rejected(proxy, proxy_port, monkeypatch):
+    monkeypatch.setattr(proxy, 'OPENAI_API_KEY', 'test-key')
+    data_url = 'data:image/jpeg;base64,' + base64.b64encode(b'not an image').decode()
+    status, body = post_scan(proxy_port, {'imageDataUrl': data_url})
+    assert status == 400
+    assert body['success'] is False
+
+
+def test_non_object_body_is_rejected(proxy_port):
+    status, body = post_scan(proxy_port, ['imageDataUrl'])
+    assert status == 400
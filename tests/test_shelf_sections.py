@@ -0,0 +1,66 @@
+from PIL import Image
+
+
+def test_tiles_cover_the_image_with_overlap(proxy):
+    boxes = proxy.tile_image(Image.new('RGB', (1000, 800)), 5, 4, 0.5)
+    assert len(boxes) == 20
+    # 200x200 cells widened by 100 pixels on each side, clamped at the edges
+    assert boxes[0] == (0, 0, 300, 300)
+    assert boxes[6] == (100, 100, 500, 500)
+    assert boxes[-1] == (700, 500, 1000, 800)
+    assert all(0 <= left < right <= 1000 and 0 <= top < bottom <= 800 for left, top, right, bottom in boxes)
+
+
+def test_tiles_without_overlap_partition_the_image(proxy):
+    boxes = proxy.tile_image(Image.new('RGB', (90, 60)), 3, 2, 0)
+    assert boxes == [(0, 0, 30, 30), (30, 0, 60, 30), (60, 0, 90, 30),
+                     (0, 30, 30, 60), (30, 30, 60, 60), (60, 30, 90, 60)]
+
+
+def test_single_tile_is_the_whole_image(proxy):
+    assert proxy.tile_image(Image.new('RGB', (64, 48)), 1, 1, 0.5) == [(0, 0, 64, 48)]
+
+
+def test_parse_strips_code_fences(proxy):
+    reply = '```json\n[{"title": " Dune ", "confidence": "high"}, {"title": "Emma"}]\n```'
+    assert proxy.parse_book_titles(reply) == [
+        {'title': 'Dune', 'confidence': 'high'},
+        {'title': 'Emma', 'confidence': 'medium'},
+    ]
+    assert proxy.parse_book_titles('```\n["Dune"]\n```') == [{'title': 'Dune', 'confidence': 'medium'}]
+
+
+def test_parse_finds_the_array_in_prose(proxy):
+    reply = 'Here are the books I can read:\n["Middlemarch", {"title": "Dune", "confidence": "low"}]\nHope it helps!'
+    assert proxy.parse_book_titles(reply) == [
+        {'title': 'Middlemarch', 'confidence': 'medium'},
+        {'title': 'Dune', 'confidence': 'low'},
+    ]
+
+
+def test_parse_drops_what_is_not_a_title(proxy):
+    assert proxy.parse_book_titles('[{"title": ""}, {"name": "Dune"}, 42, {"title": "Emma", "confidence": "sure"}]') \
+        == [{'title': 'Emma', 'confidence': 'medium'}]
+    assert proxy.parse_book_titles('{"title": "Dune"}') == []
+    assert proxy.parse_book_titles('I cannot see any books.') == []
+
+
+def test_merge_dedups_by_normalized_title(proxy):
+    merged = proxy.merge_section_titles([
+        (0, [{'title': 'The Hobbit', 'confidence': 'medium'}, {'title': 'Dune', 'confidence': 'low'}]),
+        (1, [{'title': 'the hobbit!', 'confidence': 'high'}, {'title': '...', 'confidence': 'high'}]),
+        (2, [{'title': 'THE  HOBBIT', 'confidence': 'low'}, {'title': 'Dune', 'confidence': 'low'}]),
+    ])
+    assert merged == [
+        # The most confident spelling wins and every section it was seen in is kept
+        {'title': 'the hobbit!', 'confidence': 'high', 'sections': [0, 1, 2]},
+        {'title': 'Dune', 'confidence': 'low', 'sections': [0, 2]},
+    ]
+
+
+def test_merge_orders_by_confidence(proxy):
+    merged = proxy.merge_section_titles([
+        (0, [{'title': 'Emma', 'confidence': 'low'}, {'title': 'Dune', 'confidence': 'medium'}]),
+        (1, [{'title': 'Ulysses', 'confidence': 'high'}]),
+    ])
+    assert [book['title'] for book in merged] == ['Ulysses', 'Dune', 'Emma']
@@ -0,0 +1,117 @@
+import threading
+import time
+
+import pytest
+
+from cache import SingleFlight
+
+
+def run_concurrently(count, target):
+    results = [None] * count
+    def worker(index):
+        try:
+            results[index] = target()
+        except Exception as e:
+            results[index] = e
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    calls = []
+    def slow():
+        calls.append(1)
+        time.sleep(0.2)
+        return 'answer'
+
+    results = run_concurrently(5, lambda: flights.do('key', slow))
+    assert len(calls) == 1
+    assert sorted(shared for _, shared in results) == [False, True, True, True, True]
+    assert {result for result, _ in results} == {'answer'}
+    assert flights.stats() == {'inFlight': 0, 'executed': 1, 'coalesced': 4}
+
+
+def test_different_keys_run_separately():
+    flights = SingleFlight()
+    assert flights.do('a', lambda: 1) == (1, False)
+    assert flights.do('b', lambda: 2) == (2, False)
+    # A finished call is not reused
+    assert flights.do('a', lambda: 3) == (3, False)
+
+
+def test_leader_error_reaches_every_waiter():
+    flights = SingleFlight()
+    def failing():
+        time.sleep(0.2)
+        raise ValueError('upstream down')
+
+    results = run_concurrently(3, lambda: flights.do('key', failing))
+    assert all(isinstance(result, ValueError) for result in results)
+    assert flights.stats()['executed'] == 1
+    with pytest.raises(ValueError):
+        flights.do('key', failing)
+
+
+def test_followers_get_the_leaders_state():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    def leader():
+        started.set()
+        release.wait()
+        return 'done'
+
+    thread = threading.Thread(target=flights.do, args=('key', leader), kwargs={'state': 'relay'})
+    thread.start()
+    started.wait()
+    # A follower returns at once with follow(state), without waiting for the leader
+    assert flights.do('key', lambda: 'unused', follow=lambda state: f'followed {state}') == ('followed relay', True)
+    release.set()
+    thread.join()
+
+
+def test_join_runs_before_the_follower_gets_the_state():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    joined = []
+    def leader():
+        started.set()
+        release.wait()
+        # The leader already sees the follower, whatever the follower has done since
+        return list(joined)
+
+    results = []
+    thread = threading.Thread(target=lambda: results.append(flights.do('key', leader, state='relay')))
+    thread.start()
+    started.wait()
+    assert flights.do('key', lambda: 'unused', follow=lambda state: 'following',
+                      join=lambda state: joined.append(state) or True) == ('following', True)
+    release.set()
+    thread.join()
+    assert results == [(['relay'], False)]
+
+
+def test_refused_join_starts_a_new_call():
+    flights = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    def leader():
+        started.set()
+        release.wait()
+        return 'abandoned'
+
+    thread = threading.Thread(target=flights.do, args=('key', leader), kwargs={'state': 'old'})
+    thread.start()
+    started.wait()
+    # The running call takes no more followers, so this caller leads a call of its own
+    assert flights.do('key', lambda: 'fresh', state='new', follow=lambda state: 'following',
+                      join=lambda state: state != 'old') == ('fresh', False)
+    release.set()
+    thread.join()
+    assert flights.stats() == {'inFlight': 0, 'executed': 2, 'coalesced': 0}
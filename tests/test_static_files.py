@@ -0,0 +1,113 @@
+import gzip
+import http.client
+import os
+
+import pytest
+
+from static_files import StaticFileCache, is_private_static_path
+
+SCRIPT = b'function shelf() { return "books"; }\n' * 64
+
+
+def get(port, path, **headers):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    connection.request('GET', path, headers=headers)
+    response = connection.getresponse()
+    result = response.status, dict(response.getheaders()), response.read()
+    connection.close()
+    return result
+
+
+@pytest.fixture
+def static_root(proxy, tmp_path, monkeypatch):
+    (tmp_path / 'app.js').write_bytes(SCRIPT)
+    (tmp_path / 'tiny.css').write_bytes(b'body { margin: 0 }\n')
+    monkeypatch.setattr(proxy, 'STATIC_FILES', StaticFileCache())
+    # The handler serves the current directory
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def test_private_static_paths(tmp_path):
+    root = str(tmp_path)
+    assert is_private_static_path(f"{root}/library.sqlite3-wal", root)
+    assert is_private_static_path(f"{root}/.git/config", root)
+    assert is_private_static_path(f"{root}/.env", root)
+    assert not is_private_static_path(f"{root}/index.html", root)
+    assert not is_private_static_path(f"{root}/assets/app.js", root)
+
+
+def test_only_large_text_files_are_compressed(tmp_path):
+    (tmp_path / 'app.js').write_bytes(SCRIPT)
+    (tmp_path / 'tiny.css').write_bytes(b'body { margin: 0 }\n')
+    (tmp_path / 'photo.jpg').write_bytes(os.urandom(4096))
+    cache = StaticFileCache()
+    assert gzip.decompress(cache.get(str(tmp_path / 'app.js')).encodings['gzip']) == SCRIPT
+    assert cache.get(str(tmp_path / 'tiny.css')).encodings == {}
+    assert cache.get(str(tmp_path / 'photo.jpg')).encodings == {}
+
+
+def test_entry_is_rebuilt_after_an_mtime_change(tmp_path):
+    path = tmp_path / 'app.js'
+    path.write_bytes(SCRIPT)
+    cache = StaticFileCache()
+    first = cache.get(str(path))
+    assert cache.get(str(path)) is first
+
+    # Same size, new mtime: only the stat tells the two apart
+    path.write_bytes(SCRIPT.upper())
+    os.utime(path, ns=(first.mtime_ns + 1_000_000_000, first.mtime_ns + 1_000_000_000))
+    second = cache.get(str(path))
+    assert second is not first
+    assert second.data == SCRIPT.upper()
+    assert second.etag != first.etag
+
+
+def test_large_files_are_not_held_in_memory(tmp_path):
+    path = tmp_path / 'app.js'
+    path.write_bytes(SCRIPT)
+    entry = StaticFileCache(max_cached_file=100).get(str(path))
+    assert entry.data is None and entry.encodings == {}
+
+
+def test_gzip_only_when_accepted(proxy_port, static_root):
+    status, headers, body = get(proxy_port, '/app.js', **{'Accept-Encoding': 'gzip, deflate'})
+    assert status == 200 and headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body) == SCRIPT
+    assert headers['Vary'] == 'Accept-Encoding'
+
+    for accept_encoding in ('identity', 'gzip;q=0'):
+        status, headers, body = get(proxy_port, '/app.js', **{'Accept-Encoding': accept_encoding})
+        assert status == 200 and 'Content-Encoding' not in headers
+        assert body == SCRIPT
+
+    # Too small to be worth compressing
+    status, headers, _ = get(proxy_port, '/tiny.css', **{'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in headers
+
+
+def test_matching_etag_gets_304(proxy_port, static_root):
+    _, headers, _ = get(proxy_port, '/app.js')
+    plain_etag = headers['ETag']
+    _, headers, _ = get(proxy_port, '/app.js', **{'Accept-Encoding': 'gzip'})
+    gzip_etag = headers['ETag']
+    assert gzip_etag != plain_etag
+
+    status, headers, body = get(proxy_port, '/app.js', **{'If-None-Match': plain_etag})
+    assert status == 304 and body == b''
+    # Any variant's ETag validates the file
+    status, _, _ = get(proxy_port, '/app.js', **{'If-None-Match': f'W/{gzip_etag}', 'Accept-Encoding': 'gzip'})
+    assert status == 304
+    status, _, _ = get(proxy_port, '/app.js', **{'If-None-Match': '"stale"'})
+    assert status == 200
+
+
+def test_changed_file_no_longer_matches_its_old_etag(proxy_port, static_root):
+    _, headers, _ = get(proxy_port, '/app.js')
+    old_etag = headers['ETag']
+    path = static_root / 'app.js'
+    path.write_bytes(SCRIPT + b'// edited\n')
+
+    status, headers, body = get(proxy_port, '/app.js', **{'If-None-Match': old_etag})
+    assert status == 200 and body.endswith(b'// edited\n')
+    assert headers['ETag'] != old_etag
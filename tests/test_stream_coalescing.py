@@ -0,0 +1,118 @@
+import http.client
+import http.server
+import json
+import socket
+import struct
+import threading
+import time
+
+import pytest
+
+EVENTS = [{'id': 'chatcmpl-1', 'model': 'gpt-4o', 'choices': [{'index': 0, 'delta': {'content': word}}]}
+          for word in ('Dune ', 'by ', 'Frank ', 'Herbert')]
+
+
+class MockOpenAI(http.server.BaseHTTPRequestHandler):
+    calls = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        with MockOpenAI.lock:
+            MockOpenAI.calls += 1
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        time.sleep(0.3)  # long enough for every client to arrive while the stream is open
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        for event in EVENTS:
+            self.wfile.write(b'data: ' + json.dumps(event).encode() + b'\n\n')
+            self.wfile.flush()
+            time.sleep(0.05)
+        self.wfile.write(b'data: [DONE]\n\n')
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def proxy_server(proxy, monkeypatch):
+    upstream = http.server.ThreadingHTTPServer(('127.0.0.1', 0), MockOpenAI)
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    monkeypatch.setattr(proxy, 'OPENAI_API_KEY', 'test-key')
+    monkeypatch.setattr(proxy, 'OPENAI_POOL', proxy.ConnectionPool(f'http://127.0.0.1:{upstream.server_port}/v1'))
+    MockOpenAI.calls = 0
+
+    server = proxy.ThreadPoolHTTPServer(('127.0.0.1', 0), proxy.ProxyHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+    upstream.shutdown()
+    upstream.server_close()
+
+
+def stream_request(port, prompt, results):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+    body = json.dumps({'model': 'gpt-4o', 'stream': True, 'messages': [{'role': 'user', 'content': prompt}]})
+    connection.request('POST', '/api/openai', body, {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    results.append((response.status, response.getheader('X-Cache'), response.read()))
+    connection.close()
+
+
+def test_identical_concurrent_streams_share_one_upstream_call(proxy_server):
+    results = []
+    prompt = f'coalesce {time.time()}'
+    threads = [threading.Thread(target=stream_request, args=(proxy_server, prompt, results)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    for thread in threads:
+        thread.join()
+
+    assert MockOpenAI.calls == 1
+    assert sorted(cache for _, cache, _ in results) == ['COALESCED', 'COALESCED', 'COALESCED', 'MISS']
+    bodies = {body for _, _, body in results}
+    assert len(bodies) == 1
+    body = bodies.pop()
+    assert b'Herbert' in body and body.endswith(b'data: [DONE]\n\n')
+
+
+def test_distinct_streams_are_not_coalesced(proxy_server):
+    results = []
+    threads = [threading.Thread(target=stream_request, args=(proxy_server, f'distinct {i} {time.time()}', results))
+               for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert MockOpenAI.calls == 2
+    assert all(status == 200 and cache == 'MISS' for status, cache, _ in results)
+
+
+def test_follower_joining_after_the_leader_disconnects_gets_the_whole_stream(proxy_server):
+    prompt = f'disconnect {time.time()}'
+    body = json.dumps({'model': 'gpt-4o', 'stream': True, 'messages': [{'role': 'user', 'content': prompt}]})
+    leader = socket.create_connection(('127.0.0.1', proxy_server), timeout=10)
+    leader.sendall(b'POST /api/openai HTTP/1.1\r\nHost: localhost\r\nContent-Type: application/json\r\n'
+                   b'Content-Length: %d\r\n\r\n%s' % (len(body), body.encode()))
+    assert leader.recv(1024).startswith(b'HTTP/1.1 200')
+    # Gone before the stream ends; followers arrive around the moment the leader notices
+    leader.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack('ii', 1, 0))
+    leader.close()
+
+    results = []
+    threads = [threading.Thread(target=stream_request, args=(proxy_server, prompt, results)) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.03)
+    for thread in threads:
+        thread.join()
+
+    # Each follower either joined the leader's stream or, once it was abandoned, started its own
+    assert len(results) == 4
+    for status, cache, body in results:
+        assert status == 200
+        assert b'Herbert' in body and body.endswith(b'data: [DONE]\n\n')
@@ -0,0 +1,27 @@
+from streaming import StreamRelay
+
+
+def test_abandon_is_refused_while_someone_follows():
+    relay = StreamRelay()
+    assert relay.attach()
+    assert not relay.abandon()
+    relay.detach()
+    assert relay.abandon()
+
+
+def test_attach_is_refused_after_abandon():
+    relay = StreamRelay()
+    assert relay.abandon()
+    assert not relay.attach()
+    assert relay.followers == 0
+
+
+def test_follower_replays_what_it_missed():
+    relay = StreamRelay()
+    relay.start(200)
+    relay.publish(b'one')
+    relay.publish(b'two')
+    relay.finish(complete=True)
+    assert relay.wait_start()[0] == 200
+    assert list(relay.chunks()) == [b'one', b'two']
+    assert relay.complete
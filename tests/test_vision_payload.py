@@ -0,0 +1,40 @@
+import base64
+import json
+import os
+
+import pytest
+
+PARAMS = {'model': 'gpt-4o', 'max_tokens': 500}
+PROMPT = 'List every "title" on this shelf — one per line.\n'
+
+
+@pytest.mark.parametrize('size', [0, 1, 2, 3 * 64 * 1024, 3 * 64 * 1024 * 2 + 1])
+def test_payload_round_trips(proxy, size):
+    image = os.urandom(size)
+    payload = json.loads(proxy.build_vision_payload(PARAMS, PROMPT, image, 'image/png'))
+    assert {key: value for key, value in payload.items() if key != 'messages'} == PARAMS
+    [message] = payload['messages']
+    assert message['role'] == 'user'
+    text, image_part = message['content']
+    assert text == {'type': 'text', 'text': PROMPT}
+    prefix, encoded = image_part['image_url']['url'].split(',', 1)
+    assert prefix == 'data:image/png;base64'
+    assert base64.b64decode(encoded, validate=True) == image
+
+
+def test_single_image_key_matches_the_json_request(proxy):
+    image = os.urandom(300 * 1024)
+    payload = json.loads(proxy.build_vision_payload(PARAMS, PROMPT, image, 'image/jpeg'))
+    assert proxy.single_image_cache_key(PARAMS, PROMPT, image) == proxy.vision_cache_key(payload)
+
+
+def test_key_ignores_the_image_label_but_not_the_content(proxy):
+    image = os.urandom(1024)
+    as_jpeg = json.loads(proxy.build_vision_payload(PARAMS, PROMPT, image, 'image/jpeg'))
+    as_png = json.loads(proxy.build_vision_payload(PARAMS, PROMPT, image, 'image/png'))
+    assert proxy.vision_cache_key(as_jpeg) == proxy.vision_cache_key(as_png)
+
+    key = proxy.single_image_cache_key(PARAMS, PROMPT, image)
+    assert proxy.single_image_cache_key(PARAMS, PROMPT + ' ', image) != key
+    assert proxy.single_image_cache_key({**PARAMS, 'max_tokens': 400}, PROMPT, image) != key
+    assert proxy.single_image_cache_key(PARAMS, PROMPT, image[:-1]) != key